@@ -7,14 +7,21 @@ import logging
 import sys
 import subprocess
 import smtplib
-import tempfile
 import base64
 import functools
 import io
 import csv
 import os
+import re
+import struct
+import hashlib
+import time
+import queue
+import threading
+import itertools
 from collections import defaultdict
 
+import numpy as np
 from validate_email_address import validate_email
 import bottle
 from bottle import request
@@ -24,15 +31,53 @@ import db
 import db_object
 import auth
 
-from constants import C,E,__version__,POST,GET_POST,MIME
+from constants import C,E,__version__,GET,POST,GET_POST,MIME
 import mailer
 import tracker
+import gravitropism
+import frame_cache
+import progress
+import jobqueue
+import paths
+import dbpool
 
 api = bottle.Bottle()
 
 DEMO_MODE = os.environ.get('PLANTTRACER_DEMO',' ')[0:1] in 'yYtT1'
 print("DEMO_MODE = ",DEMO_MODE)
 
+# If set, every frame of an uploaded movie is decoded and stored in movie_frames by a background task
+PREEXTRACT_FRAMES = os.environ.get('PLANTTRACER_PREEXTRACT_FRAMES',' ')[0:1] in 'yYtT1'
+
+# Number of processes that decode frames while a movie is tracked; 0 or 1 decodes in the tracking process
+TRACK_WORKERS = int(os.environ.get('PLANTTRACER_TRACK_WORKERS','0') or 0)
+
+# Tracked frames waiting to be encoded and stored. When it is full, tracking waits for the writer.
+FRAME_WRITER_QUEUE_SIZE = 64
+
+# The URL of a frame served by /api/frame includes the SHA256 of its JPEG, so it never changes.
+# Frames are only sent to users who may access the movie, so they are private to the browser.
+FRAME_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+SHA256_RE = re.compile('[0-9a-f]{64}')
+
+# /api/get-frames returns at most this many frames, which keeps a response well under Lambda's 6MB limit
+GET_FRAMES_MAX = 32
+GET_FRAMES_HEADER_LENGTH = struct.Struct('>I')  # the response starts with the length of its JSON header
+
+# Trackpoint exports are streamed in chunks of about this many characters
+EXPORT_CHUNK_SIZE = 64*1024
+
+# Tracking progress. MovieTrackCallback posts to progress.board at most every PROGRESS_UPDATE_INTERVAL seconds,
+# and /api/movie-status-events sends each change to the browser as a server-sent event.
+PROGRESS_UPDATE_INTERVAL = 0.5
+SSE_MAX_SECONDS = 25            # then the connection is closed and the browser reconnects; API Gateway times out at 29
+SSE_DB_INTERVAL = C.NOTIFY_UPDATE_INTERVAL  # how often to read the status when the movie is tracked in another process
+SSE_RETRY_MSEC = 1000           # how long the browser waits before reconnecting
+# Lambda buffers the whole response, so there each connection returns after one event, like a long poll
+SSE_EVENTS_PER_CONNECTION = 1 if paths.running_in_aws_lambda() else None
+# After sending one of these, /api/movie-status-events returns, because the status will not change by itself
+TRACKING_FINAL_STATUSES = (C.TRACKING_COMPLETED, C.TRACKING_FAILED, C.TRACKING_CANCELLED)
+
 ################################################################
 ## Utility
 def expand_memfile_max():
@@ -113,14 +158,22 @@ def fix_types(obj):
     return json.loads(json.dumps(obj,default=str))
 
 
+USER_DICT_ENVIRON = 'planttracer.user_dict'   # request.environ key of (api_key, userdict) for this request
+
 def get_user_dict():
-    """Returns the user_id of the currently logged in user, or throws a response"""
+    """Returns the user_id of the currently logged in user, or throws a response.
+    The api_key is validated once per request; the result is kept in request.environ.
+    """
     api_key = auth.get_user_api_key()
     if api_key is None:
         logging.info("api_key is none")
         # This will redirect to the / and produce a "Session expired" message
         raise bottle.HTTPResponse(body='', status=301, headers={ 'Location': '/'})
-    userdict = db.validate_api_key(api_key)
+    (cached_api_key, userdict) = request.environ.get(USER_DICT_ENVIRON, (None, None))
+    if cached_api_key != api_key:
+        userdict = db.validate_api_key(api_key)
+        if userdict:
+            request.environ[USER_DICT_ENVIRON] = (api_key, userdict)
     if not userdict:
         logging.info("api_key %s is invalid  ipaddr=%s request.url=%s",
                      api_key,request.environ.get('REMOTE_ADDR'),request.url)
@@ -310,7 +363,7 @@ def api_new_movie():
             return {'error': True, 'message': f'Upload larger than larger than {C.MAX_FILE_UPLOAD} bytes.'}
 
         movie_data_sha256 = db_object.sha256(movie_data)
-        movie_metadata = tracker.extract_movie_metadata(movie_data=movie_data)
+        movie_metadata = tracker.extract_movie_metadata(movie_data=movie_data, movie_sha256=movie_data_sha256)
     ret = {'error':False}
 
     if movie_data_sha256:
@@ -330,6 +383,8 @@ def api_new_movie():
                                    movie_metadata = movie_metadata,
                                    movie_data_sha256 = movie_data_sha256,
                                    movie_data_urn = movie_data_urn )
+    if (movie_data is not None) and PREEXTRACT_FRAMES:
+        api_extract_movie_frames(movie_id=ret['movie_id'])
     return ret
 
 
@@ -359,9 +414,25 @@ def api_upload_movie():
                 f'movie_data_sha256={movie_data_sha256} but post.sha256={db_object.sha256(movie_data)}'}
     urn = db_object.make_urn(object_name=key, scheme=scheme)
     db_object.write_object(urn, movie_data)
+    if PREEXTRACT_FRAMES:
+        for movie_id in db.get_movie_ids_for_sha256(movie_sha256=movie_data_sha256):
+            api_extract_movie_frames(movie_id=movie_id)
     return {'error':False,'message':'Upload ok.'}
 
 
+@task
+def api_extract_movie_frames(*, movie_id):
+    """Decode every frame of a movie in a single sequential pass and store them as JPEGs in movie_frames,
+    so that the analyze page gets every frame out of the database without decoding the movie.
+    Runs in the background on Lambda; runs synchronously elsewhere.
+    """
+    movie_data = db.get_movie_data(movie_id=movie_id)
+    count = db.create_new_frames(movie_id=movie_id,
+                                 frames=tracker.extract_frames(movie_data=movie_data,
+                                                               movie_sha256=db_object.sha256(movie_data)))
+    logging.info("api_extract_movie_frames movie_id=%s frames=%s", movie_id, count)
+
+
 @api.route('/get-movie-data', method=GET_POST)
 def api_get_movie_data():
     """
@@ -407,48 +478,122 @@ def api_get_movie_metadata():
         return {'error':False, 'metadata':fix_types(metadata)}
     return E.INVALID_MOVIE_ACCESS
 
+################################################################
+## Streamed responses
+
+def flush_request_logs():
+    """On Lambda nothing runs between invocations (and atexit handlers may never run),
+    so write the logs and the api_key use counts before returning"""
+    if paths.running_in_aws_lambda():
+        db.flush_logs()
+        db.flush_api_key_usage()
+
+def flush_when_done(body):
+    """Yield from the generator body, then call flush_request_logs().
+    Bottle runs its after_request hooks before the server consumes a streamed body,
+    so the logs that are made while the body is produced would otherwise wait for the next invocation.
+    """
+    try:
+        yield from body
+    finally:
+        flush_request_logs()
+
 @api.route('/get-movie-trackpoints',method=GET_POST)
 def api_get_movie_trackpoints():
-    """Downloads the movie trackpoints as a CSV
+    """Downloads the movie trackpoints. The response is streamed as it is produced,
+    so memory does not grow with the length of the movie.
     :param api_key:   authentication
     :param movie_id:   movie
-    :param: format - 'xlsx' or 'json'
-    """
-    if db.can_access_movie(user_id=get_user_id(), movie_id=get_int('movie_id')):
-        # get_movie_trackpoints() returns a dictionary for each trackpoint.
-        # we want a dictionary for each frame_number
-        trackpoint_dicts = db.get_movie_trackpoints(movie_id=get_int('movie_id'))
-        frame_numbers  = sorted( set(( tp['frame_number'] for tp in trackpoint_dicts) ))
-        labels         = sorted( set(( tp['label'] for tp in trackpoint_dicts) ))
-        frame_dicts    = defaultdict(dict)
-
-        logging.debug("frame_numbers=%s",frame_numbers)
-        logging.debug("labels=%s",labels)
-
-        if get('format')=='json':
-            return fix_types({'error':'False',
-                              'trackpoint_dicts':trackpoint_dicts})
-
-        for tp in trackpoint_dicts:
-            frame_dicts[tp['frame_number']][tp['label']+' x'] = tp['x']
-            frame_dicts[tp['frame_number']][tp['label']+' y'] = tp['y']
-
-        fieldnames = ['frame_number']
-        for label in labels:
-            fieldnames.append(label+' x')
-            fieldnames.append(label+' y')
-        logging.debug("fieldnames=%s",fieldnames)
-
-        # Now write it out with the dictwriter
-        with io.StringIO() as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='', extrasaction='ignore')
-            writer.writeheader()
-            for frame in frame_numbers:
-                frame_dicts[frame]['frame_number'] = frame
-                writer.writerow(frame_dicts[frame])
-            bottle.response.set_header('Content-Type', 'text/csv')
-            return f.getvalue()
-    return E.INVALID_MOVIE_ACCESS
+    :param: format - 'csv' (default) - a row for each frame, with an x and y column for each label;
+                     'json' - {'error':'False', 'trackpoint_dicts':[...]};
+                     'columns' - binary columns for analysis tools (see trackpoints_columns)
+    """
+    movie_id = get_int('movie_id')
+    if not db.can_access_movie(user_id=get_user_id(), movie_id=movie_id):
+        return E.INVALID_MOVIE_ACCESS
+    fmt = get('format','csv')
+    if fmt=='json':
+        bottle.response.set_header('Content-Type', MIME.JSON)
+        return flush_when_done(trackpoints_json(db.iter_movie_trackpoints(movie_id=movie_id)))
+    if fmt=='columns':
+        bottle.response.set_header('Content-Type', MIME.OCTET_STREAM)
+        return flush_when_done(trackpoints_columns(db.get_movie_trajectory_arrays(movie_id=movie_id)))
+    bottle.response.set_header('Content-Type', MIME.CSV)
+    return flush_when_done(trackpoints_csv(labels=db.get_movie_trackpoint_labels(movie_id=movie_id),
+                                           trackpoints=db.iter_movie_trackpoints(movie_id=movie_id)))
+
+def trackpoints_csv(*, labels, trackpoints):
+    """Generator for the CSV export: a header, then a row for each frame that has trackpoints.
+    :param: labels - the labels, in column order
+    :param: trackpoints - iterable of trackpoint dicts, ordered by frame_number
+    :return: yields the CSV in chunks of about EXPORT_CHUNK_SIZE characters
+    """
+    column = {label:i for (i, label) in enumerate(labels)}
+    with io.StringIO() as f:
+        writer = csv.writer(f)
+        writer.writerow(['frame_number'] + [f"{label} {axis}" for label in labels for axis in ('x','y')])
+        for (frame_number, tps) in itertools.groupby(trackpoints, key=lambda tp: tp['frame_number']):
+            row = [frame_number] + ['']*(2*len(labels))
+            for tp in tps:
+                if tp['label'] in column:
+                    row[1+2*column[tp['label']]] = tp['x']
+                    row[2+2*column[tp['label']]] = tp['y']
+            writer.writerow(row)
+            if f.tell() >= EXPORT_CHUNK_SIZE:
+                yield f.getvalue()
+                f.seek(0)
+                f.truncate()
+        yield f.getvalue()
+
+def trackpoints_json(trackpoints):
+    """Generator for the JSON export.
+    :param: trackpoints - iterable of trackpoint dicts
+    :return: yields the JSON in chunks of about EXPORT_CHUNK_SIZE characters
+    """
+    chunk = '{"error": "False", "trackpoint_dicts": ['
+    sep = ''
+    for tp in trackpoints:
+        chunk += sep + json.dumps(tp, default=str)
+        sep = ', '
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = ''
+    yield chunk + ']}'
+
+def trackpoints_columns(trajectory):
+    """Generator for the binary columnar export. The framing is the same as /api/get-frames: a 4-byte big-endian
+    length, a JSON header with the labels, frame_count, dtype and column names, then each column in turn.
+    Column 'L x' and 'L y' hold the x and y of label L for frames 0..frame_count-1 as little-endian float32,
+    NaN where the label has no trackpoint. See parse_columns() in tests/tracker_test.py.
+    :param: trajectory - dictionary with 'labels' and 'points' (see db.get_movie_trajectory)
+    """
+    (labels, points) = (trajectory['labels'], trajectory['points'])
+    header = json.dumps({'labels': labels,
+                         'frame_count': len(points),
+                         'dtype': db.TRAJECTORY_DTYPE.str,
+                         'columns': [f"{label} {axis}" for label in labels for axis in ('x','y')]}).encode('utf-8')
+    yield GET_FRAMES_HEADER_LENGTH.pack(len(header)) + header
+    for i in range(len(labels)):
+        for axis in (0, 1):
+            yield np.ascontiguousarray(points[:, i, axis], dtype=db.TRAJECTORY_DTYPE).tobytes()
+
+@api.route('/get-movie-track',method=GET_POST)
+def api_get_movie_track():
+    """Downloads the movie trackpoints as a WebVTT metadata track, so that a player can draw them over the original movie.
+    See tracker.trackpoints_to_webvtt().
+    :param api_key:   authentication
+    :param movie_id:   movie
+    """
+    user_id  = get_user_id()
+    movie_id = get_int('movie_id')
+    if not db.can_access_movie(user_id=user_id, movie_id=movie_id):
+        return E.INVALID_MOVIE_ACCESS
+    fps = db.get_movie_metadata(user_id=user_id, movie_id=movie_id)[0]['fps']
+    if not fps:
+        fps = tracker.extract_movie_metadata(movie_data=db.get_movie_data(movie_id=movie_id),
+                                             movie_sha256=db.get_movie_sha256(movie_id=movie_id))['fps']
+    bottle.response.set_header('Content-Type', MIME.VTT)
+    return flush_when_done(tracker.trackpoints_to_webvtt(db.get_movie_trackpoints(movie_id=movie_id), fps=float(fps)))
 
 
 @api.route('/delete-movie', method=POST)
@@ -470,35 +615,92 @@ def api_list_movies():
     return {'error': False, 'movies': fix_types(db.list_movies(user_id=get_user_id()))}
 
 
-# pylint: disable=too-few-public-methods
 class MovieTrackCallback:
-    """Service class to create a callback instance to update the movie status"""
-    def __init__(self, *, user_id, movie_id):
+    """Service class to create a callback instance to update the movie status.
+    The status is posted to progress.board at most every PROGRESS_UPDATE_INTERVAL seconds,
+    and written to the database at most every C.NOTIFY_UPDATE_INTERVAL seconds. Frames are JPEG-encoded and stored
+    in batches by a background thread, so tracking does not wait for the database. Frames in stored_frames,
+    whose images are already in the database, are not encoded again.
+    """
+    def __init__(self, *, user_id, movie_id, cancelled=None, stored_frames=None):
         self.user_id = user_id
         self.movie_id = movie_id
+        self.cancelled = cancelled      # threading.Event set when a queued tracking job is cancelled
+        self.stored_frames = stored_frames or set()  # frame numbers whose JPEGs are already in movie_frames
         self.movie_metadata = None
+        self.last_status = 0
+        self.last_progress = 0
+        self.error = None
+        self.frames = queue.Queue(maxsize=FRAME_WRITER_QUEUE_SIZE)
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
 
     def notify(self, *, frame_number, frame, output_trackpoints): # pylint: disable=unused-argument
-        """Update the status and write the frame to the database.
+        """Update the status and queue the frame to be written to the database.
         We only track frames 1..(total_frames-1).
         If there are 296 frames, they are numbered 0 to 295.
         We actually track frames 1 through 295. We add 1 to make the status look correct.
         """
+        if self.cancelled is not None and self.cancelled.is_set():
+            db.set_movie_status(movie_id=self.movie_id, status=C.TRACKING_CANCELLED)
+            raise jobqueue.JobCancelled(f"tracking movie {self.movie_id}")
         total_frames = self.movie_metadata['total_frames']
+        last_frame = frame_number+1 >= total_frames
+        now = time.time()
         message = f"Tracked frames {frame_number+1} of {total_frames}"
-
-        logging.debug("MovieTrackCallback %s",message)
-        db.set_metadata(user_id=self.user_id, set_movie_id=self.movie_id, prop='status', value=message)
-        db.create_new_frame(movie_id=self.movie_id, frame_number = frame_number,
-                            frame_data = tracker.convert_frame_to_jpeg(frame))
+        if now >= self.last_progress + PROGRESS_UPDATE_INTERVAL or last_frame:
+            progress.board.post(self.movie_id, status=message, total_frames=total_frames, frame_number=frame_number)
+            self.last_progress = now
+        if now >= self.last_status + C.NOTIFY_UPDATE_INTERVAL or last_frame:
+            logging.debug("MovieTrackCallback %s",message)
+            db.set_movie_status(movie_id=self.movie_id, status=message)
+            self.last_status = now
+        if frame_number not in self.stored_frames:
+            self.frames.put((frame_number, frame))
+
+    def write_frames(self):
+        """Runs in the writer thread until close() is called"""
+        def jpegs():
+            while (item := self.frames.get()) is not None:
+                (frame_number, frame) = item
+                yield (frame_number, tracker.convert_frame_to_jpeg(frame))
+        try:
+            db.create_new_frames(movie_id=self.movie_id, frames=jpegs())
+        except Exception as e:   # pylint: disable=broad-exception-caught
+            logging.error("MovieTrackCallback cannot write frames: %s",e)
+            self.error = e
+            while self.frames.get() is not None: # keep draining, so that notify() never blocks
+                pass
+
+    def close(self):
+        """Wait for the writer to store the queued frames.
+        :raises: the writer's exception, if it failed.
+        """
+        self.frames.put(None)
+        self.writer.join()
+        progress.board.finish(self.movie_id)   # from now on the status is in the database
+        if self.error is not None:
+            raise self.error
 
     def done(self):
         db.set_metadata(user_id=self.user_id, set_movie_id=self.movie_id, prop='status', value=C.TRACKING_COMPLETED)
 
 @task
 def api_track_movie(*,user_id, movie_id, engine_name, engine_version, frame_start):
+    """Track a movie with zappa's @task: in the background on Lambda, synchronously elsewhere.
+    See track_movie_job. There are no retries, so if tracking fails the movie's status says so.
+    """
+    try:
+        track_movie_job(user_id=user_id, movie_id=movie_id,
+                        engine_name=engine_name, engine_version=engine_version, frame_start=frame_start)
+    except Exception:
+        db.set_movie_status(movie_id=movie_id, status=C.TRACKING_FAILED)
+        raise
+
+def track_movie_job(*,user_id, movie_id, engine_name, engine_version, frame_start, cancelled=None):
     """Generate trackpoints for a movie based on initial trackpoints stored in the database at frame_start.
     Stores new trackpoints and each frame in the database. No longer renders new movie: that's now in render_tracked_movie
+    :param: cancelled - threading.Event that is set if the job is cancelled (see jobqueue)
     """
     # Find trackpoints we are tracking or retracking
     input_trackpoints = db.get_movie_trackpoints(movie_id=movie_id)
@@ -506,44 +708,62 @@ def api_track_movie(*,user_id, movie_id, engine_name, engine_version, frame_star
 
     # If there are no trackpoints, we just go through the motions...
 
-    # Write the movie to a tempfile, because OpenCV has to read movies from files.
-    mtc = MovieTrackCallback(user_id = user_id, movie_id = movie_id)
-    with tempfile.NamedTemporaryFile(suffix='.mp4',mode='wb') as infile:
-        movie_data     = db.get_movie_data(movie_id=movie_id)
-        movie_metadata = tracker.extract_movie_metadata(movie_data=movie_data)
-        infile.write( movie_data  )
-        infile.flush()
-
-        # While I'm here, update the movie metadata
-        for prop in ['fps','width','height','total_frames','total_bytes']:
-            if prop in movie_metadata:
-                db.set_metadata(user_id=user_id, set_movie_id=movie_id, prop=prop, value=movie_metadata[prop])
-
-
-        # Track (or retrack) the movie and create the tracked movie
-        # This creates an output file that has the trackpoints animated
-        # and an array of all the trackpoints
-        mtc.movie_metadata = db.get_movie_metadata(movie_id=movie_id, user_id=user_id)[0]
+    # OpenCV has to read movies from files. tracker.movie_file writes each movie once,
+    # named by its SHA256, so a retrack of the same movie reuses the file.
+    movie_data     = db.get_movie_data(movie_id=movie_id)
+    movie_sha256   = db.get_movie_sha256(movie_id=movie_id)
+    moviefile      = tracker.movie_file(movie_data=movie_data, movie_sha256=movie_sha256)
+    movie_metadata = tracker.MovieReader(moviefile=moviefile, movie_sha256=movie_sha256).metadata()
+
+    # While I'm here, update the movie metadata
+    for prop in ['fps','width','height','total_frames','total_bytes']:
+        if prop in movie_metadata:
+            db.set_metadata(user_id=user_id, set_movie_id=movie_id, prop=prop, value=movie_metadata[prop])
+
+    # Track (or retrack) the movie and create the tracked movie
+    # This creates an output file that has the trackpoints animated
+    # and an array of all the trackpoints
+    movie_metadata = db.get_movie_metadata(movie_id=movie_id, user_id=user_id)[0]
+    # Retracking is incremental: decoding seeks to frame_start, tracking stops when it converges with
+    # the stored trackpoints, and frames whose images are already stored are not encoded again.
+    mtc = MovieTrackCallback(user_id = user_id, movie_id = movie_id, cancelled = cancelled,
+                             stored_frames = db.get_stored_frame_numbers(movie_id=movie_id))
+    mtc.movie_metadata = movie_metadata
+    try:
         tracked = tracker.track_movie(engine_name=engine_name,
                                       engine_version=engine_version,
                                       input_trackpoints = input_trackpoints,
                                       frame_start      = frame_start,
-                                      moviefile_input  = infile.name,
-                                      callback = mtc.notify)
-
-    # Get new trackpoints for each frame and save them into the database
-    output_trackpoints   = tracked['output_trackpoints']
-    output_trackpoints_by_frame = defaultdict(list)
-    for tp in output_trackpoints:
-        output_trackpoints_by_frame[tp['frame_number']].append(tp)
-
-    # Write all of the trackpoints by frame that were re-tracked
-    for (frame_number,trackpoints) in output_trackpoints_by_frame.items():
-        if frame_number >= frame_start:
-            frame_id = db.create_new_frame(movie_id=movie_id, frame_number=frame_number)
-            db.put_frame_trackpoints(frame_id = frame_id,
-                                     trackpoints = trackpoints)
+                                      moviefile_input  = moviefile,
+                                      callback = mtc.notify,
+                                      output = 'arrays',
+                                      workers = TRACK_WORKERS,
+                                      movie_sha256 = movie_sha256,
+                                      converge_tolerance = tracker.TRACK_CONVERGE_TOLERANCE)
+    finally:
+        mtc.close()             # waits until all of the frames are stored
+
+    # Write the trackpoints of the frames that were re-tracked in one transaction.
+    # The frames after the last tracked frame already have the same trackpoints.
+    # Then store the whole trajectory, which is what get_movie_trackpoints reads.
+    if tracked['last_tracked_frame'] is not None:
+        db.put_movie_trackpoints(movie_id=movie_id,
+                                 trackpoints_by_frame=tracker.trackpoints_from_arrays(
+                                     labels=tracked['labels'],
+                                     points=tracked['points'][0:tracked['last_tracked_frame']+1],
+                                     frame_start=frame_start))
+        db.put_movie_trajectory(movie_id=movie_id, labels=tracked['labels'], points=tracked['points'])
     mtc.done()                  # sets the status to tracking complete
+    db.flush_logs()             # this may be the end of a Lambda invocation
+    db.flush_api_key_usage()
+
+def track_movie_failed(job, error, retrying):  # pylint: disable=unused-argument
+    """Show the user that a queued tracking job failed, and whether it will be tried again"""
+    db.set_movie_status(movie_id=job['movie_id'],
+                        status=C.TRACKING_RETRYING if retrying else C.TRACKING_FAILED)
+
+TRACK_MOVIE_JOB = 'track-movie'
+jobqueue.register_handler(TRACK_MOVIE_JOB, track_movie_job, on_fail=track_movie_failed)
 
 @api.route('/track-movie-queue', method=GET_POST)
 def api_track_movie_queue():
@@ -570,14 +790,109 @@ def api_track_movie_queue():
     if movie_row[0]['orig_movie'] is not None:
         return E.MUST_TRACK_ORIG_MOVIE
 
-    api_track_movie(user_id=user_id, movie_id=movie_id,
-                    engine_name=get('engine_name'),
-                    engine_version=get('engine_version'),
-                    frame_start=get_int('frame_start'))
+    # Check the engine now, rather than in the (possibly asynchronous) task
+    try:
+        engine = tracker.get_engine(engine_name=get('engine_name'), engine_version=get('engine_version'))
+    except RuntimeError:
+        return E.INVALID_ENGINE
+
+    # Set the status now, so that a status left by the last tracking of this movie is not mistaken for this one
+    db.set_movie_status(movie_id=movie_id, status=C.TRACKING_QUEUED)
+    args = {'user_id': user_id,
+            'movie_id': movie_id,
+            'engine_name': engine.name,
+            'engine_version': engine.version,
+            'frame_start': get_int('frame_start')}
+    if jobqueue.JOB_QUEUE:
+        # A worker process (python jobqueue.py --worker) will track the movie
+        job_id = jobqueue.enqueue(kind=TRACK_MOVIE_JOB, args=args, user_id=user_id, movie_id=movie_id)
+        return {'error': False, 'message':'Tracking is queued', 'job_id': job_id}
+    api_track_movie(**args)
 
     # We return all the trackpoints to the client, although the client currently doesn't use them
     return {'error': False, 'message':'Tracking is queued'}
 
+def get_accessible_job(user_id):
+    """Return the job in the job_id parameter if user_id can access its movie, otherwise None"""
+    job = jobqueue.get_job(job_id=get_int('job_id'))
+    if job is None or not db.can_access_movie(user_id=user_id, movie_id=job['movie_id']):
+        return None
+    return job
+
+@api.route('/get-job', method=GET_POST)
+def api_get_job():
+    """Return the status of a queued job.
+    :param api_key: the user's api_key
+    :param job_id: the job, as returned by /api/track-movie-queue
+    """
+    job = get_accessible_job(get_user_id(allow_demo=True))
+    if job is None:
+        return E.INVALID_JOB_ID
+    return {'error': False,
+            'job': {key: job[key] for key in ['id','kind','status','movie_id','attempts','max_attempts','error',
+                                              'created_at','started_at','finished_at']}}
+
+@api.route('/cancel-job', method=POST)
+def api_cancel_job():
+    """Cancel a queued or running job.
+    :param api_key: the user's api_key
+    :param job_id: the job, as returned by /api/track-movie-queue
+    """
+    job = get_accessible_job(get_user_id(allow_demo=False))
+    if job is None:
+        return E.INVALID_JOB_ID
+    if not jobqueue.cancel(job_id=job['id']):
+        return {'error': True, 'message': f"job {job['id']} is {job['status']} and cannot be cancelled"}
+    if job['movie_id'] is not None:
+        db.set_movie_status(movie_id=job['movie_id'], status=C.TRACKING_CANCELLED)
+    return {'error': False, 'message': f"job {job['id']} cancelled"}
+
+
+def movie_status_events(*, movie_id, last_status=None, max_seconds=SSE_MAX_SECONDS, max_events=SSE_EVENTS_PER_CONNECTION):
+    """Generator of server-sent events, one each time the status of movie_id changes.
+    If the movie is being tracked in this process, the status comes from progress.board and the database is not read.
+    Otherwise the status is read from the database every SSE_DB_INTERVAL seconds.
+    :param: last_status - the status the client already has, which is not sent again
+    :param: max_seconds - return after this long
+    :param: max_events - return after this many events; None for no limit
+    """
+    yield f"retry: {SSE_RETRY_MSEC}\n\n"
+    deadline = time.time() + max_seconds
+    events = 0
+    local = progress.board.get(movie_id)
+    while True:
+        status = local if local is not None else db.get_movie_status(movie_id=movie_id)
+        if status['status'] != last_status:
+            last_status = status['status']
+            # The id is the status, which the browser sends back as Last-Event-ID when it reconnects
+            event_id = str(last_status).replace('\n',' ')
+            yield f"id: {event_id}\ndata: {json.dumps(status)}\n\n"
+            events += 1
+            if last_status in TRACKING_FINAL_STATUSES or (max_events is not None and events >= max_events):
+                return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        local = progress.board.wait(movie_id, local, timeout=min(remaining, SSE_DB_INTERVAL))
+
+@api.route('/movie-status-events', method=GET)
+def api_movie_status_events():
+    """Server-sent events with the tracking status of a movie, replacing polling of /api/get-movie-metadata.
+    :param api_key: the user's api_key
+    :param movie_id: the movie
+    :return: text/event-stream. Each event's data is a JSON object with status and total_frames,
+             and frame_number if the movie is being tracked by this server.
+             The stream ends after one of TRACKING_FINAL_STATUSES or SSE_MAX_SECONDS; EventSource then reconnects.
+    """
+    user_id  = get_user_id(allow_demo=True)
+    movie_id = get_int('movie_id')
+    if not db.can_access_movie(user_id=user_id, movie_id=movie_id):
+        return E.INVALID_MOVIE_ACCESS
+    bottle.response.content_type = 'text/event-stream'
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    bottle.response.set_header('X-Accel-Buffering', 'no')
+    return flush_when_done(movie_status_events(movie_id=movie_id, last_status=request.headers.get('Last-Event-ID')))
+
 
 ##
 # Movie analysis API
@@ -601,6 +916,48 @@ def api_new_movie_analysis():
                                                      annotations=request.forms.get('annotations'))['movie_analysis_id']
     return {'error': False, 'movie_analysis_id': movie_analysis_id}
 
+@api.route('/get-movie-gravitropism', method=GET_POST)
+def api_get_movie_gravitropism():
+    """Analyzes the motion of every tracked point of a movie (see gravitropism.analyze_trajectory),
+    calibrated with the movie's ruler if it has one.
+    The results are cached in movie_analysis for each movie and version of the analysis,
+    and are recomputed when the trackpoints or the parameters change. A GET is served from the cache
+    but never writes it; only a POST stores what it computes.
+    :param api_key: the user's api_key
+    :param movie_id: the movie
+    :param seconds_per_frame: time between frames; defaults to 1/fps of the movie
+    :param smoothing: frames in the moving average of smoothed_rate
+    :return: dict['error'] = True/False
+             dict['analysis'] = the analysis
+    """
+    user_id  = get_user_id()
+    movie_id = get_int('movie_id')
+    if not db.can_access_movie(user_id=user_id, movie_id=movie_id):
+        return E.INVALID_MOVIE_ACCESS
+    seconds_per_frame = get_float('seconds_per_frame')
+    if seconds_per_frame is None:
+        fps = db.get_movie_metadata(user_id=user_id, movie_id=movie_id)[0]['fps']
+        seconds_per_frame = 1/float(fps) if fps else 1.0
+    smoothing = get_int('smoothing', gravitropism.SMOOTHING_FRAMES)
+    if seconds_per_frame <= 0 or smoothing < 1:
+        return E.CALC_RESULTS_PARAM_INVALID
+
+    trajectory = db.get_movie_trajectory_arrays(movie_id=movie_id)
+    h = hashlib.sha256(json.dumps(trajectory['labels']).encode('utf-8'))
+    h.update(np.ascontiguousarray(trajectory['points'], dtype=db.TRAJECTORY_DTYPE).tobytes())
+    key = {'trajectory_sha256': h.hexdigest(), 'seconds_per_frame': seconds_per_frame, 'smoothing': smoothing}
+    engine_id = db.get_analysis_engine_id(engine_name=gravitropism.GRAVITROPISM_ENGINE,
+                                          engine_version=gravitropism.GRAVITROPISM_VERSION)
+    cached = db.get_movie_analysis(movie_id=movie_id, engine_id=engine_id)
+    if cached is not None and cached.get('key')==key:
+        return {'error': False, 'analysis': cached['analysis']}
+
+    analysis = gravitropism.analyze_trajectory(labels=trajectory['labels'], points=trajectory['points'],
+                                               seconds_per_frame=seconds_per_frame, smoothing=smoothing)
+    if request.method == 'POST':
+        db.put_movie_analysis(movie_id=movie_id, engine_id=engine_id, annotations={'key': key, 'analysis': analysis})
+    return {'error': False, 'analysis': analysis}
+
 
 ################################################################
 ### Frame API
@@ -629,6 +986,68 @@ def api_new_frame():
     assert isinstance( frame_id, int)
     return {'error': False, 'frame_id': frame_id}
 
+def get_movie_frame_jpeg(*, movie_id, frame_number):
+    """Return the JPEG for frame_number of movie_id. The frame cache is consulted first,
+    so the movie is only downloaded and decoded on a miss.
+    :raises ValueError: if frame_number is out of range
+    """
+    movie_sha256 = db.get_movie_sha256(movie_id=movie_id)
+    if movie_sha256:
+        jpeg = frame_cache.cache.get(movie_sha256, frame_number)
+        if jpeg is not None:
+            return jpeg
+    # Frames may have been pre-extracted into the database
+    row = db.get_frame(movie_id=movie_id, frame_number=frame_number)
+    if row and row.get('frame_data'):
+        jpeg = row['frame_data']
+    else:
+        jpeg = tracker.extract_frame(movie_data = db.get_movie_data(movie_id = movie_id),
+                                     frame_number = frame_number,
+                                     fmt = 'jpeg',
+                                     movie_sha256 = movie_sha256)
+    if movie_sha256:
+        frame_cache.cache.put(movie_sha256, frame_number, jpeg)
+    return jpeg
+
+def jpeg_sha256(jpeg):
+    return hashlib.sha256(jpeg).hexdigest()
+
+def frame_url(movie_id, frame_number, frame_sha256):
+    """Content-addressed URL of a frame's JPEG, relative to where the API is mounted.
+    :param: frame_sha256 - SHA256 of the JPEG, so the URL changes if the frame is replaced (e.g. by /api/new-frame)
+    """
+    return f"{request.script_name}frame/{movie_id}/{frame_number}/{frame_sha256}.jpg"
+
+@api.route('/frame/<movie_id:int>/<frame_number:int>/<frame_sha256>.jpg', method=GET)
+def api_frame_jpeg(movie_id, frame_number, frame_sha256):
+    """Return the JPEG for a frame, if its SHA256 is frame_sha256 (see frame_url). The browser sends the api_key cookie.
+    The response for a URL never changes, so the browser may cache it forever without revalidating.
+    :return: 403 if the user may not access the movie; 404 if neither the decoded nor the stored frame is frame_sha256.
+    """
+    if not db.can_access_movie(user_id=get_user_id(allow_demo=True), movie_id=movie_id):
+        return bottle.HTTPResponse(status=403)
+    if not SHA256_RE.fullmatch(frame_sha256):
+        return bottle.HTTPResponse(status=404)
+    etag = f'"{frame_sha256}"'
+    headers = {'ETag': etag,
+               'Cache-Control': FRAME_CACHE_CONTROL}
+    inm = request.headers.get('If-None-Match','')
+    if inm.strip()=='*' or etag in [tag.strip() for tag in inm.split(',')]:
+        return bottle.HTTPResponse(status=304, headers=headers)
+    try:
+        jpeg = get_movie_frame_jpeg(movie_id=movie_id, frame_number=frame_number)
+    except ValueError:
+        return bottle.HTTPResponse(status=404)
+    if jpeg_sha256(jpeg) != frame_sha256:
+        # The frame cache is shared by every movie with the same content, so it holds the frame as decoded
+        # from the movie. This movie's stored frame may have replaced it (e.g. with /api/new-frame).
+        row = db.get_frame(movie_id=movie_id, frame_number=frame_number)
+        if not (row and row.get('frame_sha256')==frame_sha256 and row.get('frame_data')):
+            return bottle.HTTPResponse(status=404)
+        jpeg = row['frame_data']
+    headers['Content-Type'] = MIME.JPEG
+    return bottle.HTTPResponse(body=jpeg, status=200, headers=headers)
+
 def api_get_jpeg(*,frame_id=None, frame_number=None, movie_id=None):
     # is frame_id provided?
     if (frame_id is not None) and db.can_access_frame(user_id = get_user_id(), frame_id=frame_id):
@@ -637,9 +1056,7 @@ def api_get_jpeg(*,frame_id=None, frame_number=None, movie_id=None):
     # Is there a movie we can access?
     if frame_number is not None and db.can_access_movie(user_id = get_user_id(), movie_id=movie_id):
         try:
-            return tracker.extract_frame(movie_data = db.get_movie_data(movie_id = movie_id),
-                                         frame_number = frame_number,
-                                         fmt = 'jpeg')
+            return get_movie_frame_jpeg(movie_id = movie_id, frame_number = frame_number)
         except ValueError as e:
             return bottle.HTTPResponse(status=500, body=f"frame number {frame_number} out of range: "+e.args[0])
     logging.info("fmt=jpeg but INVALID_FRAME_ACCESS with frame_id=%s and frame_number=%s and movie_id=%s",frame_id,frame_number,movie_id)
@@ -666,6 +1083,7 @@ def api_get_frame():
       frame_id     - the id of the frame (always returned)
       frame_number - the number of the frame (always returned)
       last_tracked_frame - the frame number of the highest frame with trackpoints
+      frame_url   - URL of the frame's JPEG, which may be cached forever (see api_frame_jpeg)
       annotations - a JSON object of annotations from the databsae.
       trackpoints - a list of the trackpoints
     """
@@ -689,46 +1107,119 @@ def api_get_frame():
         bottle.response.set_header('Content-Type', MIME.JPEG)
         return api_get_jpeg(frame_id=frame_id, frame_number=frame_number, movie_id=movie_id)
 
-    # See if get_frame can find the movie frame
-    ret = db.get_frame(movie_id=movie_id, frame_id = frame_id, frame_number=frame_number)
-    if ret:
-        # Get any frame annotations and trackpoints
-        ret['annotations'] = db.get_frame_annotations(frame_id=ret['frame_id'])
-        ret['trackpoints'] = db.get_frame_trackpoints(frame_id=ret['frame_id'])
+    # Get the frame, its annotations and trackpoints, and the last tracked frame in one query.
+    # The JPEG is sent by URL, so the frame_data is not needed.
+    ret = db.get_frame_bundle(movie_id=movie_id, frame_id=frame_id, frame_number=frame_number, get_frame_data=False)
+    if ret is None:
+        return E.INVALID_FRAME_ID_DB
+    del ret['movie_sha256']
+    total_frames = ret.pop('total_frames')
+    frame_sha256 = ret.pop('frame_sha256')
+    del ret['frame_data']
+    if ret['frame_number'] < 0 or (total_frames is not None and ret['frame_number'] >= total_frames):
+        return {'error':True,
+                'message':f'frame number {frame_number} is out of range'}
 
-    else:
-        # the frame is not in the database, so we need to make it
-        if frame_id is not None:
-            return E.INVALID_FRAME_ID_DB
-        frame_id = db.create_new_frame(movie_id = movie_id, frame_number = frame_number)
-        ret = {'movie_id':movie_id,
-               'frame_id':frame_id,
-               'frame_number':frame_number}
-
-    # If we do not have frame_data, extract it from the movie (but don't store in database)
-    if ret.get('frame_data',None) is None:
-        logging.debug('no frame_data provided. extracting movie_id=%s frame_number=%s',movie_id,frame_number)
+    if frame_sha256 is None:
+        # The frame is not stored, so its URL needs the SHA256 of the JPEG decoded from the movie.
+        # Decoding it now also makes sure that it can be decoded, and puts it in the frame cache for the URL.
         try:
-            ret['frame_data'] = tracker.extract_frame(movie_data=db.get_movie_data(movie_id=movie_id),
-                                                      frame_number=frame_number,
-                                                      fmt='jpeg')
+            frame_sha256 = jpeg_sha256(get_movie_frame_jpeg(movie_id=ret['movie_id'], frame_number=ret['frame_number']))
         except ValueError:
             return {'error':True,
                     'message':f'frame number {frame_number} is out of range'}
 
-    # Convert the frame_data to a data URL
-    ret['data_url'] = f'data:image/jpeg;base64,{base64.b64encode(ret["frame_data"]).decode()}'
-    del ret['frame_data']
+    if ret['frame_id'] is None:
+        # the frame is not in the database, so we need to make it
+        ret['frame_id'] = db.create_new_frame(movie_id = ret['movie_id'], frame_number = ret['frame_number'])
 
-    ret['last_tracked_frame'] = db.last_tracked_frame(movie_id = movie_id)
+    ret['frame_url'] = frame_url(ret['movie_id'], ret['frame_number'], frame_sha256)
     ret['error'] = False
-    #
-    # Need to convert all datetimes to strings.
-    # We then return the dictionary, which bottle runs json.dumps() on
-    # and returns MIME type of "application/json"
+
+    # Everything in the bundle is already a JSON type (the aggregates were decoded by get_frame_bundle),
+    # so bottle encodes it once and there is no need for the fix_types() round trip.
     # JQuery will then automatically decode this JSON into a JavaScript object,
     # without having to call JSON.parse()
-    return fix_types(ret)
+    return ret
+
+@api.route('/get-frames', method=GET_POST)
+def api_get_frames():
+    """
+    Get a range of frames and their trackpoints in one response, so that the player can fetch ahead.
+    The JPEGs that are not in the frame cache are decoded in a single sequential pass through the movie.
+
+    :param api_key:      authentication
+    :param movie_id:     movie
+    :param frame_start:  first frame (default 0)
+    :param frame_end:    last frame, inclusive. At most GET_FRAMES_MAX frames are returned.
+    :param frame_stride: return every frame_stride'th frame (default 1)
+
+    :return: a JSON object if there is an error. Otherwise a binary stream of:
+      - the length of the header, as a 32-bit big-endian unsigned integer
+      - the header, a UTF-8 JSON object with:
+        error              = false
+        movie_id           - the movie
+        last_tracked_frame - the frame number of the highest frame with trackpoints
+        frames             - a list of {frame_number, frame_id, annotations, trackpoints, jpeg_offset, jpeg_length},
+                             as from /api/get-frame, where jpeg_offset counts from the first byte after the header.
+                             Frames past the end of the movie are omitted.
+      - the JPEGs, concatenated
+    """
+    user_id      = get_user_id(allow_demo=True)
+    movie_id     = get_int('movie_id')
+    frame_start  = get_int('frame_start', 0)
+    frame_stride = get_int('frame_stride', 1)
+    frame_end    = get_int('frame_end', frame_start + frame_stride*(GET_FRAMES_MAX-1))
+    if not db.can_access_movie(user_id=user_id, movie_id=movie_id):
+        return E.INVALID_MOVIE_ACCESS
+    if frame_start < 0 or frame_stride < 1 or frame_end < frame_start:
+        return {'error':True, 'message':f'invalid frame range {frame_start}..{frame_end} stride {frame_stride}'}
+    # Slicing the range (rather than a list of it) does not build the whole range the client asked for
+    frame_numbers = list(range(frame_start, frame_end+1, frame_stride)[0:GET_FRAMES_MAX])
+
+    movie_sha256 = db.get_movie_sha256(movie_id=movie_id)
+    jpegs = {}
+    if movie_sha256:
+        for frame_number in frame_numbers:
+            jpeg = frame_cache.cache.get(movie_sha256, frame_number)
+            if jpeg is not None:
+                jpegs[frame_number] = jpeg
+    missing = [frame_number for frame_number in frame_numbers if frame_number not in jpegs]
+    if missing:
+        for (frame_number, jpeg) in tracker.extract_frames(movie_data = db.get_movie_data(movie_id = movie_id),
+                                                           frame_start = missing[0],
+                                                           frame_end = missing[-1],
+                                                           frame_stride = frame_stride,
+                                                           fmt = 'jpeg',
+                                                           movie_sha256 = movie_sha256):
+            jpegs[frame_number] = jpeg
+            if movie_sha256:
+                frame_cache.cache.put(movie_sha256, frame_number, jpeg)
+    frame_numbers = [frame_number for frame_number in frame_numbers if frame_number in jpegs]
+    if not frame_numbers:
+        return {'error':True, 'message':f'frame number {frame_start} is out of range'}
+
+    trackpoints = defaultdict(list)
+    for tp in db.get_movie_trackpoints(movie_id=movie_id, frame_start=frame_numbers[0], frame_end=frame_numbers[-1]):
+        trackpoints[tp['frame_number']].append({'x':tp['x'], 'y':tp['y'], 'label':tp['label']})
+    annotations = db.get_frames_annotations(movie_id=movie_id, frame_numbers=frame_numbers)
+    frames = []
+    offset = 0
+    for frame_number in frame_numbers:
+        frames.append({'frame_number': frame_number,
+                       'frame_id': annotations[frame_number]['frame_id'],
+                       'annotations': annotations[frame_number]['annotations'],
+                       'trackpoints': trackpoints[frame_number],
+                       'jpeg_offset': offset,
+                       'jpeg_length': len(jpegs[frame_number])})
+        offset += len(jpegs[frame_number])
+    header = json.dumps({'error': False,
+                         'movie_id': movie_id,
+                         'last_tracked_frame': db.last_tracked_frame(movie_id=movie_id),
+                         'frames': frames}).encode('utf-8')
+    bottle.response.content_type = MIME.OCTET_STREAM
+    return b''.join([GET_FRAMES_HEADER_LENGTH.pack(len(header)), header] + [jpegs[frame_number] for frame_number in frame_numbers])
+
 
 @api.route('/put-frame-analysis', method=POST)
 def api_put_frame_analysis():
@@ -841,7 +1332,8 @@ def api_ver():
     """
     logging.debug("api_ver")
     print("api_ver")
-    return {'__version__': __version__, 'sys_version': sys.version}
+    return {'__version__': __version__, 'sys_version': sys.version, 'frame_cache': frame_cache.cache.stats(),
+            'db_pool': dbpool.stats()}
 
 
 ################################################################
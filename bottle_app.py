@@ -82,6 +82,11 @@ LOAD_MESSAGE = "Error: JavaScript did not execute. Please open JavaScript consol
 app = bottle.default_app()      # for Lambda
 app.mount('/api', bottle_api.api)
 
+@app.hook('after_request')
+def flush_logs():
+    """Write the logs before returning. Streamed bodies are produced later, and flush their own logs (see bottle_api.flush_when_done)."""
+    bottle_api.flush_request_logs()
+
 
 pattern_without_zero = r'ruler ([1-9]\d*) mm'  # ruler xx mm pattern
 
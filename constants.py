@@ -13,6 +13,10 @@ GET_POST = [GET,POST]
 class C:
     """Constants"""
     TRACKING_COMPLETED='TRACKING COMPLETED' # keep case; it's used as a flag
+    TRACKING_QUEUED='Tracking queued'
+    TRACKING_CANCELLED='Tracking cancelled'
+    TRACKING_RETRYING='Tracking failed; retrying'
+    TRACKING_FAILED='Tracking failed'
     DBCREDENTIALS_PATH = 'DBCREDENTIALS_PATH'
     MAX_FILE_UPLOAD = 1024*1024*16
     NOTIFY_UPDATE_INTERVAL = 5.0
@@ -37,8 +41,12 @@ class Engines:
 
 class MIME:
     """MIME Types"""
+    CSV = 'text/csv'
     JPEG = 'image/jpeg'
+    JSON = 'application/json'
     MP4 = 'video/quicktime'
+    OCTET_STREAM = 'application/octet-stream'
+    VTT = 'text/vtt'
 
 class E:
     """Error constants"""
@@ -49,6 +57,8 @@ class E:
     INVALID_COURSE_ACCESS = { 'error':True, 'message':'User is not authorized to manipulate course.'}
     INVALID_COURSE_KEY = {'error': True, 'message': 'There is no course for that course key.'}
     INVALID_EMAIL = {'error': True, 'message': 'Invalid email address'}
+    INVALID_ENGINE = {'error': True, 'message': 'Unknown tracking engine or engine version'}
+    INVALID_JOB_ID = {'error': True, 'message': 'Invalid job_id'}
     INVALID_FRAME_ACCESS = { 'error': True, 'message': 'User does not have access to requested movie frame.'}
     INVALID_FRAME_FORMAT = { 'error': True, 'message': 'Format must be "json" or "jpeg".'}
     INVALID_FRAME_ID = {'error': True, 'message': 'frame_id is invalid or missing'}
@@ -7,14 +7,20 @@
 
 import os
 import base64
+import hashlib
 import uuid
 import logging
 import json
 import sys
 import copy
 import smtplib
+import time
+import queue
+import atexit
+import threading
 from typing import Optional
 
+import numpy as np
 from jinja2.nativetypes import NativeEnvironment
 from validate_email_address import validate_email
 
@@ -23,9 +29,9 @@ from paths import TEMPLATE_DIR
 import auth
 from constants import MIME,C
 from auth import get_user_api_key, get_user_ipaddr, get_dbreader, get_dbwriter
-from lib.ctools import dbfile
 from mailer import InvalidEmail
 import mailer
+import dbpool
 
 if sys.version < '3.11':
     raise RuntimeError("Requires python 3.11 or above.")
@@ -40,7 +46,27 @@ logging_policy = set()
 logging_policy.add(LOG_DB)
 
 LOG_MAX_RECORDS = 5000
+LOG_BLOCK = 'block'
+LOG_DROP = 'drop'
+LOG_ASYNC = os.environ.get('PLANTTRACER_LOG_ASYNC','Y')[0:1] in 'yYtT1' # write the logs table from a background thread
+LOG_OVERFLOW = os.environ.get('PLANTTRACER_LOG_OVERFLOW', LOG_BLOCK)       # LOG_BLOCK or LOG_DROP when the queue is full
+LOG_QUEUE_SIZE = 10000          # log records waiting to be written
+LOG_BATCH_SIZE = 200            # log records per INSERT
+LOG_API_KEY_CACHE_SIZE = 10000  # api_keys whose ids are remembered by the audit log
+LOG_API_KEY_CACHE_TTL = 300     # seconds that the audit log remembers an api_key's ids
+API_KEY_CACHE_TTL = 10          # seconds that a validated api_key is trusted without checking the database
+API_KEY_CACHE_SIZE = 10000
+API_KEY_USAGE_FLUSH_INTERVAL = 60 # seconds between writes of api_keys use_count and last_used_at
+ACCESS_CACHE_TTL = 60           # seconds that a user's set of accessible movies is trusted
+ACCESS_CACHE_SIZE = 10000       # users whose access sets are cached
+FRAME_MOVIE_CACHE_SIZE = 100000 # frame_id -> movie_id entries cached by can_access_frame
 MAX_FUNC_RETURN_LOG = 4096      # do not log func_return larger than this
+FRAME_INSERT_BATCH_SIZE = 32    # frames per INSERT in create_new_frames; keep well under max_allowed_packet
+TRACKPOINT_INSERT_BATCH_SIZE = 2000 # trackpoints per INSERT in put_movie_trackpoints
+TRACKPOINT_PAGE_SIZE = 2000     # trackpoints per SELECT in iter_movie_trackpoints
+TRAJECTORY_VERSION = 1          # layout of movie_trajectories.points; trajectories with another version are ignored
+TRAJECTORY_DTYPE = np.dtype('<f4')  # little-endian float32
+TRAJECTORY_DECIMALS = 3         # trackpoints read from a trajectory are rounded to this many decimals
 CHECK_MX = False            # True doesn't work
 
 ################################################################
@@ -80,18 +106,119 @@ class NoMovieData(DB_Errors):
 
 
 logit_DEBUG = False
+
+class AuditLog:
+    """Buffered sink for the logs table.
+    logit() puts records on a bounded queue and a background thread writes them with multi-row INSERTs.
+    The apikey_id and user_id of each api_key are looked up once and remembered for LOG_API_KEY_CACHE_TTL
+    seconds, rather than with two subqueries in every INSERT. forget() removes them when a key is deleted.
+    :param: overflow - what logit() does when the queue is full: LOG_BLOCK waits for the writer; LOG_DROP discards the record.
+    """
+    def __init__(self, *, maxsize=LOG_QUEUE_SIZE, overflow=LOG_BLOCK):
+        assert overflow in (LOG_BLOCK, LOG_DROP)
+        self.records = queue.Queue(maxsize=maxsize)
+        self.overflow = overflow
+        self.api_key_ids = {}   # api_key -> (apikey_id, user_id, time looked up)
+        self.lock = threading.Lock()
+        self.writer = None
+        self.written = 0
+        self.dropped = 0
+
+    def put(self, record):
+        """Queue (time_t, api_key, ipaddr, func_name, func_args, func_return) to be written"""
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.run, daemon=True)
+                self.writer.start()
+        if self.overflow==LOG_DROP:
+            try:
+                self.records.put_nowait(record)
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+        else:
+            self.records.put(record)
+
+    def run(self):
+        """The writer thread: waits for a record, then writes it along with any others that are waiting"""
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:   # pylint: disable=broad-exception-caught
+                logging.error("cannot write %s log records: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self.records.task_done()
+
+    def write(self, batch):
+        now = time.time()
+        with self.lock:
+            ids = {}
+            for api_key in {record[1] for record in batch if record[1]}:
+                cached = self.api_key_ids.get(api_key)
+                if cached is not None and now - cached[2] <= LOG_API_KEY_CACHE_TTL:
+                    ids[api_key] = cached[0:2]
+        unknown = {record[1] for record in batch if record[1] and record[1] not in ids}
+        if unknown:
+            rows = dbpool.DBMySQL.csfr(get_dbwriter(),
+                                       "SELECT api_key, min(id), min(user_id) FROM api_keys WHERE api_key IN ("
+                                       + ",".join(["%s"]*len(unknown)) + ") GROUP BY api_key",
+                                       list(unknown))
+            with self.lock:
+                if len(self.api_key_ids) + len(rows) > LOG_API_KEY_CACHE_SIZE:
+                    self.api_key_ids.clear()
+                for (api_key, apikey_id, user_id) in rows:
+                    ids[api_key] = (apikey_id, user_id)
+                    self.api_key_ids[api_key] = (apikey_id, user_id, now)
+        vals = []
+        for (time_t, api_key, ipaddr, func_name, func_args, func_return) in batch:
+            (apikey_id, user_id) = ids.get(api_key, (None, None))
+            vals.extend([time_t, apikey_id, user_id, ipaddr, func_name, func_args, func_return])
+        dbpool.DBMySQL.csfr(get_dbwriter(),
+                            "INSERT INTO logs (time_t, apikey_id, user_id, ipaddr, func_name, func_args, func_return) VALUES "
+                            + ",".join(["(%s,%s,%s,%s,%s,%s,%s)"]*len(batch)),
+                            vals,
+                            debug=logit_DEBUG)
+        with self.lock:
+            self.written += len(batch)
+
+    def forget(self, api_key=None):
+        """Remove the ids of api_key (or of every api_key), so that they are looked up again"""
+        with self.lock:
+            if api_key is None:
+                self.api_key_ids.clear()
+            else:
+                self.api_key_ids.pop(api_key, None)
+
+    def flush(self):
+        """Wait until every queued record has been written"""
+        if self.writer is not None:
+            self.records.join()
+
+
+audit_log = AuditLog(overflow=LOG_OVERFLOW)
+atexit.register(audit_log.flush)
+
+def flush_logs():
+    """Write every queued log record. Called at the end of each request on AWS Lambda,
+    where the writer thread is frozen between invocations, and before the logs are read."""
+    audit_log.flush()
+
 def logit(*, func_name, func_args, func_return):
     # Get the name of the caller
     user_api_key = get_user_api_key()
     user_ipaddr  = get_user_ipaddr()
 
-    # Make copies of func_args and func_return so we can modify without fear
-    func_args = copy.copy(func_args)
-    func_return = copy.copy(func_return)
-
     if 'movie_data' in func_args and func_args['movie_data'] is not None:
-        func_args['movie_data'] = f"({len(func_args['movie_data'])} bytes)"
+        func_args = {**func_args, 'movie_data': f"({len(func_args['movie_data'])} bytes)"}
 
+    # Encode now, so the record does not change if the caller modifies the arguments or the return value
     func_args   = json.dumps(func_args, default=str)
     func_return = json.dumps(func_return, default=str)
 
@@ -101,18 +228,11 @@ def logit(*, func_name, func_args, func_return):
     logging.debug("%s(%s) = %s ", func_name, func_args, func_return)
 
     if LOG_DB in logging_policy:
-        dbfile.DBMySQL.csfr(get_dbwriter(),
-                            """INSERT INTO logs (
-                                time_t,
-                                apikey_id, user_id, ipaddr,
-                                func_name, func_args, func_return)
-                         VALUES (UNIX_TIMESTAMP(),
-                                (select min(id) from api_keys where api_key=%s),
-                                   (select min(user_id) from api_keys where api_key=%s), %s,
-                                 %s, %s, %s )""",
-                            (user_api_key, user_api_key, user_ipaddr,
-                             func_name, func_args, func_return),
-                            debug=logit_DEBUG)
+        record = (int(time.time()), user_api_key, user_ipaddr, func_name, func_args, func_return)
+        if LOG_ASYNC:
+            audit_log.put(record)
+        else:
+            audit_log.write([record])
 
     if LOG_INFO in logging_policy:
         logging.info("%s func_name=%s func_args=%s func_return=%s",
@@ -162,29 +282,75 @@ def add_log_policy(v):
 ## USER MANAGEMENT ##
 #####################
 
+api_key_cache = {}               # api_key -> (time cached, user dict)
+api_key_usage = {}               # api_key -> [uses, first use, last use] not yet written to api_keys
+api_key_usage_flushed = time.time()
+api_key_lock = threading.Lock()
+
 @log_args
 def validate_api_key(api_key):
     """
     Validate API key.
+    Valid keys are cached for API_KEY_CACHE_TTL seconds. A key that is deleted by this process is removed
+    from the cache at once (see forget_api_keys), but a key or user that is disabled, or a key that is deleted
+    by another process, remains valid in this process for up to API_KEY_CACHE_TTL seconds.
+    Their use is counted in memory and written to api_keys every API_KEY_USAGE_FLUSH_INTERVAL seconds,
+    and at the end of each Lambda invocation (see flush_api_key_usage).
     :param: api_key - the key provided by the cookie or the HTML form.
     :return: User dictionary or {} if key is not valid
     """
-    ret = dbfile.DBMySQL.csfr(get_dbreader(),
-                              """SELECT * from api_keys left join users on user_id=users.id
-                              where api_key=%s and api_keys.enabled=1 and users.enabled=1 LIMIT 1""",
-                              (api_key, ), asDicts=True)
-
-    logging.debug("validate_api_key(%s)=%s",api_key,ret)
-    if ret:
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+    now = time.time()
+    with api_key_lock:
+        (cached_at, userdict) = api_key_cache.get(api_key, (0, None))
+    if now - cached_at > API_KEY_CACHE_TTL:
+        ret = dbpool.DBMySQL.csfr(get_dbreader(),
+                                  """SELECT * from api_keys left join users on user_id=users.id
+                                  where api_key=%s and api_keys.enabled=1 and users.enabled=1 LIMIT 1""",
+                                  (api_key, ), asDicts=True)
+        logging.debug("validate_api_key(%s)=%s",api_key,ret)
+        if not ret:
+            return {}
+        userdict = ret[0]
+        with api_key_lock:
+            if len(api_key_cache) >= API_KEY_CACHE_SIZE:
+                api_key_cache.clear()
+            api_key_cache[api_key] = (now, userdict)
+
+    with api_key_lock:
+        usage = api_key_usage.setdefault(api_key, [0, now, now])
+        usage[0] += 1
+        usage[2] = now
+        flush = now - api_key_usage_flushed > API_KEY_USAGE_FLUSH_INTERVAL
+    if flush:
+        flush_api_key_usage()
+    return copy.copy(userdict)
+
+def flush_api_key_usage():
+    """Write the use counts and times of the api_keys that were validated since the last flush"""
+    global api_key_usage_flushed # pylint: disable=global-statement
+    with api_key_lock:
+        usage = dict(api_key_usage)
+        api_key_usage.clear()
+        api_key_usage_flushed = time.time()
+    for (api_key, (uses, first_used_at, last_used_at)) in usage.items():
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             """UPDATE api_keys
-                             SET last_used_at=unix_timestamp(),
-                             first_used_at=if(first_used_at is null,unix_timestamp(),first_used_at),
-                             use_count=use_count+1
+                             SET last_used_at=%s,
+                             first_used_at=if(first_used_at is null,%s,first_used_at),
+                             use_count=use_count+%s
                              WHERE api_key=%s""",
-                            (api_key,))
-        return ret[0]
-    return {}
+                            (int(last_used_at), int(first_used_at), uses, api_key))
+
+def forget_api_keys(api_key=None):
+    """Remove api_key (or every api_key) from the cache, so that it is validated against the database the next time"""
+    with api_key_lock:
+        if api_key is None:
+            api_key_cache.clear()
+        else:
+            api_key_cache.pop(api_key, None)
+    audit_log.forget(api_key)
+
+atexit.register(flush_api_key_usage)
 
 ##
 
@@ -204,7 +370,7 @@ def lookup_user(*, email=None, user_id=None, get_admin=None, get_courses=None):
         cmd += "id=%s "
         args += [user_id]
     try:
-        ret= dbfile.DBMySQL.csfr(get_dbreader(),cmd, args, asDicts=True)[0]
+        ret= dbpool.DBMySQL.csfr(get_dbreader(),cmd, args, asDicts=True)[0]
         # If the user_id was not provided as an argument, provide it.
         if not user_id:
             user_id = ret['user_id']
@@ -212,11 +378,11 @@ def lookup_user(*, email=None, user_id=None, get_admin=None, get_courses=None):
         return {}
 
     if get_admin:
-        ret['admin'] = dbfile.DBMySQL.csfr(get_dbreader(),
+        ret['admin'] = dbpool.DBMySQL.csfr(get_dbreader(),
                                            """SELECT * from admins where user_id = %s""",
                                            (user_id,), asDicts=True)
     if get_courses:
-        ret['courses'] = dbfile.DBMySQL.csfr(get_dbreader(),
+        ret['courses'] = dbpool.DBMySQL.csfr(get_dbreader(),
                                            """SELECT *,id as course_id from courses where id = %s
                                            OR id in (select course_id from admins where user_id=%s)
                                            """, (user_id,user_id),asDicts=True)
@@ -227,7 +393,7 @@ def lookup_user(*, email=None, user_id=None, get_admin=None, get_courses=None):
 @log
 def rename_user(*,user_id, email, new_email):
     """Changes a user's email. Requires a correct old_email"""
-    dbfile.DBMySQL.csfr(get_dbwriter(), "UPDATE users SET email=%s where id=%s AND email=%s",
+    dbpool.DBMySQL.csfr(get_dbwriter(), "UPDATE users SET email=%s where id=%s AND email=%s",
                         (email, user_id, new_email))
 
 
@@ -244,7 +410,7 @@ def delete_user(*,email,purge_movies=False):
     Deletes all of the users
     Also deletes the user from any courses where they may be an admin.
     """
-    rows = dbfile.DBMySQL.csfr(get_dbreader(),
+    rows = dbpool.DBMySQL.csfr(get_dbreader(),
                                "SELECT id as movie_id,title from movies where user_id in (select id from users where email=%s)",
                                (email,),asDicts=True)
     if rows:
@@ -256,9 +422,10 @@ def delete_user(*,email,purge_movies=False):
         for row in rows:
             purge_movie(movie_id=row['movie_id'])
 
-    dbfile.DBMySQL.csfr(get_dbwriter(), "DELETE FROM admins WHERE user_id in (select id from users where email=%s)", (email,))
-    dbfile.DBMySQL.csfr(get_dbwriter(), "DELETE FROM api_keys WHERE user_id in (select id from users where email=%s)", (email,))
-    dbfile.DBMySQL.csfr(get_dbwriter(), "DELETE FROM users WHERE email=%s", (email,))
+    dbpool.DBMySQL.csfr(get_dbwriter(), "DELETE FROM admins WHERE user_id in (select id from users where email=%s)", (email,))
+    dbpool.DBMySQL.csfr(get_dbwriter(), "DELETE FROM api_keys WHERE user_id in (select id from users where email=%s)", (email,))
+    dbpool.DBMySQL.csfr(get_dbwriter(), "DELETE FROM users WHERE email=%s", (email,))
+    forget_api_keys()
 
 
 ################ REGISTRATION ################
@@ -281,18 +448,18 @@ def register_email(*, email, name, course_key=None, course_id=None, demo_user=0)
 
     # Get the course_id if not provided
     if not course_id:
-        res = dbfile.DBMySQL.csfr(
+        res = dbpool.DBMySQL.csfr(
             get_dbreader(), "SELECT id FROM courses WHERE course_key=%s", (course_key,))
         if (not res) or (len(res) != 1):
             raise InvalidCourse_Key(course_key)
         course_id = res[0][0]
 
-    dbfile.DBMySQL.csfr(get_dbwriter(),
+    dbpool.DBMySQL.csfr(get_dbwriter(),
                         """INSERT INTO users (email, primary_course_id, name, demo)
                         VALUES (%s, %s, %s, %s)
                         ON DUPLICATE KEY UPDATE email=%s""",
                         (email, course_id, name, demo_user, email))
-    return dbfile.DBMySQL.csfr(get_dbreader(),
+    return dbpool.DBMySQL.csfr(get_dbreader(),
                                "SELECT *,id as user_id, primary_course_id as course_id from users where email=%s",
                                (email,),
                                asDicts=True)[0]
@@ -343,7 +510,7 @@ def make_new_api_key(*,email):
     if user and user['enabled'] == 1:
         user_id = user['id']
         api_key = str(uuid.uuid4()).replace('-', '')
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                                 """INSERT INTO api_keys (user_id, api_key) VALUES (%s,%s)""",
 
                                 (user_id, api_key))
@@ -361,7 +528,8 @@ def delete_api_key(api_key):
     """
     if len(api_key) < 10:
         raise InvalidAPI_Key(api_key)
-    return dbfile.DBMySQL.csfr(get_dbwriter(),
+    forget_api_keys(api_key)
+    return dbpool.DBMySQL.csfr(get_dbwriter(),
                                """DELETE FROM api_keys WHERE api_key=%s""",
                                (api_key,))
 
@@ -384,22 +552,22 @@ def list_users(*, user_id):
                 OR %s IN (select user_id from admins where course_id=%s)
               ORDER BY primary_course_id,name,email"""
     args = (user_id, user_id,user_id,user_id,SUPER_ADMIN_COURSE_ID)
-    ret['users'] = dbfile.DBMySQL.csfr(get_dbreader(),cmd,args,asDicts=True)
+    ret['users'] = dbpool.DBMySQL.csfr(get_dbreader(),cmd,args,asDicts=True)
 
     cmd = """SELECT id as course_id,course_name,course_section,max_enrollment from courses"""
     args = []
-    ret['courses'] = dbfile.DBMySQL.csfr(get_dbreader(),cmd,args,asDicts=True)
+    ret['courses'] = dbpool.DBMySQL.csfr(get_dbreader(),cmd,args,asDicts=True)
     return ret
 
 def list_admins():
     """Returns a list of all the admins"""
-    return dbfile.DBMySQL.csfr(get_dbreader(),
+    return dbpool.DBMySQL.csfr(get_dbreader(),
                                "select *,users.id as user_id FROM users left join admins on users.id=admins.user_id",
                                asDicts=True)
 
 def list_demo_users():
     """Returns a list of all demo accounts and their API keys. This can be downloaded without authentication!"""
-    return dbfile.DBMySQL.csfr(get_dbreader(),
+    return dbpool.DBMySQL.csfr(get_dbreader(),
                                "select *,users.id as user_id from users left join api_keys on api_keys.user_id=users.id where demo=1 and api_keys.enabled=1",
                                asDicts=True,debug=True)
 
@@ -410,7 +578,7 @@ def list_demo_users():
 
 def lookup_course(*, course_id):
     try:
-        return dbfile.DBMySQL.csfr(get_dbreader(),
+        return dbpool.DBMySQL.csfr(get_dbreader(),
                                    "SELECT * FROM courses WHERE id=%s", (course_id,), asDicts=True)[0]
     except IndexError:
         return {}
@@ -421,7 +589,7 @@ def create_course(*, course_key, course_name, max_enrollment, course_section=Non
     """Create a new course
     :return: course_id of the new course
     """
-    ret = dbfile.DBMySQL.csfr(get_dbwriter(),
+    ret = dbpool.DBMySQL.csfr(get_dbwriter(),
                               "INSERT into courses (course_key, course_name, max_enrollment, course_section) values (%s,%s,%s,%s)",
                               (course_key, course_name, max_enrollment, course_section))
     return {'course_id':ret}
@@ -432,7 +600,7 @@ def delete_course(*,course_key):
     """Delete a course.
     :return: number of courses deleted.
     """
-    return dbfile.DBMySQL.csfr(get_dbwriter(), "DELETE from courses where course_key=%s", (course_key,))
+    return dbpool.DBMySQL.csfr(get_dbwriter(), "DELETE from courses where course_key=%s", (course_key,))
 
 
 @log
@@ -448,45 +616,49 @@ def make_course_admin(*, email, course_key=None, course_id=None):
 
     assert ((course_key is None) and (course_id is not None)) or ((course_key is not None) and (course_id is None))
     if course_key and course_id is None:
-        course_id = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT id from courses WHERE course_key=%s",(course_key,))[0][0]
+        course_id = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT id from courses WHERE course_key=%s",(course_key,))[0][0]
         logging.info("course_id=%s",course_id)
 
-    dbfile.DBMySQL.csfr(get_dbwriter(), "INSERT into admins (course_id, user_id) values (%s, %s)",
+    dbpool.DBMySQL.csfr(get_dbwriter(), "INSERT into admins (course_id, user_id) values (%s, %s)",
                         (course_id, user_id))
+    forget_access(user_id)
     return {'user_id':user_id,'course_id':course_id}
 
 
 @log
 def remove_course_admin(*, email, course_key=None, course_id=None):
     if course_id:
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             "DELETE FROM admins WHERE course_id=%s and user_id in (select id from users where email=%s)",
                             (course_id, email))
     if course_key:
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             "DELETE FROM admins where course_id in (SELECT id FROM courses WHERE course_key=%s) "
                             "AND user_id IN (SELECT id FROM users WHERE email=%s)",
                             (course_key, email))
+    user = lookup_user(email=email)
+    if user:
+        forget_access(user['user_id'])
 
 
 @log
 def check_course_admin(*, user_id, course_id):
     """Return True if user_id is an admin in course_id"""
-    res = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT * FROM admins WHERE user_id=%s AND course_id=%s LIMIT 1",
+    res = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT * FROM admins WHERE user_id=%s AND course_id=%s LIMIT 1",
                               (user_id, course_id))
     return len(res) == 1
 
 
 @log
 def validate_course_key(*, course_key):
-    res = dbfile.DBMySQL.csfr(get_dbreader(),
+    res = dbpool.DBMySQL.csfr(get_dbreader(),
                               """SELECT course_key FROM courses WHERE course_key=%s LIMIT 1""", (course_key,))
     return len(res) == 1 and res[0][0] == course_key
 
 
 @log
 def remaining_course_registrations(*,course_key):
-    res = dbfile.DBMySQL.csfr(get_dbreader(),
+    res = dbpool.DBMySQL.csfr(get_dbreader(),
                               """SELECT max_enrollment
                               - (SELECT COUNT(*) FROM users
                               WHERE primary_course_id=(SELECT id FROM courses WHERE course_key=%s))
@@ -508,7 +680,7 @@ def get_movie_data(*, movie_id):
     """Returns the movie contents for a movie_id. If the data is stored in the movie_data, return that.
     If a sha256 is stored, redirect through the objects table.
     """
-    rows = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT movie_data, movie_sha256 from movie_data where movie_id=%s LIMIT 1", (movie_id,))
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT movie_data, movie_sha256 from movie_data where movie_id=%s LIMIT 1", (movie_id,))
     if len(rows)!=1:
         raise InvalidMovie_Id(f"movie_id={movie_id}")
     (movie_data,movie_sha256) = rows[0]
@@ -518,7 +690,7 @@ def get_movie_data(*, movie_id):
     # Performance Improvement:
     # Make this a join with object_store so that we get the object if it is locally in the database
 
-    rows = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT urn from objects where sha256=%s LIMIT 1", (movie_sha256,))
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT urn from objects where sha256=%s LIMIT 1", (movie_sha256,))
     logging.debug("rows=%s",rows)
     if len(rows)!=1:
         logging.debug("raise")
@@ -530,6 +702,21 @@ def get_movie_data(*, movie_id):
     return None
 
 
+def get_movie_ids_for_sha256(*, movie_sha256):
+    """Returns the movie_ids of all movies whose data has the given SHA256."""
+    return [row[0] for row in dbpool.DBMySQL.csfr(get_dbreader(),
+                                                  "SELECT movie_id from movie_data where movie_sha256=%s",
+                                                  (movie_sha256,))]
+
+# Don't log this; it is called for every frame that is displayed
+def get_movie_sha256(*, movie_id):
+    """Returns the SHA256 of a movie's data without reading the data, or None if it is not known."""
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT movie_sha256 from movie_data where movie_id=%s LIMIT 1", (movie_id,))
+    if len(rows)!=1:
+        raise InvalidMovie_Id(f"movie_id={movie_id}")
+    return rows[0][0]
+
+
 @log
 def get_movie_metadata(*,user_id, movie_id):
     """Gets the metadata for all movies accessible by user_id or enumerated by movie_id.
@@ -552,59 +739,122 @@ def get_movie_metadata(*,user_id, movie_id):
         cmd += " AND A.id=%s"
         params.append(movie_id)
 
-    return dbfile.DBMySQL.csfr(get_dbreader(), cmd, params, asDicts=True)
+    return dbpool.DBMySQL.csfr(get_dbreader(), cmd, params, asDicts=True)
+
+access_cache = {}                # user_id -> (time computed, frozenset of movie_ids the user may access)
+frame_movie_ids = {}             # frame_id -> movie_id; a frame never moves to another movie
+access_lock = threading.Lock()
+
+ACCESS_WHERE = """(user_id=%s OR
+            course_id=(select primary_course_id from users where id=%s) OR
+            course_id in (select course_id from admins where user_id=%s))"""
+
+def accessible_movie_ids(*, user_id):
+    """Return the set of movie_ids that user_id may access: the user's own movies, the movies in the user's
+    primary course, and the movies in the courses that the user administers.
+    The set is cached for ACCESS_CACHE_TTL seconds, or until forget_access() is called. Access that is granted
+    later is found by check_movie_access, so forget_access() is only needed when access is taken away.
+    """
+    now = time.time()
+    with access_lock:
+        (computed_at, movie_ids) = access_cache.get(user_id, (0, None))
+    if now - computed_at > ACCESS_CACHE_TTL:
+        res = dbpool.DBMySQL.csfr(get_dbreader(), "select id from movies WHERE " + ACCESS_WHERE,
+                                  (user_id, user_id, user_id))
+        movie_ids = frozenset(row[0] for row in res)
+        with access_lock:
+            if len(access_cache) >= ACCESS_CACHE_SIZE:
+                access_cache.clear()
+            access_cache[user_id] = (now, movie_ids)
+    return movie_ids
+
+def check_movie_access(*, user_id, movie_id):
+    """Check one movie that is not in user_id's cached access set against the database,
+    since it may have been created (by another process) after the set was computed.
+    If the user may access it, it is added to the cached set.
+    """
+    res = dbpool.DBMySQL.csfr(get_dbreader(), "select id from movies WHERE id=%s AND " + ACCESS_WHERE,
+                              (movie_id, user_id, user_id, user_id))
+    if not res:
+        return False
+    with access_lock:
+        if user_id in access_cache:
+            (computed_at, movie_ids) = access_cache[user_id]
+            access_cache[user_id] = (computed_at, movie_ids | {movie_id})
+    return True
+
+def forget_access(user_id=None):
+    """Remove user_id's (or every user's) cached access set"""
+    with access_lock:
+        if user_id is None:
+            access_cache.clear()
+        else:
+            access_cache.pop(user_id, None)
 
 @log
 def can_access_movie(*, user_id, movie_id):
-    """Return if the user is allowed to access the movie."""
-    res = dbfile.DBMySQL.csfr(
-        get_dbreader(),
-        """select count(*) from movies WHERE id=%s AND
-        (user_id=%s OR
-        course_id=(select primary_course_id from users where id=%s) OR
-        course_id in (select course_id from admins where user_id=%s))""",
-        (movie_id, user_id, user_id, user_id))
-    return res[0][0] > 0
+    """Return if the user is allowed to access the movie.
+    :param: movie_id - an int, or a string from a request; a value that is not an integer is never accessible.
+    """
+    try:
+        movie_id = int(movie_id)
+    except (TypeError, ValueError):
+        return False
+    if movie_id in accessible_movie_ids(user_id=user_id):
+        return True
+    return check_movie_access(user_id=user_id, movie_id=movie_id)
 
 @log
 def can_access_frame(*, user_id, frame_id=None):
     """Return if the user is allowed to access a specific frame.
     """
-    res = dbfile.DBMySQL.csfr(
-            get_dbreader(),
-            """select count(*) from movies WHERE id in (select movie_id from movie_frames where id=%s)
-            AND ( (user_id=%s) OR
-                  (course_id=(select primary_course_id from users where id=%s)) OR
-                  (course_id in (select course_id from admins where user_id=%s)) OR
-                  (%s = 0) )
-            """,
-            (frame_id, user_id, user_id, user_id, user_id))
-    return res[0][0] > 0
+    with access_lock:
+        movie_id = frame_movie_ids.get(frame_id)
+    if movie_id is None:
+        res = dbpool.DBMySQL.csfr(get_dbreader(), "select movie_id from movie_frames where id=%s", (frame_id,))
+        if not res:
+            return False
+        movie_id = res[0][0]
+        with access_lock:
+            if len(frame_movie_ids) >= FRAME_MOVIE_CACHE_SIZE:
+                frame_movie_ids.clear()
+            frame_movie_ids[frame_id] = movie_id
+    if user_id == 0:
+        return True
+    if movie_id in accessible_movie_ids(user_id=user_id):
+        return True
+    return check_movie_access(user_id=user_id, movie_id=movie_id)
 
 @log
 def movie_frames_info(*,movie_id):
     """Gets information about movie frames"""
     ret = {}
-    ret['count'] = dbfile.DBMySQL.csfr(
+    ret['count'] = dbpool.DBMySQL.csfr(
         get_dbreader(), "SELECT count(*) from movie_frames where movie_id=%s", (movie_id,))[0][0]
     return ret
 
+def get_stored_frame_numbers(*, movie_id):
+    """Return the set of frame numbers of a movie whose JPEGs are stored in movie_frames"""
+    return {row[0] for row in dbpool.DBMySQL.csfr(
+        get_dbreader(), "SELECT frame_number from movie_frames where movie_id=%s and frame_data is not null", (movie_id,))}
+
 @log
 def purge_movie_frames(*,movie_id):
     """Delete the frames associated with a movie."""
     logging.debug("purge_movie_frames movie_id=%s",movie_id)
-    dbfile.DBMySQL.csfr(
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "DELETE from movie_frame_analysis where frame_id in (select id from movie_frames where movie_id=%s)", (movie_id,))
-    dbfile.DBMySQL.csfr(
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "DELETE from movie_frame_trackpoints where frame_id in (select id from movie_frames where movie_id=%s)", (movie_id,))
-    dbfile.DBMySQL.csfr(
+    forget_movie_trajectory(movie_id=movie_id)
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "DELETE from movie_frames where movie_id=%s", (movie_id,))
 
 @log
 def purge_movie_data(*,movie_id):
     """Delete the frames associated with a movie."""
     logging.debug("purge_movie_data movie_id=%s",movie_id)
-    dbfile.DBMySQL.csfr(
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "DELETE from movie_data where movie_id=%s", (movie_id,))
 
 @log
@@ -612,14 +862,14 @@ def purge_movie(*,movie_id):
     """Actually delete a movie and all its frames"""
     purge_movie_frames(movie_id=movie_id)
     purge_movie_data(movie_id=movie_id)
-    dbfile.DBMySQL.csfr(
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "DELETE from movies where id=%s", (movie_id,))
 
 
 @log
 def delete_movie(*,movie_id, delete=1):
     """Set a movie's deleted bit to be true"""
-    dbfile.DBMySQL.csfr(
+    dbpool.DBMySQL.csfr(
         get_dbwriter(), "UPDATE movies SET deleted=%s where id=%s", (delete, movie_id,))
 
 
@@ -652,7 +902,7 @@ def create_new_movie(*, user_id, title=None, description=None,
         raise ValueError(f"movie_data_sha256={movie_data_sha256} but computed_movie_data_sha256={computed_movie_data_sha256}")
 
     # First get the user's primary_course_id
-    res = dbfile.DBMySQL.csfr(
+    res = dbpool.DBMySQL.csfr(
         get_dbreader(), "select primary_course_id from users where id=%s", (user_id,))
     if not res or len(res) != 1:
         logging.error("len(res)=%s", len(res))
@@ -661,23 +911,25 @@ def create_new_movie(*, user_id, title=None, description=None,
     primary_course_id = res[0][0]
 
     # Now create the movie record
-    movie_id = dbfile.DBMySQL.csfr(get_dbwriter(),
+    movie_id = dbpool.DBMySQL.csfr(get_dbwriter(),
                                    """INSERT INTO movies (title,description,user_id,course_id,orig_movie) VALUES (%s,%s,%s,%s,%s)
                                     """,
                                    (title, description, user_id, primary_course_id,orig_movie))
     if movie_data_sha256:
         # If we know the sha256 we can put it in the metadata
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             "INSERT INTO movie_data (movie_id, movie_sha256) values (%s,%s)",
                             (movie_id, movie_data_sha256))
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             "INSERT INTO objects (sha256, urn) values (%s, %s) ON DUPLICATE KEY UPDATE id=id",
                             (movie_data_sha256, movie_data_urn))
     if movie_data:
         db_object.write_object(movie_data_urn, movie_data)
 
+    # The new movie is not in any cached access set, so can_access_movie checks it on its own (see check_movie_access)
+
     if movie_metadata:
-        dbfile.DBMySQL.csfr(get_dbwriter(),
+        dbpool.DBMySQL.csfr(get_dbwriter(),
                             "UPDATE movies SET " + ",".join(f"{key}=%s" for key in movie_metadata.keys()) + " " +
                             "WHERE id = %s",
                             list(movie_metadata.values()) + [movie_id])
@@ -699,27 +951,97 @@ def create_new_frame(*, movie_id, frame_number, frame_data=None):
     args = (movie_id, frame_number, movie_id, frame_number)
     a1 = a2 = a3 = ""
     if frame_data is not None:
-        a1 = ", frame_data"
-        a2 = ",%s"
-        a3 = ",frame_data=%s"
-        args = (movie_id, frame_number, frame_data, movie_id, frame_number, frame_data)
-    dbfile.DBMySQL.csfr(get_dbwriter(),
+        # frame_sha256 addresses the stored JPEG (see bottle_api.frame_url)
+        frame_sha256 = hashlib.sha256(frame_data).hexdigest()
+        a1 = ", frame_data, frame_sha256"
+        a2 = ",%s,%s"
+        a3 = ",frame_data=%s,frame_sha256=%s"
+        args = (movie_id, frame_number, frame_data, frame_sha256, movie_id, frame_number, frame_data, frame_sha256)
+    dbpool.DBMySQL.csfr(get_dbwriter(),
                         f"""INSERT INTO movie_frames (movie_id, frame_number{a1})
                         VALUES (%s,%s{a2})
                         ON DUPLICATE KEY UPDATE movie_id=%s,frame_number=%s{a3}""",
                         args)
-    frame_id = dbfile.DBMySQL.csfr(get_dbwriter(),"SELECT id from movie_frames where movie_id=%s and frame_number=%s",
+    frame_id = dbpool.DBMySQL.csfr(get_dbwriter(),"SELECT id from movie_frames where movie_id=%s and frame_number=%s",
                                    (movie_id, frame_number))[0][0]
     return frame_id
 
 
+# Don't log this either; the frames are large
+def create_new_frames(*, movie_id, frames, batch_size=FRAME_INSERT_BATCH_SIZE):
+    """Store many frames of a movie using batched multi-row inserts.
+    :param: movie_id - the movie
+    :param: frames - iterable of (frame_number, frame_data) tuples. May be a generator.
+    :param: batch_size - number of frames per INSERT statement
+    :return: number of frames written
+    """
+    count = 0
+    batch = []
+    def flush():
+        args = ",".join(["(%s,%s,%s,%s)"]*len(batch))
+        vals = [v for (frame_number, frame_data) in batch
+                for v in (movie_id, frame_number, frame_data, hashlib.sha256(frame_data).hexdigest())]
+        dbpool.DBMySQL.csfr(get_dbwriter(),
+                            f"""INSERT INTO movie_frames (movie_id, frame_number, frame_data, frame_sha256) VALUES {args}
+                            ON DUPLICATE KEY UPDATE frame_data=VALUES(frame_data), frame_sha256=VALUES(frame_sha256)""",
+                            vals)
+        batch.clear()
+    for (frame_number, frame_data) in frames:
+        batch.append((frame_number, frame_data))
+        count += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return count
+
+
+# Don't log this; it is called for every range of frames that is played
+def get_frames_annotations(*, movie_id, frame_numbers):
+    """Return the frame_id and annotations of many frames of a movie in one query.
+    As with a single frame from /api/get-frame, frames that are not in the database are created.
+    :param: frame_numbers - the frames
+    :return: dictionary of frame_number -> {'frame_id', 'annotations'}, where annotations are as from get_frame_annotations
+    """
+    if not frame_numbers:
+        return {}
+    dbpool.DBMySQL.csfr(get_dbwriter(),
+                        "INSERT INTO movie_frames (movie_id, frame_number) VALUES "
+                        + ",".join(["(%s,%s)"]*len(frame_numbers))
+                        + " ON DUPLICATE KEY UPDATE movie_id=movie_id",
+                        [v for frame_number in frame_numbers for v in (movie_id, frame_number)])
+    rows = dbpool.DBMySQL.csfr(get_dbwriter(),
+                               """SELECT F.frame_number, F.id AS frame_id,
+                                         A.id AS movie_frame_analysis_id, A.engine_id, A.annotations,
+                                         E.name AS engine_name, E.version AS engine_version
+                               FROM movie_frames F
+                               LEFT JOIN movie_frame_analysis A ON A.frame_id=F.id
+                               LEFT JOIN engines E ON A.engine_id=E.id
+                               WHERE F.movie_id=%s AND F.frame_number IN ("""
+                               + ",".join(["%s"]*len(frame_numbers)) + """)
+                               ORDER BY F.frame_number, E.name, E.version""",
+                               [movie_id] + list(frame_numbers),
+                               asDicts=True)
+    ret = {}
+    for row in rows:
+        frame = ret.setdefault(row['frame_number'], {'frame_id':row['frame_id'], 'annotations':[]})
+        if row['movie_frame_analysis_id'] is not None:
+            frame['annotations'].append({'movie_frame_analysis_id': row['movie_frame_analysis_id'],
+                                         'frame_id': row['frame_id'],
+                                         'engine_id': row['engine_id'],
+                                         'annotations': json.loads(row['annotations']),
+                                         'engine_name': row['engine_name'],
+                                         'engine_version': row['engine_version']})
+    return ret
+
+
 def get_frame_annotations(*, frame_id):
     """Returns a list of dictionaries where each dictonary represents a record.
     Within that record, 'annotations' is stored in the database as a JSON string,
     but we turn it into a dictionary on return, so that we don't have JSON encapsulating JSON when we send the data to the client.
     """
 
-    ret = dbfile.DBMySQL.csfr(get_dbreader(),
+    ret = dbpool.DBMySQL.csfr(get_dbreader(),
                                """SELECT movie_frame_analysis.id AS movie_frame_analysis_id,
                                          frame_id,engine_id,annotations,engines.name as engine_name,
                                          engines.version AS engine_version FROM movie_frame_analysis
@@ -735,7 +1057,7 @@ def get_frame_annotations(*, frame_id):
 def get_frame_trackpoints(*, frame_id):
     """Returns a list of trackpoint dictionaries where each dictonary represents a trackpoint.
     """
-    return  dbfile.DBMySQL.csfr(get_dbreader(),
+    return  dbpool.DBMySQL.csfr(get_dbreader(),
                                """
                                SELECT id as movie_frame_trackpoints_id,
                                       frame_id,x,y,label FROM movie_frame_trackpoints
@@ -743,23 +1065,69 @@ def get_frame_trackpoints(*, frame_id):
                                (frame_id,),
                                asDicts=True)
 
-def get_movie_trackpoints(*, movie_id):
+def get_movie_trackpoints(*, movie_id, frame_start=None, frame_end=None):
     """Returns a list of trackpoint dictionaries where each dictonary represents a trackpoint.
+    They come from the movie's trajectory if it has one; otherwise from movie_frame_trackpoints.
+    :param: frame_start, frame_end - if provided, only the trackpoints of frames frame_start..frame_end (inclusive)
     """
-    return  dbfile.DBMySQL.csfr(get_dbreader(),
-                               """
-                               SELECT frame_number,x,y,label
-                               FROM movie_frame_trackpoints
-                               LEFT JOIN movie_frames ON movie_frame_trackpoints.frame_id = movie_frames.id
-                               WHERE movie_id=%s
-                               ORDER BY frame_number
-                               """,
-                               (movie_id,),
-                               asDicts=True)
+    trajectory = get_movie_trajectory(movie_id=movie_id)
+    if trajectory is not None:
+        return list(trajectory_trackpoints(trajectory, frame_start=frame_start, frame_end=frame_end))
+    cmd = """SELECT frame_number,x,y,label
+             FROM movie_frame_trackpoints
+             LEFT JOIN movie_frames ON movie_frame_trackpoints.frame_id = movie_frames.id
+             WHERE movie_id=%s"""
+    args = [movie_id]
+    if frame_start is not None:
+        cmd += " AND frame_number>=%s"
+        args.append(frame_start)
+    if frame_end is not None:
+        cmd += " AND frame_number<=%s"
+        args.append(frame_end)
+    return  dbpool.DBMySQL.csfr(get_dbreader(), cmd + " ORDER BY frame_number", args, asDicts=True)
+
+def iter_movie_trackpoints(*, movie_id, page_size=TRACKPOINT_PAGE_SIZE):
+    """Generator version of get_movie_trackpoints for exports. Trackpoints that are not in a trajectory
+    are read page_size at a time, each page starting after the (frame_number, label) that ended the last one,
+    so memory does not grow with the length of the movie and no connection is held while the caller sends them.
+    :return: yields trackpoint dictionaries ordered by frame_number
+    """
+    trajectory = get_movie_trajectory(movie_id=movie_id)
+    if trajectory is not None:
+        yield from trajectory_trackpoints(trajectory)
+        return
+    after = (-1, '')
+    while True:
+        rows = dbpool.DBMySQL.csfr(get_dbreader(),
+                                   """SELECT frame_number,x,y,label
+                                      FROM movie_frame_trackpoints
+                                      LEFT JOIN movie_frames ON movie_frame_trackpoints.frame_id = movie_frames.id
+                                      WHERE movie_id=%s AND (frame_number,label) > (%s,%s)
+                                      ORDER BY frame_number, label LIMIT %s""",
+                                   (movie_id, *after, page_size), asDicts=True)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1]['frame_number'], rows[-1]['label'])
+
+def get_movie_trackpoint_labels(*, movie_id):
+    """Return the labels of the trackpoints of a movie, sorted"""
+    trajectory = get_movie_trajectory(movie_id=movie_id)
+    if trajectory is not None:
+        return sorted(trajectory['labels'])
+    return [row[0] for row in dbpool.DBMySQL.csfr(get_dbreader(),
+                                                  """SELECT DISTINCT label FROM movie_frame_trackpoints
+                                                     LEFT JOIN movie_frames ON movie_frame_trackpoints.frame_id = movie_frames.id
+                                                     WHERE movie_id=%s ORDER BY label""",
+                                                  (movie_id,))]
 
 def last_tracked_frame(*, movie_id):
     """Return the last tracked frame_number of the movie"""
-    return dbfile.DBMySQL.csfr(get_dbreader(),
+    trajectory = get_movie_trajectory(movie_id=movie_id)
+    if trajectory is not None:
+        frames = np.flatnonzero(~np.isnan(trajectory['points'][:, :, 0]).all(axis=1))
+        return int(frames[-1]) if len(frames) else None
+    return dbpool.DBMySQL.csfr(get_dbreader(),
                                """SELECT max(movie_frames.frame_number)
                                FROM movie_frame_trackpoints
                                LEFT JOIN movie_frames ON movie_frame_trackpoints.frame_id = movie_frames.id
@@ -767,6 +1135,91 @@ def last_tracked_frame(*, movie_id):
                                """,
                                (movie_id,))[0][0]
 
+################################################################
+## Trajectories.
+## movie_frame_trackpoints has a row for each trackpoint, with integer x and y. Each tracking run also
+## stores the whole trajectory of the movie in movie_trajectories: the labels, and the x,y of each label
+## in each frame as float32, so reading a movie's trackpoints is one primary-key lookup and keeps the
+## sub-pixel positions that the tracker found. Changing the trackpoints of a frame deletes the trajectory,
+## and the trackpoints are read from movie_frame_trackpoints until the movie is tracked again.
+
+def put_movie_trajectory(*, movie_id, labels, points):
+    """Store the trajectory of a movie, replacing any that it had.
+    :param: labels - the label of each point
+    :param: points - float32 array of shape (frames, labels, 2), NaN where a label has no trackpoint;
+            frame 0 is the first frame of the movie. See tracker.track_movie(output='arrays').
+    """
+    points = np.ascontiguousarray(points, dtype=TRAJECTORY_DTYPE)
+    dbpool.DBMySQL.csfr(get_dbwriter(),
+                        """INSERT INTO movie_trajectories (movie_id, version, labels, frame_count, points)
+                           VALUES (%s,%s,%s,%s,%s)
+                           ON DUPLICATE KEY UPDATE version=VALUES(version), labels=VALUES(labels),
+                                                   frame_count=VALUES(frame_count), points=VALUES(points)""",
+                        (movie_id, TRAJECTORY_VERSION, json.dumps(list(labels)), len(points), points.tobytes()))
+
+# Don't log this; it is read for every download of the trackpoints
+def get_movie_trajectory(*, movie_id):
+    """Return the trajectory of a movie as a dictionary with 'labels' and 'points' (see put_movie_trajectory),
+    or None if the movie has no trajectory of the current version.
+    """
+    rows = dbpool.DBMySQL.csfr(get_dbreader(),
+                               "SELECT version, labels, frame_count, points FROM movie_trajectories WHERE movie_id=%s",
+                               (movie_id,))
+    if len(rows)!=1 or rows[0][0]!=TRAJECTORY_VERSION:
+        return None
+    (_, labels, frame_count, points) = rows[0]
+    labels = json.loads(labels)
+    return {'labels':labels,
+            'points':np.frombuffer(points, dtype=TRAJECTORY_DTYPE).reshape(frame_count, len(labels), 2)}
+
+def forget_movie_trajectory(*, movie_id=None, frame_id=None):
+    """Delete the trajectory of movie_id, or of the movie that frame_id belongs to, because its trackpoints changed."""
+    if frame_id is not None:
+        dbpool.DBMySQL.csfr(get_dbwriter(),
+                            "DELETE FROM movie_trajectories WHERE movie_id=(SELECT movie_id FROM movie_frames WHERE id=%s)",
+                            (frame_id,))
+    if movie_id is not None:
+        dbpool.DBMySQL.csfr(get_dbwriter(), "DELETE FROM movie_trajectories WHERE movie_id=%s", (movie_id,))
+
+def trajectory_coordinate(v):
+    """Round a coordinate from a trajectory for output. Whole numbers become ints, so that points that
+    were placed by hand read back as they were entered."""
+    v = round(float(v), TRAJECTORY_DECIMALS)
+    return int(v) if v.is_integer() else v
+
+def trajectory_trackpoints(trajectory, *, frame_start=None, frame_end=None):
+    """Generator for the trackpoints of a trajectory as the dictionaries that get_movie_trackpoints returns,
+    ordered by frame_number and then by label order.
+    :param: frame_start, frame_end - if provided, only the trackpoints of frames frame_start..frame_end (inclusive)
+    """
+    points = trajectory['points']
+    first  = max(0, frame_start or 0)
+    last   = len(points) if frame_end is None else min(len(points), frame_end+1)
+    if first >= last:
+        return
+    labels = trajectory['labels']
+    for (f, i) in np.argwhere(~np.isnan(points[first:last, :, 0])):
+        yield {'frame_number':first + int(f), 'x':trajectory_coordinate(points[first+f, i, 0]),
+               'y':trajectory_coordinate(points[first+f, i, 1]), 'label':labels[i]}
+
+def get_movie_trajectory_arrays(*, movie_id):
+    """Return the trackpoints of a movie as a trajectory (see get_movie_trajectory): the stored trajectory if
+    there is one; otherwise one built from movie_frame_trackpoints, with the labels sorted.
+    """
+    trajectory = get_movie_trajectory(movie_id=movie_id)
+    if trajectory is not None:
+        return trajectory
+    labels = get_movie_trackpoint_labels(movie_id=movie_id)
+    last   = last_tracked_frame(movie_id=movie_id)
+    points = np.full((0 if last is None else last+1, len(labels), 2), np.nan, dtype=TRAJECTORY_DTYPE)
+    column = {label:i for (i, label) in enumerate(labels)}
+    for tp in iter_movie_trackpoints(movie_id=movie_id):
+        # Skip trackpoints added since the labels and last frame were read
+        if tp['frame_number'] < len(points) and tp['label'] in column:
+            points[tp['frame_number'], column[tp['label']]] = (tp['x'], tp['y'])
+    return {'labels':labels, 'points':points}
+
+
 def get_frame(*,
               frame_id=None, movie_id=None, frame_number=None,
               get_annotations=False, get_trackpoints=False):
@@ -782,8 +1235,8 @@ def get_frame(*,
     else:
         where = "WHERE movie_id=%s AND frame_number=%s"
         args = [movie_id, frame_number]
-    cmd = f"""SELECT id as frame_id, movie_id, frame_number, frame_data FROM movie_frames {where} LIMIT 1"""
-    rows = dbfile.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
+    cmd = f"""SELECT id as frame_id, movie_id, frame_number, frame_data, frame_sha256 FROM movie_frames {where} LIMIT 1"""
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
     if len(rows)!=1:
         return None
     row = rows[0]
@@ -794,22 +1247,85 @@ def get_frame(*,
     return row
 
 
+# Don't log this either; it is called for every frame that is displayed
+def get_frame_bundle(*, movie_id=None, frame_number=None, frame_id=None, get_frame_data=True):
+    """Get a frame, its annotations, its trackpoints and the movie's last tracked frame in a single query.
+    The frame is specified by frame_id, or by movie_id and frame_number.
+    :param: get_frame_data - if False, frame_data is not fetched (the caller will send a URL for the frame instead)
+    :return: dictionary with movie_id, frame_id, frame_number, frame_data, frame_sha256 (of the stored JPEG, if any),
+             annotations, trackpoints, last_tracked_frame, and the movie's movie_sha256 and total_frames.
+             If the frame is not in the database, frame_id and frame_data are None and annotations and trackpoints are empty.
+             Returns None if frame_id is provided and there is no such frame.
+    """
+    frame_data = "F.frame_data" if get_frame_data else "NULL"
+    subqueries = f"""F.id AS frame_id, {frame_data} AS frame_data, F.frame_sha256,
+        (SELECT JSON_ARRAYAGG(JSON_OBJECT('movie_frame_analysis_id', A.id, 'frame_id', A.frame_id,
+                                          'engine_id', A.engine_id, 'annotations', A.annotations,
+                                          'engine_name', E.name, 'engine_version', E.version))
+           FROM movie_frame_analysis A LEFT JOIN engines E ON A.engine_id=E.id WHERE A.frame_id=F.id) AS annotations,
+        (SELECT JSON_ARRAYAGG(JSON_OBJECT('movie_frame_trackpoints_id', T.id, 'frame_id', T.frame_id,
+                                          'x', T.x, 'y', T.y, 'label', T.label))
+           FROM movie_frame_trackpoints T WHERE T.frame_id=F.id) AS trackpoints,
+        (SELECT max(F2.frame_number) FROM movie_frame_trackpoints T2 JOIN movie_frames F2 ON T2.frame_id=F2.id
+           WHERE F2.movie_id=M.movie_id) AS last_tracked_frame,
+        (SELECT movie_sha256 FROM movie_data WHERE movie_id=M.movie_id LIMIT 1) AS movie_sha256,
+        (SELECT total_frames FROM movies WHERE id=M.movie_id) AS total_frames"""
+    if frame_id is not None:
+        cmd = f"""SELECT M.movie_id, F.frame_number, {subqueries}
+                  FROM movie_frames F JOIN (SELECT movie_id FROM movie_frames WHERE id=%s) M ON F.id=%s"""
+        args = [frame_id, frame_id]
+    else:
+        # Select from the movie, so last_tracked_frame is returned even if the frame is not in the database
+        cmd = f"""SELECT M.movie_id, %s AS frame_number, {subqueries}
+                  FROM (SELECT %s AS movie_id) M
+                  LEFT JOIN movie_frames F ON F.movie_id=M.movie_id AND F.frame_number=%s"""
+        args = [frame_number, movie_id, frame_number]
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
+    if not rows:
+        return None
+    row = rows[0]
+    # JSON_ARRAYAGG does not order its results, so put them in the order of get_frame_annotations and get_frame_trackpoints
+    row['annotations'] = sorted(json.loads(row['annotations'] or '[]'),
+                                key=lambda a: (a['engine_name'] or '', a['engine_version'] or ''))
+    row['trackpoints'] = sorted(json.loads(row['trackpoints'] or '[]'),
+                                key=lambda t: t['movie_frame_trackpoints_id'])
+    return row
+
+
+engine_ids = {}                  # (engine_name, engine_version) -> engine_id; cleared when an engine is deleted
+engine_ids_lock = threading.Lock()
+
 def get_analysis_engine_id(*, engine_name, engine_version):
-    """Create an analysis engine if it does not exist, and return the engine_id"""
-    dbfile.DBMySQL.csfr(get_dbwriter(),
+    """Create an analysis engine if it does not exist, and return the engine_id.
+    The id is remembered, so only the first call for each engine writes to the database.
+    """
+    with engine_ids_lock:
+        engine_id = engine_ids.get((engine_name, engine_version))
+    if engine_id is not None:
+        return engine_id
+    dbpool.DBMySQL.csfr(get_dbwriter(),
                         """INSERT INTO engines
                         (`name`,version) VALUES (%s,%s)
                         ON DUPLICATE KEY UPDATE name=%s""",
                         (engine_name,engine_version,engine_name))
-    return dbfile.DBMySQL.csfr(get_dbreader(),
-                               """SELECT id from engines
-                               WHERE `name`=%s and version=%s""",
-                               (engine_name,engine_version))[0][0]
+    engine_id = dbpool.DBMySQL.csfr(get_dbreader(),
+                                    """SELECT id from engines
+                                    WHERE `name`=%s and version=%s""",
+                                    (engine_name,engine_version))[0][0]
+    with engine_ids_lock:
+        engine_ids[(engine_name, engine_version)] = engine_id
+    return engine_id
 
 def delete_analysis_engine_id(*, engine_id):
     """Deletes an analysis engine_id. This fails if the engine_id is in use"""
-    dbfile.DBMySQL.csfr(get_dbwriter(),
+    dbpool.DBMySQL.csfr(get_dbwriter(),
                         "DELETE from engines where id=%s",(engine_id,))
+    forget_engine_ids()
+
+def forget_engine_ids():
+    """Called when engines are deleted, so that get_analysis_engine_id creates them again"""
+    with engine_ids_lock:
+        engine_ids.clear()
 
 def encode_json(d):
     """Given json data, encode it as base64 and return as an SQL
@@ -853,7 +1369,7 @@ def put_frame_annotations(*,
     # We use base64 encoding to get by the quoting problems.
     # This means we need a format string, rather than a prepared statement.
     # The int() and the ea() provide sufficient protection.
-    dbfile.DBMySQL.csfr(get_dbwriter(),
+    dbpool.DBMySQL.csfr(get_dbwriter(),
                         f"""INSERT INTO movie_frame_analysis
                         (frame_id, engine_id, annotations)
                         VALUES ({int(frame_id)},{int(engine_id)},{ea})
@@ -870,12 +1386,61 @@ def put_frame_trackpoints(*, frame_id:int, trackpoints:list[dict]):
         if ('x' not in tp) or ('y' not in tp) or ('label') not in tp:
             raise KeyError(f'trackpoints element {tp} missing x, y or label')
         vals.extend([frame_id,tp['x'],tp['y'],tp['label']])
-    dbfile.DBMySQL.csfr(get_dbwriter(),"DELETE FROM movie_frame_trackpoints where frame_id=%s",(frame_id,))
+    dbpool.DBMySQL.csfr(get_dbwriter(),"DELETE FROM movie_frame_trackpoints where frame_id=%s",(frame_id,))
+    forget_movie_trajectory(frame_id=frame_id)
     if vals:
         args = ",".join(["(%s,%s,%s,%s)"]*len(trackpoints))
         cmd = f"INSERT INTO movie_frame_trackpoints (frame_id,x,y,label) VALUES {args}"
         logging.debug("cmd=%s vals=%s",cmd,vals)
-        dbfile.DBMySQL.csfr(get_dbwriter(),cmd,vals)
+        dbpool.DBMySQL.csfr(get_dbwriter(),cmd,vals)
+
+def put_movie_trackpoints(*, movie_id:int, trackpoints_by_frame, batch_size=TRACKPOINT_INSERT_BATCH_SIZE):
+    """Replace the trackpoints of many frames of a movie in a single transaction.
+    The frames are created if necessary with one multi-row INSERT, their ids are found with one SELECT,
+    and their trackpoints are replaced with one DELETE and multi-row INSERTs of batch_size trackpoints.
+    The movie's trajectory is deleted; a tracking run stores a new one with put_movie_trajectory.
+    :param: movie_id - the movie
+    :param: trackpoints_by_frame - iterable of (frame_number, trackpoints), where trackpoints is a list of
+            dicts that each have an x, y and label. A frame with an empty list has its trackpoints removed.
+    :return: number of trackpoints written
+    """
+    trackpoints_by_frame = dict(trackpoints_by_frame)
+    for trackpoints in trackpoints_by_frame.values():
+        for tp in trackpoints:
+            if ('x' not in tp) or ('y' not in tp) or ('label') not in tp:
+                raise KeyError(f'trackpoints element {tp} missing x, y or label')
+    if not trackpoints_by_frame:
+        return 0
+    frame_numbers = sorted(trackpoints_by_frame.keys())
+    in_frames = ",".join(["%s"]*len(frame_numbers))
+    count = 0
+    with dbpool.connection(get_dbwriter()) as conn:
+        c = conn.cursor()
+        c.execute("START TRANSACTION")
+        try:
+            c.execute("INSERT INTO movie_frames (movie_id, frame_number) VALUES " + ",".join(["(%s,%s)"]*len(frame_numbers))
+                      + " ON DUPLICATE KEY UPDATE movie_id=movie_id",
+                      [v for frame_number in frame_numbers for v in (movie_id, frame_number)])
+            c.execute(f"SELECT frame_number, id FROM movie_frames WHERE movie_id=%s AND frame_number IN ({in_frames})",
+                      [movie_id] + frame_numbers)
+            frame_ids = dict(c.fetchall())
+            c.execute(f"DELETE FROM movie_frame_trackpoints WHERE frame_id IN ({in_frames})",
+                      [frame_ids[frame_number] for frame_number in frame_numbers])
+            c.execute("DELETE FROM movie_trajectories WHERE movie_id=%s", (movie_id,))
+            vals = [(frame_ids[frame_number], tp['x'], tp['y'], tp['label'])
+                    for frame_number in frame_numbers
+                    for tp in trackpoints_by_frame[frame_number]]
+            for i in range(0, len(vals), batch_size):
+                batch = vals[i:i+batch_size]
+                c.execute("INSERT INTO movie_frame_trackpoints (frame_id,x,y,label) VALUES "
+                          + ",".join(["(%s,%s,%s,%s)"]*len(batch)),
+                          [v for row in batch for v in row])
+                count += len(batch)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+    return count
 
 def delete_frame_analysis(*, frame_id=None, engine_id=None):
     """Deletes all annotations associated with frame_id or engine_id. If frame_id is provided, also delete all trackpoints"""
@@ -892,11 +1457,12 @@ def delete_frame_analysis(*, frame_id=None, engine_id=None):
     if engine_id:
         cmd += " engine_id=%s"
         args.append(engine_id)
-    dbfile.DBMySQL.csfr(get_dbwriter(),cmd, args)
+    dbpool.DBMySQL.csfr(get_dbwriter(),cmd, args)
 
     if frame_id is not None:
         cmd = "DELETE FROM movie_trackpoints WHERE frame_id=%s"
-        dbfile.DBMySQL.csfr(get_dbwriter(), cmd, [frame_id,])
+        dbpool.DBMySQL.csfr(get_dbwriter(), cmd, [frame_id,])
+        forget_movie_trajectory(frame_id=frame_id)
 
 
 def delete_analysis_engine(*, engine_name, version=None, recursive=None):
@@ -911,10 +1477,11 @@ def delete_analysis_engine(*, engine_name, version=None, recursive=None):
         where += "AND version=%s "
         args.append(version)
     if recursive:
-        dbfile.DBMySQL.csfr(get_dbwriter(), f"delete from movie_analysis where engine_id in (SELECT id from engines where {where})",args)
-        dbfile.DBMySQL.csfr(get_dbwriter(), f"delete from movie_frame_analysis where engine_id in (SELECT id from engines where {where})",args)
+        dbpool.DBMySQL.csfr(get_dbwriter(), f"delete from movie_analysis where engine_id in (SELECT id from engines where {where})",args)
+        dbpool.DBMySQL.csfr(get_dbwriter(), f"delete from movie_frame_analysis where engine_id in (SELECT id from engines where {where})",args)
 
-    dbfile.DBMySQL.csfr(get_dbwriter(), f"delete from engines where {where}",args)
+    dbpool.DBMySQL.csfr(get_dbwriter(), f"delete from engines where {where}",args)
+    forget_engine_ids()
 
 
 # Don't log this; we run list_movies every time the page is refreshed
@@ -929,7 +1496,7 @@ def list_movies(*,user_id, movie_id=None, orig_movie=None, no_frames=False):
     cmd = """SELECT users.name as name,users.email as email,users.primary_course_id as primary_course_id,
           movies.id as movie_id,title,description,movies.created_at as created_at,
           user_id,course_id,published,deleted,date_uploaded,orig_movie,
-          fps,width,height,total_frames,total_bytes
+          fps,width,height,total_frames,total_bytes,movies.status as status
           FROM movies LEFT JOIN users ON movies.user_id = users.id
           WHERE
           ((user_id=%s)
@@ -952,7 +1519,7 @@ def list_movies(*,user_id, movie_id=None, orig_movie=None, no_frames=False):
         cmd += " AND (movies.id not in (select distinct movie_id from movie_frames)) "
     cmd += " ORDER BY movies.id "
 
-    res = dbfile.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
+    res = dbpool.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
     return res
 
 ###
@@ -962,28 +1529,53 @@ def list_movies(*,user_id, movie_id=None, orig_movie=None, no_frames=False):
 @log
 def create_new_movie_analysis(*, movie_id, engine_id, annotations):
     if movie_id:
-        movie_analysis_id = dbfile.DBMySQL.csfr(get_dbwriter(),
+        movie_analysis_id = dbpool.DBMySQL.csfr(get_dbwriter(),
                                                 """INSERT INTO movie_analysis (movie_id, engine_id, annotations) VALUES (%s,%s,%s)""",
                                                 (movie_id, engine_id, annotations))
         return {'movie_analysis_id': movie_analysis_id}
     else:
         return {'movie_analysis_id': None}
 
+# Don't log these; the annotations can be large
+def get_movie_analysis(*, movie_id, engine_id):
+    """Return the most recent annotations of movie_id by engine_id, decoded from JSON, or None if there are none"""
+    rows = dbpool.DBMySQL.csfr(get_dbreader(),
+                               "SELECT annotations FROM movie_analysis WHERE movie_id=%s AND engine_id=%s ORDER BY id DESC LIMIT 1",
+                               (movie_id, engine_id))
+    if not rows or rows[0][0] is None:
+        return None
+    return json.loads(rows[0][0])
+
+def put_movie_analysis(*, movie_id, engine_id, annotations):
+    """Replace the annotations of movie_id by engine_id"""
+    with dbpool.connection(get_dbwriter()) as conn:
+        c = conn.cursor()
+        c.execute("START TRANSACTION")
+        try:
+            c.execute("DELETE FROM movie_analysis WHERE movie_id=%s AND engine_id=%s", (movie_id, engine_id))
+            c.execute("INSERT INTO movie_analysis (movie_id, engine_id, annotations) VALUES (%s,%s,%s)",
+                      (movie_id, engine_id, json.dumps(annotations)))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
 @log
 def delete_movie_analysis(*,movie_analysis_id):
-    dbfile.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_analysis WHERE id=%s", ([movie_analysis_id]))
+    dbpool.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_analysis WHERE id=%s", ([movie_analysis_id]))
 
 @log
 def purge_engine(*,engine_id):
     assert engine_id is not None
-    dbfile.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_analysis WHERE engine_id=%s", ([engine_id]))
-    dbfile.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_frame_analysis WHERE engine_id=%s", ([engine_id]))
+    dbpool.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_analysis WHERE engine_id=%s", ([engine_id]))
+    dbpool.DBMySQL.csfr( get_dbwriter(), "DELETE from movie_frame_analysis WHERE engine_id=%s", ([engine_id]))
     delete_engine(engine_id=engine_id)
 
 @log
 def delete_engine(*,engine_id):
     assert engine_id is not None
-    dbfile.DBMySQL.csfr( get_dbwriter(), "DELETE from engines WHERE id=%s", ([engine_id]))
+    dbpool.DBMySQL.csfr( get_dbwriter(), "DELETE from engines WHERE id=%s", ([engine_id]))
+    forget_engine_ids()
 
 ################################################################
 ## Logs
@@ -1006,6 +1598,7 @@ def get_logs( *, user_id , start_time = 0, end_time = None, course_id=None,
     """
 
     count = max(count, LOG_MAX_RECORDS)
+    flush_logs()
 
     # First find all of the records requested by the searcher
     cmd = """SELECT * FROM logs WHERE (time_t >= %s """
@@ -1073,7 +1666,7 @@ def get_logs( *, user_id , start_time = 0, end_time = None, course_id=None,
     args.append(count)
     args.append(offset)
 
-    return dbfile.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
+    return dbpool.DBMySQL.csfr(get_dbreader(), cmd, args, asDicts=True)
 
 
 
@@ -1105,6 +1698,22 @@ SET_MOVIE_METADATA = {
 }
 
 
+# Don't log this; it is read repeatedly while a movie is tracked
+def get_movie_status(*, movie_id):
+    """Return the status and total_frames of a movie, without the joins of get_movie_metadata"""
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT status, total_frames FROM movies WHERE id=%s", (movie_id,), asDicts=True)
+    if len(rows)!=1:
+        raise InvalidMovie_Id(f"movie_id={movie_id}")
+    return rows[0]
+
+# Don't log this; it is called repeatedly while a movie is tracked
+def set_movie_status(*, movie_id, status):
+    """Set the status of a movie without the permission checks of set_metadata.
+    Only for the tracker, which runs after the request that started it checked the user's access to the movie.
+    """
+    dbpool.DBMySQL.csfr(get_dbwriter(), "UPDATE movies SET status=%s WHERE id=%s", (status, movie_id))
+
+
 @log
 def set_metadata(*, user_id, set_movie_id=None, set_user_id=None, prop, value):
     """We tried doing this in a single statement and it failed"""
@@ -1122,12 +1731,12 @@ def set_metadata(*, user_id, set_movie_id=None, set_user_id=None, prop, value):
 
     if set_movie_id:
         # We are changing metadata for a movie; make sure that this user is allowed to do so
-        res = dbfile.DBMySQL.csfr(
+        res = dbpool.DBMySQL.csfr(
             get_dbreader(),
             """SELECT %s in (select user_id from movies where id=%s)""", (user_id, set_movie_id))
         # Find out if the user is the owner of the movie
         is_owner = MAPPER[res[0][0]]
-        res = dbfile.DBMySQL.csfr(get_dbreader(),
+        res = dbpool.DBMySQL.csfr(get_dbreader(),
                                   """
                                   SELECT %s IN (select user_id from admins
                                                 WHERE course_id=(select course_id
@@ -1139,15 +1748,15 @@ def set_metadata(*, user_id, set_movie_id=None, set_user_id=None, prop, value):
         # Create the command that updates the movie metadata if the user is the owner of the movie or admin
         cmd   = SET_MOVIE_METADATA[prop].replace( '@is_owner', is_owner).replace('@is_admin', is_admin)
         args  = [value, set_movie_id]
-        ret   = dbfile.DBMySQL.csfr(get_dbwriter(), cmd, args)
-        return ret
+        # None of these properties are in ACCESS_WHERE, so the cached access sets are still right
+        return dbpool.DBMySQL.csfr(get_dbwriter(), cmd, args)
 
     # Currently, users can only set their own data
     if set_user_id:
         if user_id == set_user_id:
             prop = prop.lower()
             if prop in ['name', 'email']:
-                ret = dbfile.DBMySQL.csfr(get_dbwriter(),
+                ret = dbpool.DBMySQL.csfr(get_dbwriter(),
                                           f"UPDATE users set {prop}=%s where id=%s",
                                           (value, user_id))
                 return ret
@@ -1168,14 +1777,14 @@ class Movie():
         if (user_id is not None) and not can_access_movie(user_id=user_id, movie_id=movie_id):
             raise UnauthorizedUser(f"user_id={user_id} movie_id={movie_id}")
         self.movie_id = movie_id
-        rows = dbfile.DBMySQL.csfr(get_dbreader(),
+        rows = dbpool.DBMySQL.csfr(get_dbreader(),
                                    "SELECT movie_data,movie_sha256 from movie_data where movie_id=%s LIMIT 1",
                                    (self.movie_id,))
         if len(rows)!=1:
             raise InvalidMovie_Id(f"movie_id={self.movie_id}")
         (self.data,self.sha256) = rows[0]
         if self.data is None:
-            rows = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT urn from objects where sha256=%s LIMIT 1", (self.sha256,))
+            rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT urn from objects where sha256=%s LIMIT 1", (self.sha256,))
             try:
                 self.urn = rows[0][0]
             except IndexError as e:
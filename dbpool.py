@@ -0,0 +1,234 @@
+"""
+Thread-safe pool of MySQL connections.
+
+dbfile.DBMySQL.csfr opens and closes a connection for every query, and a single API request makes
+many queries. The pool keeps connections open between queries, per set of credentials, so that a
+request (or a warm AWS Lambda invocation) reuses them.
+
+* The pool is bounded; when every connection is in use, callers wait up to POOL_TIMEOUT seconds.
+* Connections that have been idle for more than PING_INTERVAL seconds are pinged before they are used,
+  and are replaced if they have gone stale (e.g. after the server's wait_timeout, or a frozen Lambda).
+* stats() reports how often callers waited and for how long, so that the pool can be sized.
+
+dbpool.DBMySQL.csfr is a drop-in replacement for dbfile.DBMySQL.csfr. Setting PLANTTRACER_DB_POOL_SIZE=0
+disables pooling and sends every query to dbfile.DBMySQL.csfr.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import pymysql
+
+from lib.ctools import dbfile
+
+POOL_SIZE_ENVIRON = 'PLANTTRACER_DB_POOL_SIZE'
+POOL_SIZE = int(os.environ.get(POOL_SIZE_ENVIRON, '8') or 0) # connections per set of credentials
+POOL_TIMEOUT = 30               # seconds to wait for a connection before raising PoolTimeout
+PING_INTERVAL = 30              # seconds a connection may be idle before it is pinged
+STALE_ERRORS = (2006, 2013)     # MySQL server has gone away; lost connection to MySQL server during query
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became available within POOL_TIMEOUT"""
+
+
+class ConnectionPool:
+    """A bounded pool of connections that all use the same credentials"""
+    def __init__(self, auth, *, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.auth = auth
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.idle = []          # (connection, time last used); the most recently used is last
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.reconnects = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.max_in_use = 0
+
+    def connect(self):
+        return pymysql.connect(host=self.auth.host,
+                               port=int(getattr(self.auth, 'port', None) or 3306),
+                               user=self.auth.user,
+                               password=self.auth.password,
+                               database=self.auth.database,
+                               autocommit=True)
+
+    def acquire(self):
+        """Return a connection, waiting if every connection is in use.
+        :raises PoolTimeout: if no connection becomes available within self.timeout seconds.
+        """
+        with self.cond:
+            if not self.idle and self.in_use >= self.max_size:
+                self.waits += 1
+                t0 = time.time()
+                ok = self.cond.wait_for(lambda: self.idle or self.in_use < self.max_size, timeout=self.timeout)
+                self.wait_time += time.time() - t0
+                if not ok:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"no database connection available after {self.timeout} seconds")
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            (conn, last_used) = self.idle.pop() if self.idle else (None, None)
+        try:
+            if conn is None:
+                conn = self.connect()
+                with self.cond:
+                    self.created += 1
+                return conn
+            if time.time() - last_used > PING_INTERVAL:
+                try:
+                    conn.ping(reconnect=False)
+                except pymysql.err.Error:
+                    self.discard(conn)
+                    conn = self.connect()
+                    with self.cond:
+                        self.reconnects += 1
+            with self.cond:
+                self.reused += 1
+            return conn
+        except BaseException:
+            self.release(None)
+            raise
+
+    def release(self, conn):
+        """Return conn to the pool. If conn is None, the connection was discarded."""
+        with self.cond:
+            self.in_use -= 1
+            if conn is not None:
+                self.idle.append((conn, time.time()))
+            self.cond.notify()
+
+    @staticmethod
+    def discard(conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Context manager for a connection. If the block raises a database error, the connection is closed rather than reused."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.discard(conn)
+            conn = None
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close the idle connections"""
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for (conn, _) in idle:
+            self.discard(conn)
+
+    def stats(self):
+        with self.cond:
+            return {'max_size': self.max_size,
+                    'in_use': self.in_use,
+                    'idle': len(self.idle),
+                    'max_in_use': self.max_in_use,
+                    'created': self.created,
+                    'reused': self.reused,
+                    'reconnects': self.reconnects,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time,
+                    'timeouts': self.timeouts}
+
+
+pools = {}                      # (host, port, user, database) -> ConnectionPool
+pools_lock = threading.Lock()
+
+def get_pool(auth):
+    key = (auth.host, getattr(auth, 'port', None), auth.user, auth.database)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(auth)
+        return pools[key]
+
+@contextmanager
+def connection(auth):
+    """Context manager for a pooled connection, for callers that need more than one statement (e.g. a transaction)"""
+    if POOL_SIZE <= 0:
+        conn = ConnectionPool(auth).connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+    with get_pool(auth).connection() as conn:
+        yield conn
+
+def read_only(cmd):
+    """Return True if cmd is a statement that changes nothing, so running it twice is harmless"""
+    words = cmd.split()
+    return bool(words) and words[0].upper() in ('SELECT', 'SHOW', 'DESCRIBE') and 'FOR UPDATE' not in cmd.upper()
+
+def csfr(auth, cmd, vals=None, *, asDicts=False, get_column_names=None, debug=False):
+    """Connect, select, fetchall. Same semantics as dbfile.DBMySQL.csfr:
+    :param: auth - authentication token (e.g. from get_dbreader() or get_dbwriter())
+    :param: cmd  - SQL statement
+    :param: vals - values for the SQL statement
+    :param: asDicts - return each row as a dictionary
+    :param: get_column_names - if a list is provided, it is filled with the column names
+    :return: for statements that return rows, a tuple of rows (a list of dicts if asDicts);
+             lastrowid for INSERT, otherwise the number of rows affected.
+    The statement is retried once only if retrying cannot apply it twice: if checking out the connection
+    failed (e.g. a stale connection failed its ping and could not be replaced), if the connection was closed
+    before the statement was sent, or if a read-only statement lost its connection (STALE_ERRORS).
+    A lost connection during an INSERT or UPDATE is raised, because the server may have applied it.
+    """
+    if POOL_SIZE <= 0:
+        return dbfile.DBMySQL.csfr(auth, cmd, vals, asDicts=asDicts, get_column_names=get_column_names, debug=debug)
+    if debug:
+        logging.info("cmd=%s vals=%s", cmd, vals)
+    for attempt in (1, 2):
+        sent = False
+        try:
+            with connection(auth) as conn:
+                with conn.cursor() as c:
+                    sent = True
+                    c.execute(cmd, vals)
+                    if c.description is not None:
+                        rows = c.fetchall()
+                        if asDicts or get_column_names is not None:
+                            names = [d[0] for d in c.description]
+                            if get_column_names is not None:
+                                get_column_names.clear()
+                                get_column_names.extend(names)
+                            if asDicts:
+                                rows = [dict(zip(names, row)) for row in rows]
+                        return rows
+                    if cmd.lstrip()[0:6].upper()=='INSERT':
+                        return c.lastrowid
+                    return c.rowcount
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            # pymysql raises InterfaceError when the connection was already closed, before sending anything
+            retry = ((not sent) or isinstance(e, pymysql.err.InterfaceError)
+                     or (read_only(cmd) and e.args[0] in STALE_ERRORS))
+            if attempt==2 or not retry:
+                raise
+            logging.warning("retrying after stale database connection: %s", e)
+    raise RuntimeError("not reached")
+
+def stats():
+    """Return the stats of every pool"""
+    with pools_lock:
+        return {f"{user}@{host}/{database}": pool.stats()
+                for ((host, _, user, database), pool) in pools.items()}
+
+
+# pylint: disable=too-few-public-methods
+class DBMySQL:
+    """Drop-in replacement for dbfile.DBMySQL.csfr that uses the pool"""
+    csfr = staticmethod(csfr)
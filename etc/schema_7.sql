@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS `jobs` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `kind` varchar(64) NOT NULL,
+  `args` json NOT NULL,
+  `status` varchar(16) NOT NULL DEFAULT 'queued',
+  `user_id` int DEFAULT NULL,
+  `movie_id` int DEFAULT NULL,
+  `attempts` int NOT NULL DEFAULT '0',
+  `max_attempts` int NOT NULL DEFAULT '3',
+  `run_after` int NOT NULL DEFAULT '0',
+  `worker` varchar(255) DEFAULT NULL,
+  `claim` varchar(64) DEFAULT NULL,
+  `error` text,
+  `created_at` int NOT NULL DEFAULT (unix_timestamp()),
+  `started_at` int DEFAULT NULL,
+  `heartbeat_at` int DEFAULT NULL,
+  `finished_at` int DEFAULT NULL,
+  `mtime` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `status` (`status`,`run_after`),
+  KEY `claim` (`claim`),
+  KEY `user_id` (`user_id`),
+  KEY `movie_id` (`movie_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+UPDATE metadata set v=7 where k='schema_version';
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS `movie_trajectories` (
+  `movie_id` int NOT NULL,
+  `version` int NOT NULL DEFAULT '1',
+  `labels` json NOT NULL,
+  `frame_count` int NOT NULL,
+  `points` longblob NOT NULL,
+  `mtime` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`movie_id`),
+  CONSTRAINT `movie_trajectories_movie` FOREIGN KEY (`movie_id`) REFERENCES `movies` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+UPDATE metadata set v=8 where k='schema_version';
@@ -0,0 +1,2 @@
+UPDATE movie_frames SET frame_sha256=SHA2(frame_data,256) WHERE frame_data IS NOT NULL AND frame_sha256 IS NULL;
+UPDATE metadata set v=9 where k='schema_version';
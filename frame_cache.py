@@ -0,0 +1,171 @@
+"""
+Cache of JPEG frames extracted from movies.
+
+Frames are keyed by (movie_sha256, frame_number), so every movie with the same content shares them.
+There are two tiers:
+* memory - a bounded LRU shared by all of the requests served by this process.
+* disk   - an optional directory of JPEG files. On AWS Lambda this is the ephemeral storage in /tmp,
+           so warm containers reuse the frames that they have already decoded.
+
+Hit and miss counters are kept so that the cache can be sized; see stats().
+"""
+
+import os
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import paths
+
+FRAME_CACHE_MAX_BYTES = 64*1024*1024           # memory tier
+FRAME_CACHE_MAX_DISK_BYTES = 512*1024*1024     # disk tier; Lambda ephemeral storage is 1024MB
+FRAME_CACHE_DIR_ENVIRON = 'PLANTTRACER_FRAME_CACHE_DIR'
+LAMBDA_FRAME_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'planttracer-frames')
+
+
+def default_cache_dir():
+    """Use the directory in PLANTTRACER_FRAME_CACHE_DIR if set, the ephemeral storage on Lambda, otherwise no disk tier."""
+    if FRAME_CACHE_DIR_ENVIRON in os.environ:
+        return os.environ[FRAME_CACHE_DIR_ENVIRON] or None
+    if paths.running_in_aws_lambda():
+        return LAMBDA_FRAME_CACHE_DIR
+    return None
+
+
+class FrameCache:
+    """Thread-safe LRU cache of JPEG frames, with an optional disk tier."""
+    def __init__(self, *, max_bytes=FRAME_CACHE_MAX_BYTES, cache_dir=None, max_disk_bytes=FRAME_CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()  # (movie_sha256, frame_number) -> jpeg
+        self.bytes = 0
+        # Warm Lambda containers and restarted servers find the frames that earlier processes wrote
+        self.disk_bytes = sum(size for (_, size, _) in self.disk_entries())
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def disk_path(self, movie_sha256, frame_number):
+        return os.path.join(self.cache_dir, movie_sha256, f"{int(frame_number)}.jpg")
+
+    def get(self, movie_sha256, frame_number):
+        """Return the cached JPEG, or None if it is not in either tier."""
+        key = (movie_sha256, frame_number)
+        with self.lock:
+            jpeg = self.frames.get(key)
+            if jpeg is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return jpeg
+        if self.cache_dir:
+            try:
+                with open(self.disk_path(movie_sha256, frame_number), 'rb') as f:
+                    jpeg = f.read()
+            except OSError:
+                jpeg = None
+            if jpeg:
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, jpeg)
+                return jpeg
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, movie_sha256, frame_number, jpeg):
+        """Add a JPEG to the memory tier and, if configured, the disk tier."""
+        self._put_memory((movie_sha256, frame_number), jpeg)
+        if self.cache_dir:
+            self._put_disk(movie_sha256, frame_number, jpeg)
+
+    def _put_memory(self, key, jpeg):
+        if len(jpeg) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.frames[key] = jpeg
+            self.bytes += len(jpeg)
+            while self.bytes > self.max_bytes:
+                (_, evicted) = self.frames.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def _put_disk(self, movie_sha256, frame_number, jpeg):
+        path = self.disk_path(movie_sha256, frame_number)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary name and rename, so that readers in other threads never see a partial file
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp, 'wb') as f:
+                f.write(jpeg)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning("frame cache cannot write %s: %s", path, e)
+            return
+        with self.lock:
+            self.disk_bytes += len(jpeg) - replaced
+            trim = self.disk_bytes > self.max_disk_bytes
+        if trim:
+            self.trim_disk()
+
+    def disk_entries(self):
+        """Return (mtime, size, path) for every file in the disk tier."""
+        entries = []
+        if not self.cache_dir:
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for fname in files:
+                try:
+                    st = os.stat(os.path.join(root, fname))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, fname)))
+        return entries
+
+    def trim_disk(self):
+        """Delete the least recently written frames until the disk tier is at 3/4 of its budget."""
+        entries = sorted(self.disk_entries())
+        total = sum(e[1] for e in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_disk_bytes * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        with self.lock:
+            self.disk_bytes = total
+
+    def stats(self):
+        """Return the counters, so that the cache can be sized"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'frames': len(self.frames),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'disk_bytes': self.disk_bytes,
+                    'cache_dir': self.cache_dir,
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None}
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+
+cache = FrameCache(cache_dir=default_cache_dir())
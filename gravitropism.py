@@ -1,10 +1,19 @@
 """ Implement the gravitropism algorithm """
 
 
+import re
 import math
 
+import numpy as np
+
 from constants import E
 
+GRAVITROPISM_ENGINE = 'GRAVITROPISM'
+GRAVITROPISM_VERSION = '1'      # change when analyze_trajectory changes, so that cached results are recomputed
+RULER_ZERO_LABEL = 'ruler 0 mm'
+RULER_RE = re.compile(r'ruler ([1-9]\d*) mm')   # the other end of the ruler; the number is its distance from 0
+SMOOTHING_FRAMES = 5            # width of the moving average used for smoothed rates
+
 
 def calculate_results_gravitropism(x1, y1, x2, y2, time_elapsed):
     """
@@ -48,3 +57,109 @@ def calculate_results_gravitropism(x1, y1, x2, y2, time_elapsed):
     angle = round(angle, 2)
 
     return {'distance': distance, 'rate': rate, 'angle': angle}
+
+
+def ruler_mm_per_pixel(labels, points):
+    """Find the scale of a movie from its ruler trackpoints.
+    :param: labels - the label of each point
+    :param: points - array of shape (frames, labels, 2), NaN where a label has no trackpoint
+    :return: mm per pixel, from the first frame with both 'ruler 0 mm' and the longest 'ruler N mm';
+             None if the movie has no ruler
+    """
+    if RULER_ZERO_LABEL not in labels:
+        return None
+    rulers = [(int(m.group(1)), i) for (i, label) in enumerate(labels) if (m := RULER_RE.fullmatch(label))]
+    if not rulers:
+        return None
+    (distance_mm, end) = max(rulers)
+    zero = labels.index(RULER_ZERO_LABEL)
+    pixels = np.hypot(*(points[:, end] - points[:, zero]).T)
+    found = np.flatnonzero(pixels > 0)
+    if len(found) == 0:
+        return None
+    return distance_mm / float(pixels[found[0]])
+
+def moving_average(values, window):
+    """Centered moving average along axis 0 that ignores NaN. Windows with no values are NaN."""
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.where(present, values, 0), axis=0)
+    counts = np.cumsum(present, axis=0)
+    pad = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([pad, sums])
+    counts = np.concatenate([pad, counts])
+    n = len(values)
+    lo = np.clip(np.arange(n) - window // 2, 0, n)
+    hi = np.clip(np.arange(n) + (window - window // 2), 0, n)
+    count = counts[hi] - counts[lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (sums[hi] - sums[lo]) / count, np.nan)
+
+def analyze_trajectory(*, labels, points, seconds_per_frame, mm_per_pixel=None, smoothing=SMOOTHING_FRAMES):
+    """Compute the motion of every tracked point of a movie in one vectorized pass.
+    Ruler labels are used for calibration and are not analyzed.
+    :param: labels - the label of each point
+    :param: points - array of shape (frames, labels, 2), NaN where a label has no trackpoint
+    :param: seconds_per_frame - time between frames
+    :param: mm_per_pixel - scale; if None, it comes from the ruler, and if there is no ruler, distances are in pixels
+    :param: smoothing - width in frames of the moving average for smoothed_rate
+    :return: A dictionary of
+        units - 'mm' or 'pixels'
+        mm_per_pixel, seconds_per_frame, frame_count
+        tracks - label -> dictionary of per-frame lists, None where there is no value:
+            x, y - position (units)
+            displacement - distance from the first position (units)
+            distance - distance moved since the previous frame (units)
+            rate - rate of movement (units/min)
+            smoothed_rate - moving average of rate over `smoothing` frames (units/min)
+            angle - angle of movement since the previous frame relative to positive x-axis (degrees),
+                    as in calculate_results_gravitropism
+            curvature - cumulative change of angle since the first movement (degrees)
+    """
+    if seconds_per_frame is None or seconds_per_frame <= 0:
+        raise TypeError(E.CALC_RESULTS_PARAM_INVALID['message'])
+    if mm_per_pixel is None:
+        mm_per_pixel = ruler_mm_per_pixel(labels, points)
+    scale = mm_per_pixel or 1.0
+    tracked = [i for (i, label) in enumerate(labels) if label != RULER_ZERO_LABEL and not RULER_RE.fullmatch(label)]
+    xy = np.asarray(points, dtype=np.float64)[:, tracked] * scale        # (frames, tracked, 2)
+    frames = len(xy)
+
+    # The first position of each label
+    present = ~np.isnan(xy[:, :, 0])
+    origin = xy[np.argmax(present, axis=0), np.arange(len(tracked))] if frames else np.zeros((len(tracked), 2))
+    displacement = np.hypot(xy[:, :, 0] - origin[:, 0], xy[:, :, 1] - origin[:, 1])
+
+    # Movement from the previous frame; NaN for the first frame
+    step = np.concatenate([np.full((1, len(tracked), 2), np.nan), np.diff(xy, axis=0)])[:frames]
+    distance = np.hypot(step[:, :, 0], step[:, :, 1])
+    rate = distance / (seconds_per_frame / 60)
+    heading = np.arctan2(step[:, :, 1], step[:, :, 0])
+    angle = np.degrees(heading)
+
+    # Cumulative curvature: the sum of the changes in heading from one movement to the next,
+    # each wrapped to -180..180 degrees. previous is the last frame before each frame with movement.
+    moving = distance > 0
+    index = np.where(moving, np.arange(frames)[:, None], -1)
+    previous = np.maximum.accumulate(np.concatenate([np.full((1, len(tracked)), -1), index]), axis=0)[:-1]
+    turn = heading - np.take_along_axis(heading, np.maximum(previous, 0), axis=0)
+    turn = np.where(moving & (previous >= 0), (turn + np.pi) % (2 * np.pi) - np.pi, 0)
+    curvature = np.where(present, np.degrees(np.cumsum(turn, axis=0)), np.nan)
+
+    smoothed_rate = moving_average(rate, smoothing)
+
+    def column(values, j):
+        return [None if math.isnan(v) else round(float(v), 4) for v in values[:, j]]
+    tracks = {labels[i]: {'x': column(xy[:, :, 0], j),
+                          'y': column(xy[:, :, 1], j),
+                          'displacement': column(displacement, j),
+                          'distance': column(distance, j),
+                          'rate': column(rate, j),
+                          'smoothed_rate': column(smoothed_rate, j),
+                          'angle': column(angle, j),
+                          'curvature': column(curvature, j)}
+              for (j, i) in enumerate(tracked)}
+    return {'units': 'mm' if mm_per_pixel else 'pixels',
+            'mm_per_pixel': mm_per_pixel,
+            'seconds_per_frame': seconds_per_frame,
+            'frame_count': frames,
+            'tracks': tracks}
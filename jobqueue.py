@@ -0,0 +1,292 @@
+"""
+Durable job queue for work that is too slow to do in a request, such as tracking a movie.
+
+Jobs are rows in the `jobs` table. A worker process (python jobqueue.py --worker) claims queued jobs
+and runs them with the handler registered for their kind. Throughput scales by running more workers,
+rather than by tying up request threads.
+
+* Each job has a status: queued, running, done, failed or cancelled.
+* A job that raises is retried after RETRY_DELAY seconds (doubling each time), up to max_attempts times.
+  The failure handler registered for its kind is told each time, so it can show the failure to the user.
+* A running job's worker updates heartbeat_at every HEARTBEAT_INTERVAL seconds. Jobs whose worker
+  stops updating it for STALE_AFTER seconds are requeued, so a job is not lost when a worker dies.
+* Cancelling a running job sets the threading.Event that its handler receives as `cancelled`;
+  handlers are expected to check it and stop.
+* Concurrency is limited by the number of threads in each worker, by MAX_RUNNING_PER_USER,
+  and by running at most one job for a movie at a time. Workers claim jobs one at a time while
+  holding the MySQL named lock CLAIM_LOCK, so two workers cannot both take the last free slot.
+
+On AWS Lambda the zappa @task mechanism is used instead. Set PLANTTRACER_JOB_QUEUE=Y
+where workers are running to have the API enqueue jobs here.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+
+import dbpool
+from auth import get_dbreader, get_dbwriter
+
+# If set, slow API calls enqueue jobs for workers rather than running them with zappa's @task
+JOB_QUEUE = os.environ.get('PLANTTRACER_JOB_QUEUE',' ')[0:1] in 'yYtT1'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30                # seconds before the first retry of a failed job
+HEARTBEAT_INTERVAL = 10         # seconds between updates of heartbeat_at while a job runs
+STALE_AFTER = 120               # seconds without a heartbeat before a running job is requeued
+POLL_INTERVAL = 2               # seconds an idle worker waits before looking for another job
+MAX_RUNNING_PER_USER = 2
+CLAIM_LOCK = 'planttracer_jobs_claim'   # MySQL named lock held while claiming a job
+CLAIM_LOCK_TIMEOUT = 10         # seconds to wait for CLAIM_LOCK before giving up
+WORKER_THREADS = int(os.environ.get('PLANTTRACER_JOB_WORKER_THREADS','1') or 1)
+
+
+class JobCancelled(Exception):
+    """Raised by a handler when it notices that its job was cancelled"""
+
+
+handlers = {}                   # kind -> function(**args, cancelled=threading.Event)
+failure_handlers = {}           # kind -> function(job, error, retrying)
+
+def register_handler(kind, func, on_fail=None):
+    """Register the function that runs jobs of kind.
+    :param: on_fail - if provided, called with (job, error, retrying) each time a job of kind fails,
+                      where retrying is True if the job was requeued and False if it has failed for good.
+    """
+    handlers[kind] = func
+    if on_fail is not None:
+        failure_handlers[kind] = on_fail
+    else:
+        failure_handlers.pop(kind, None)
+
+def notify_failure(job, error, retrying):
+    """Call the failure handler for the job's kind. Its errors are logged, not raised."""
+    on_fail = failure_handlers.get(job['kind'])
+    if on_fail is None:
+        return
+    try:
+        on_fail(job, error, retrying)
+    except Exception as e:   # pylint: disable=broad-exception-caught
+        logging.warning("job %s: failure handler failed: %s", job['id'], e)
+
+
+def enqueue(*, kind, args, user_id=None, movie_id=None, max_attempts=MAX_ATTEMPTS):
+    """Add a job to the queue.
+    :param: kind - which handler runs the job
+    :param: args - dictionary of keyword arguments for the handler; must be JSON serializable
+    :return: job_id
+    """
+    return dbpool.DBMySQL.csfr(get_dbwriter(),
+                               """INSERT INTO jobs (kind, args, status, user_id, movie_id, max_attempts)
+                                  VALUES (%s, %s, %s, %s, %s, %s)""",
+                               (kind, json.dumps(args), QUEUED, user_id, movie_id, max_attempts))
+
+def get_job(*, job_id):
+    """Return the job as a dictionary, or None if there is no such job"""
+    rows = dbpool.DBMySQL.csfr(get_dbreader(), "SELECT * FROM jobs WHERE id=%s", (job_id,), asDicts=True)
+    if not rows:
+        return None
+    job = rows[0]
+    job['args'] = json.loads(job['args'])
+    return job
+
+def cancel(*, job_id):
+    """Cancel a job that is queued or running.
+    :return: True if the job was cancelled, False if it had already finished.
+    """
+    return dbpool.DBMySQL.csfr(get_dbwriter(),
+                               """UPDATE jobs SET status=%s, finished_at=unix_timestamp()
+                                  WHERE id=%s AND status IN (%s, %s)""",
+                               (CANCELLED, job_id, QUEUED, RUNNING)) > 0
+
+def claim(*, worker, kinds=None, max_per_user=MAX_RUNNING_PER_USER):
+    """Take the oldest job that may run now, skipping users at their limit and movies with a running job.
+    The limits are checked and the job is taken while holding CLAIM_LOCK, so claims from
+    different workers are serialized and cannot exceed the limits.
+    :param: worker - recorded in the job
+    :param: kinds - if provided, only claim jobs of these kinds
+    :return: the job as a dictionary, or None if there is nothing to do (or CLAIM_LOCK could not be had).
+    """
+    token = uuid.uuid4().hex
+    kinds_clause = ''
+    kinds_args = []
+    if kinds:
+        kinds_clause = 'AND kind IN (' + ','.join(['%s']*len(kinds)) + ')'
+        kinds_args = list(kinds)
+    # A named lock belongs to a connection, so the lock, the claim and the release all use this one.
+    # The connection is in autocommit mode, so the claim is committed before the lock is released.
+    with dbpool.connection(get_dbwriter()) as conn:
+        with conn.cursor() as c:
+            c.execute("SELECT GET_LOCK(%s, %s)", (CLAIM_LOCK, CLAIM_LOCK_TIMEOUT))
+            if c.fetchone()[0] != 1:
+                logging.warning("%s: timed out waiting for %s", worker, CLAIM_LOCK)
+                return None
+            try:
+                # The subqueries are DISTINCT or GROUP BY, so MySQL materializes them rather than
+                # reading the table that is being updated.
+                count = c.execute(f"""UPDATE jobs SET status=%s, worker=%s, claim=%s, attempts=attempts+1,
+                                             started_at=unix_timestamp(), heartbeat_at=unix_timestamp(), error=NULL
+                                      WHERE status=%s AND run_after<=unix_timestamp() {kinds_clause}
+                                        AND (user_id IS NULL OR user_id NOT IN
+                                             (SELECT user_id FROM (SELECT user_id FROM jobs WHERE status=%s AND user_id IS NOT NULL
+                                                                   GROUP BY user_id HAVING count(*)>=%s) AS busy_users))
+                                        AND (movie_id IS NULL OR movie_id NOT IN
+                                             (SELECT movie_id FROM (SELECT DISTINCT movie_id FROM jobs WHERE status=%s
+                                                                    AND movie_id IS NOT NULL) AS busy_movies))
+                                      ORDER BY id LIMIT 1""",
+                                  [RUNNING, worker, token, QUEUED] + kinds_args + [RUNNING, max_per_user, RUNNING])
+            finally:
+                c.execute("SELECT RELEASE_LOCK(%s)", (CLAIM_LOCK,))
+    if count == 0:
+        return None
+    rows = dbpool.DBMySQL.csfr(get_dbwriter(), "SELECT * FROM jobs WHERE claim=%s", (token,), asDicts=True)
+    job = rows[0]
+    job['args'] = json.loads(job['args'])
+    return job
+
+def heartbeat(*, job):
+    """Record that the job is still running.
+    :return: the job's status, which is CANCELLED if it was cancelled while running.
+    """
+    dbpool.DBMySQL.csfr(get_dbwriter(),
+                        "UPDATE jobs SET heartbeat_at=unix_timestamp() WHERE id=%s AND claim=%s AND status=%s",
+                        (job['id'], job['claim'], RUNNING))
+    rows = dbpool.DBMySQL.csfr(get_dbwriter(), "SELECT status FROM jobs WHERE id=%s AND claim=%s", (job['id'], job['claim']))
+    return rows[0][0] if rows else CANCELLED
+
+def finish(*, job):
+    """Mark the job as done. Nothing happens if the job was cancelled or requeued in the meantime."""
+    dbpool.DBMySQL.csfr(get_dbwriter(),
+                        "UPDATE jobs SET status=%s, finished_at=unix_timestamp() WHERE id=%s AND claim=%s AND status=%s",
+                        (DONE, job['id'], job['claim'], RUNNING))
+
+def fail(*, job, error):
+    """Requeue the job with a delay, or mark it as failed if it has used all of its attempts,
+    and tell the failure handler for its kind. Nothing happens if the job was cancelled or requeued in the meantime.
+    """
+    count = dbpool.DBMySQL.csfr(get_dbwriter(),
+                                """UPDATE jobs SET status=IF(attempts<max_attempts, %s, %s),
+                                                   run_after=unix_timestamp() + %s*POW(2, attempts-1),
+                                                   finished_at=IF(attempts<max_attempts, NULL, unix_timestamp()),
+                                                   error=%s
+                                   WHERE id=%s AND claim=%s AND status=%s""",
+                                (QUEUED, FAILED, RETRY_DELAY, str(error)[0:65535], job['id'], job['claim'], RUNNING))
+    if count > 0:
+        notify_failure(job, error, job['attempts'] < job['max_attempts'])
+
+def requeue_stale(*, stale_after=STALE_AFTER):
+    """Requeue (or fail) running jobs whose worker has stopped sending heartbeats,
+    and tell the failure handler for the kind of each.
+    :return: the number of jobs
+    """
+    error = 'worker stopped sending heartbeats'
+    stale = dbpool.DBMySQL.csfr(get_dbwriter(),
+                                "SELECT * FROM jobs WHERE status=%s AND heartbeat_at < unix_timestamp() - %s",
+                                (RUNNING, stale_after), asDicts=True)
+    count = 0
+    for job in stale:
+        # The claim is checked, so a job that sent a heartbeat (or finished) since the SELECT is left alone
+        if dbpool.DBMySQL.csfr(get_dbwriter(),
+                               """UPDATE jobs SET status=IF(attempts<max_attempts, %s, %s),
+                                                  finished_at=IF(attempts<max_attempts, NULL, unix_timestamp()),
+                                                  error=%s
+                                  WHERE id=%s AND claim=%s AND status=%s AND heartbeat_at < unix_timestamp() - %s""",
+                               (QUEUED, FAILED, error, job['id'], job['claim'], RUNNING, stale_after)) > 0:
+            count += 1
+            job['args'] = json.loads(job['args'])
+            notify_failure(job, error, job['attempts'] < job['max_attempts'])
+    return count
+
+def run_job(job):
+    """Run a claimed job with its handler, sending heartbeats from another thread while it runs"""
+    cancelled = threading.Event()
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                if heartbeat(job=job) == CANCELLED:
+                    cancelled.set()
+            except Exception as e:   # pylint: disable=broad-exception-caught
+                logging.warning("job %s: heartbeat failed: %s", job['id'], e)
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    logging.info("job %s: running %s attempt %s", job['id'], job['kind'], job['attempts'])
+    try:
+        handler = handlers[job['kind']]
+        handler(**job['args'], cancelled=cancelled)
+        finish(job=job)
+        logging.info("job %s: done", job['id'])
+    except JobCancelled:
+        logging.info("job %s: cancelled", job['id'])
+    except Exception as e:   # pylint: disable=broad-exception-caught
+        logging.exception("job %s: failed", job['id'])
+        fail(job=job, error=f"{type(e).__name__}: {e}")
+    finally:
+        stop.set()
+        beater.join()
+
+def work(*, worker=None, threads=WORKER_THREADS, once=False):
+    """Claim and run jobs of the registered kinds until interrupted.
+    :param: worker - name recorded in each job that this process runs
+    :param: threads - number of jobs to run at the same time
+    :param: once - return when there are no more jobs that can run now
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    def loop(n):
+        name = f"{worker}/{n}"
+        while True:
+            job = claim(worker=name, kinds=list(handlers))
+            if job is None:
+                if once:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            run_job(job)
+
+    requeue_stale()
+    runners = [threading.Thread(target=loop, args=(n,), daemon=True) for n in range(threads)]
+    for t in runners:
+        t.start()
+    # Requeue stale jobs every STALE_AFTER seconds, however many threads there are to wait for
+    while any(t.is_alive() for t in runners):
+        deadline = time.time() + STALE_AFTER
+        for t in runners:
+            t.join(timeout=max(0, deadline - time.time()))
+        requeue_stale()
+
+
+if __name__=="__main__":
+    import argparse
+    from lib.ctools import clogging
+    parser = argparse.ArgumentParser(description="Plant Tracer job queue",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--worker", help="run jobs from the queue", action='store_true')
+    parser.add_argument("--threads", help="number of jobs to run at once", type=int, default=WORKER_THREADS)
+    parser.add_argument("--once", help="exit when no jobs can run now", action='store_true')
+    parser.add_argument("--cancel", help="cancel a job", type=int)
+    parser.add_argument("--status", help="print a job", type=int)
+    clogging.add_argument(parser, loglevel_default='INFO')
+    args = parser.parse_args()
+    clogging.setup(level=args.loglevel)
+
+    if args.cancel:
+        print("cancelled" if cancel(job_id=args.cancel) else "not cancelled; the job has finished")
+    elif args.status:
+        print(json.dumps(get_job(job_id=args.status), default=str, indent=4))
+    elif args.worker:
+        import bottle_api       # pylint: disable=unused-import; registers the handlers
+        work(threads=args.threads, once=args.once)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,47 @@
+"""
+In-process registry of the tracking status of movies.
+
+MovieTrackCallback posts the status of a movie here as it tracks, and the server-sent events endpoint
+(/api/movie-status-events) waits on it, so that a browser watching a movie being tracked in the same
+process is told of each change without touching the database.
+
+When tracking runs in another process (e.g. a zappa @task on AWS Lambda) nothing is posted here,
+and the endpoint reads the status from the database instead.
+"""
+
+import threading
+
+
+class ProgressBoard:
+    """Thread-safe map of movie_id -> status dictionary, with a way to wait for it to change"""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.progress = {}      # movie_id -> dict
+
+    def post(self, movie_id, **status):
+        """Set the status of movie_id and wake everyone waiting for it"""
+        with self.cond:
+            self.progress[movie_id] = status
+            self.cond.notify_all()
+
+    def get(self, movie_id):
+        """Return the status of movie_id, or None if it is not being tracked in this process"""
+        with self.cond:
+            return self.progress.get(movie_id)
+
+    def finish(self, movie_id):
+        """movie_id is no longer being tracked in this process. Its final status is in the database."""
+        with self.cond:
+            self.progress.pop(movie_id, None)
+            self.cond.notify_all()
+
+    def wait(self, movie_id, last, timeout):
+        """Wait until the status of movie_id is not last, or until timeout seconds have passed.
+        :return: the status, or None if the movie is not being tracked in this process.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.progress.get(movie_id) != last, timeout=timeout)
+            return self.progress.get(movie_id)
+
+
+board = ProgressBoard()
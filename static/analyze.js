@@ -59,6 +59,7 @@
 /*global movie_id */
 
 const PLAY_MSEC = 100;          // how fast to play
+const PREFETCH_FRAMES = 20;     // frames fetched ahead with /api/get-frames while playing
 const DEFAULT_R = 10;           // default radius of the marker
 const MIN_MARKER_NAME_LEN = 4;  // markers must be this long (allows 'apex')
 const STATUS_WORKER = document.currentScript.src.replace("analyze.js","analyze_status_worker.js");
@@ -71,6 +72,7 @@ var div_template = '';          // will be set with the div template
 const ENGINE = 'CV2';
 const ENGINE_VERSION = '1.0';
 const TRACKING_COMPLETED_FLAG='TRACKING COMPLETED';
+const TRACKING_STOPPED_FLAGS=['Tracking failed','Tracking cancelled']; // must match C.TRACKING_FAILED and C.TRACKING_CANCELLED
 
 // available colors
 // https://sashamaps.net/docs/resources/20-colors/
@@ -342,6 +344,9 @@ class PlantTracerController extends CanvasController {
         this.download_link        = $(`#${this.this_id} .download_link`);
         this.download_button      = $(`#${this.this_id} .download_button`);
         this.playing = 0;
+        this.prefetched = new Map();    // frame_number -> get_frame_handler() data, filled by prefetch_frames()
+        this.prefetching = false;
+        this.shown_blob_url = undefined; // blob URL of a prefetched frame that is still on screen (see clear_prefetched)
         console.log("PlantTracer movie_id=",movie_id,"metadata=",movie_metadata);
 
         this.download_link.attr('href',`/api/get-movie-trackpoints?api_key=${api_key}&movie_id=${movie_id}`);
@@ -554,24 +559,6 @@ class PlantTracerController extends CanvasController {
      */
     track_to_end(_event) {
         // get the next frame and apply tracking logic
-        // First launch the status worker
-        /* Disabled because Amazon's back end isn't multi-threaded */
-        if (window.Worker) {
-            this.status_worker = new Worker(STATUS_WORKER);
-            this.status_worker.onmessage = (e) => {
-                // Got back a message
-                console.log("got e.data=",e.data,"status=",e.data.status);
-                this.tracked_movie_status.text( e.data.status );
-                if (e.data.status==TRACKING_COMPLETED_FLAG) {
-                    this.movie_tracked();
-                    this.total_frames = e.data.total_frames;
-                    $(`#${this.this_id} span.total-frames-span`).text(this.total_frames);
-                }
-            };
-            this.status_worker.postMessage( {movie_id:movie_id, api_key:api_key} );
-        } else {
-            alert("Your browser does not support web workers. You cannot track movies.");
-        }
         console.log("track_to_end start");
         this.tracked_movie.hide();
         this.tracked_movie_status.text("Asking server to track movie...");
@@ -593,10 +580,37 @@ class PlantTracerController extends CanvasController {
                     alert(data.message);
                 } else {
                     this.tracked_movie_status.text(data.message);
+                    // Only now has the server replaced the status of the last tracking (which may be
+                    // TRACKING COMPLETED) with the status of this one, so the stream cannot see the old one.
+                    this.start_status_worker();
                 }
             });
     }
 
+    /** Launch the status worker, which reports the tracking status until tracking is completed */
+    start_status_worker() {
+        /* Disabled because Amazon's back end isn't multi-threaded */
+        if (window.Worker) {
+            this.status_worker = new Worker(STATUS_WORKER);
+            this.status_worker.onmessage = (e) => {
+                // Got back a message
+                console.log("got e.data=",e.data,"status=",e.data.status);
+                this.tracked_movie_status.text( e.data.status );
+                if (e.data.status==TRACKING_COMPLETED_FLAG) {
+                    this.movie_tracked();
+                    this.total_frames = e.data.total_frames;
+                    $(`#${this.this_id} span.total-frames-span`).text(this.total_frames);
+                } else if (TRACKING_STOPPED_FLAGS.includes(e.data.status)) {
+                    console.log("tracking stopped; terminating status worker");
+                    this.status_worker.terminate();
+                }
+            };
+            this.status_worker.postMessage( {movie_id:this.movie_id, api_key:api_key} );
+        } else {
+            alert("Your browser does not support web workers. You cannot track movies.");
+        }
+    }
+
     /** movie is tracked - display the results */
     movie_tracked() {
         const movie_id = this.movie_id;
@@ -652,14 +666,88 @@ class PlantTracerController extends CanvasController {
             this.frame_number_field[0].value = frame;
         }
         this.set_movie_control_buttons();     // enable or disable all buttons as appropriate
-        // And get the frame
-        const get_frame_params = {
-            api_key :api_key,
-            movie_id:this.movie_id,
-            frame_number:this.frame_number,
-            format:'json',
-        };
-        $.post('/api/get-frame', get_frame_params).done( (data) => { this.get_frame_handler(data);});
+        // And get the frame. While playing, the frames are fetched ahead in batches.
+        // The trackpoints cannot be moved while playing, so the prefetched trackpoints are current.
+        if (this.playing && this.prefetched.has(frame)) {
+            this.get_frame_handler( this.prefetched.get(frame) );
+        } else {
+            const get_frame_params = {
+                api_key :api_key,
+                movie_id:this.movie_id,
+                frame_number:this.frame_number,
+                format:'json',
+            };
+            $.post('/api/get-frame', get_frame_params).done( (data) => { this.get_frame_handler(data);});
+        }
+        if (this.playing) {
+            let next = frame+1;
+            while (this.prefetched.has(next)) {
+                next += 1;
+            }
+            if (next - frame <= PREFETCH_FRAMES/2) {
+                this.prefetch_frames(next);
+            }
+        }
+    }
+
+    /**
+     * Get frames frame_start.. with a single /api/get-frames call and keep them in this.prefetched.
+     * The response is the length of a JSON header (32-bit big-endian), the header, and then the JPEGs.
+     */
+    prefetch_frames( frame_start ) {
+        if (this.prefetching || frame_start > this.last_tracked_frame) {
+            return;
+        }
+        this.prefetching = true;
+        const params = new URLSearchParams({
+            api_key: api_key,
+            movie_id: this.movie_id,
+            frame_start: frame_start,
+            frame_end: Math.min(frame_start+PREFETCH_FRAMES-1, this.last_tracked_frame),
+        });
+        fetch('/api/get-frames', { method:'POST', body:params })
+            .then((response) => {
+                if (response.headers.get('Content-Type').startsWith('application/json')) {
+                    return response.json().then((data) => { throw new Error(data.message); });
+                }
+                return response.arrayBuffer();
+            })
+            .then((buf) => {
+                if (!this.playing) {
+                    return;     // stopped while the frames were in flight
+                }
+                const header_length = new DataView(buf).getUint32(0);
+                const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, header_length)));
+                const jpegs_start = 4 + header_length;
+                for (const f of header.frames) {
+                    const jpeg = new Blob([new Uint8Array(buf, jpegs_start + f.jpeg_offset, f.jpeg_length)], {type:'image/jpeg'});
+                    this.prefetched.set(f.frame_number, {
+                        error: false,
+                        frame_number: f.frame_number,
+                        frame_id: f.frame_id,
+                        last_tracked_frame: header.last_tracked_frame,
+                        annotations: f.annotations,
+                        trackpoints: f.trackpoints,
+                        frame_url: URL.createObjectURL(jpeg),
+                    });
+                }
+            })
+            .catch((error) => console.log("prefetch_frames: ",error))
+            .finally(() => { this.prefetching = false; });
+    }
+
+    /** Discard the prefetched frames, whose trackpoints may be changed once the movie stops.
+     * The frame on screen is still using its blob URL, so that one is revoked when the next frame is shown.
+     */
+    clear_prefetched() {
+        for (const [frame_number, data] of this.prefetched) {
+            if (frame_number == this.frame_number) {
+                this.shown_blob_url = data.frame_url;
+            } else {
+                URL.revokeObjectURL(data.frame_url);
+            }
+        }
+        this.prefetched.clear();
     }
 
     set_movie_control_buttons() {
@@ -705,6 +793,7 @@ class PlantTracerController extends CanvasController {
             this.playTimer = undefined;
         }
         this.playing = 0;
+        this.clear_prefetched();
         this.set_movie_control_buttons();
     }
 
@@ -730,7 +819,11 @@ class PlantTracerController extends CanvasController {
 
         //console.log("this.frame_number_field=",this.frame_number_field,"val=",this.frame_number_field.val());
         // Add the markers to the image and draw them in the table
-        this.theImage = new MyImage( 0, 0, data.data_url, this);
+        if (this.shown_blob_url && this.shown_blob_url != data.frame_url) {
+            URL.revokeObjectURL(this.shown_blob_url); // a prefetched frame that was on screen when playing stopped
+            this.shown_blob_url = undefined;
+        }
+        this.theImage = new MyImage( 0, 0, data.frame_url || data.data_url, this);
         this.objects = [];      // clear the array
         this.objects.push(this.theImage );
         $(`#${this.this_id} td.message`).text( ' ' );
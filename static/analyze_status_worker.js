@@ -6,9 +6,10 @@
 // https://stackoverflow.com/questions/48408491/using-webworkers-jquery-returns-undefined
 
 const NOTIFY_UPDATE_INTERVAL = 1000;    // how quickly to pool for retracking (in msec)
+const MAX_EVENT_SOURCE_ERRORS = 3;      // fall back to polling after this many failed connections in a row
 
 // Set a timer to get the movie status from the server and put it in the status field
-// during long operations.
+// during long operations. Only used if the browser cannot use /api/movie-status-events.
 // See https://developer.mozilla.org/en-US/docs/Web/API/setInterval
 function start_update_timer(obj) {
     setInterval( () => {
@@ -31,7 +32,36 @@ function start_update_timer(obj) {
     },NOTIFY_UPDATE_INTERVAL);
 }
 
+// Have the server push each change in the movie status as a server-sent event.
+// EventSource reconnects by itself when the server closes the stream.
+// See https://developer.mozilla.org/en-US/docs/Web/API/EventSource
+function start_event_source(obj) {
+    if (typeof EventSource === 'undefined') {
+        start_update_timer(obj);
+        return;
+    }
+    const params = new URLSearchParams({api_key:obj.api_key, movie_id:obj.movie_id});
+    const source = new EventSource(`/api/movie-status-events?${params}`);
+    let errors = 0;
+    source.onopen = (_) => {
+        errors = 0;
+    };
+    source.onmessage = (e) => {
+        const status = JSON.parse(e.data);
+        console.log(Date.now(),"movie-status-events (movie_id=",obj.movie_id,") got = ",status);
+        postMessage(status);
+    };
+    source.onerror = (_) => {
+        errors += 1;
+        if (source.readyState == EventSource.CLOSED || errors >= MAX_EVENT_SOURCE_ERRORS) {
+            console.log("movie-status-events failed; polling instead");
+            source.close();
+            start_update_timer(obj);
+        }
+    };
+}
+
 onmessage = function(e) {
     console.log("load analyze_webworker.js. e=",e);
-    start_update_timer(e.data);
+    start_event_source(e.data);
 };
@@ -10,6 +10,9 @@
 
 const PLAY_LABEL = 'play original';
 const PLAY_TRACKED_LABEL = 'play tracked';
+const TRACKING_COMPLETED = 'TRACKING COMPLETED'; // must match C.TRACKING_COMPLETED in constants.py
+const TRACKPOINT_RADIUS = 3;
+const TRACKPOINT_COLOR = 'red';
 const UPLOAD_TIMEOUT_SECONDS = 20;
 
 ////////////////////////////////////////////////////////////////
@@ -234,6 +237,51 @@ function play_clicked( e, movie_id ) {
     document.getElementById( vid ).play();
 }
 
+// callback when 'play tracked' is clicked for a movie that was tracked on the server.
+// Plays the original movie and draws the trackpoints over it from a WebVTT metadata track
+// (/api/get-movie-track), so the server does not have to render a tracked movie.
+function play_tracked_clicked( e, movie_id ) {
+    console.log('play_tracked_clicked=',e,'movie_id=',movie_id);
+    const url   = `/api/get-movie-data?api_key=${api_key}&movie_id=${movie_id}`;
+    const track = `/api/get-movie-track?api_key=${api_key}&movie_id=${movie_id}`;
+    const rowid = e.getAttribute('x-rowid');
+    $(`#tr-${rowid}`).show();
+    const td = $(`#td-${rowid}`);
+    td.html(`<div style='position:relative; display:inline-block'>` +
+            `<video class='movie_player' id='video-${rowid}' controls playsinline>` +
+            `<source src='${url}' type='video/mp4'><track kind='metadata' src='${track}' default></video>` +
+            `<canvas id='overlay-${rowid}' style='position:absolute; left:0; top:0; width:100%; height:100%; pointer-events:none'></canvas>` +
+            `</div>` +
+            `<input class='hide' x-movie_id='${movie_id}' x-rowid='${rowid}' type='button' value='hide' onclick='hide_clicked(this)'>`);
+    td.show();
+    const video  = document.getElementById(`video-${rowid}`);
+    const canvas = document.getElementById(`overlay-${rowid}`);
+    const text_track = video.textTracks[0];
+    text_track.mode = 'hidden';     // deliver the cues, but do not display them
+    text_track.oncuechange = () => {
+        canvas.width  = video.videoWidth;
+        canvas.height = video.videoHeight;
+        const ctx = canvas.getContext('2d');
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        for (const cue of text_track.activeCues) {
+            for (const pt of JSON.parse(cue.text)) {
+                ctx.beginPath();
+                ctx.arc(pt.x, pt.y, TRACKPOINT_RADIUS, 0, 2 * Math.PI);
+                ctx.fillStyle = TRACKPOINT_COLOR;
+                ctx.fill();
+            }
+            // Frame number in the upper right hand corner, as render_tracked_movie does
+            ctx.font = '16px sans-serif';
+            const width = ctx.measureText(cue.id).width;
+            ctx.fillStyle = TRACKPOINT_COLOR;
+            ctx.fillRect(canvas.width - width - 10, 0, width + 10, 22);
+            ctx.fillStyle = 'white';
+            ctx.fillText(cue.id, canvas.width - width - 5, 17);
+        }
+    };
+    video.play();
+}
+
 function hide_clicked( e ) {
     let rowid = e.getAttribute('x-rowid');
     let video = $(`#video-${rowid}`);
@@ -444,6 +492,9 @@ function list_movies_data( movies ) {
             if (m.tracked_movie_id){
                 playt     = `<input class='play'    x-rowid='${rowid}' x-movie_id='${m.tracked_movie_id}' type='button' value='${PLAY_TRACKED_LABEL}' onclick='play_clicked(this,${m.tracked_movie_id})'>`;
                 analyze_label = 're-analyze';
+            } else if (m.status == TRACKING_COMPLETED && !m.orig_movie) {
+                playt     = `<input class='play'    x-rowid='${rowid}' x-movie_id='${movie_id}' type='button' value='${PLAY_TRACKED_LABEL}' onclick='play_tracked_clicked(this,${movie_id})'>`;
+                analyze_label = 're-analyze';
             }
             const analyze   = m.orig_movie ? '' : `<input class='analyze' x-rowid='${rowid}' x-movie_id='${movie_id}' type='button' value='${analyze_label}' onclick='analyze_clicked(this)'>`;
             const up_down   = movieDate.toLocaleString().replace(' ','<br>').replace(',','');
@@ -0,0 +1,72 @@
+import sys
+import time
+import threading
+
+import pytest
+import pymysql
+
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from auth import get_dbreader
+import dbpool
+
+def test_csfr():
+    assert dbpool.DBMySQL.csfr(get_dbreader(), "SELECT 1, 2") == ((1, 2),)
+    names = []
+    assert dbpool.DBMySQL.csfr(get_dbreader(), "SELECT 1 AS a, 2 AS b", asDicts=True, get_column_names=names) == [{'a':1, 'b':2}]
+    assert names == ['a', 'b']
+
+def kill_idle_connection(auth):
+    """Have the server drop the connection that the pool will hand out next, without the pool noticing"""
+    pool = dbpool.get_pool(auth)
+    with pool.connection() as conn:
+        connection_id = conn.thread_id()
+    dbpool.ConnectionPool(auth).connect().query(f"KILL CONNECTION {connection_id}")
+
+def test_csfr_retry():
+    """A read-only statement is retried on a dropped connection; any other statement is not, because it may have run"""
+    assert dbpool.read_only("SELECT 1") and dbpool.read_only(" show tables")
+    assert not dbpool.read_only("SELECT * FROM jobs FOR UPDATE")
+    assert not dbpool.read_only("UPDATE movies SET status='x'")
+
+    kill_idle_connection(get_dbreader())
+    assert dbpool.csfr(get_dbreader(), "SELECT 1") == ((1,),)
+
+    kill_idle_connection(get_dbreader())
+    with pytest.raises(pymysql.err.OperationalError):
+        dbpool.csfr(get_dbreader(), "SET @retried = 1")
+
+def test_pool_bounded():
+    """More threads than connections: the threads wait, and no more than max_size connections are made"""
+    pool = dbpool.ConnectionPool(get_dbreader(), max_size=2)
+    def query():
+        with pool.connection() as conn:
+            with conn.cursor() as c:
+                c.execute("SELECT SLEEP(0.1)")
+    threads = [threading.Thread(target=query) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = pool.stats()
+    assert stats['created'] <= 2
+    assert stats['max_in_use'] == 2
+    assert stats['waits'] > 0
+    assert stats['in_use'] == 0
+    pool.close()
+
+def test_pool_reconnect():
+    """A connection that went stale while idle is replaced"""
+    pool = dbpool.ConnectionPool(get_dbreader(), max_size=1)
+    with pool.connection() as conn:
+        pass
+    conn.close()                # simulate the server dropping the connection
+    pool.idle = [(conn, time.time() - dbpool.PING_INTERVAL - 1)]
+    with pool.connection() as conn2:
+        with conn2.cursor() as c:
+            c.execute("SELECT 1")
+            assert c.fetchall() == ((1,),)
+    assert pool.stats()['reconnects'] == 1
+    pool.close()
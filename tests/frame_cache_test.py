@@ -0,0 +1,62 @@
+"""
+Test the frame cache
+"""
+
+import sys
+import tempfile
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from frame_cache import FrameCache
+
+SHA256 = 'a' * 64
+
+
+def test_frame_cache_lru():
+    fc = FrameCache(max_bytes=30)
+    assert fc.get(SHA256, 0) is None
+    fc.put(SHA256, 0, b'0' * 10)
+    fc.put(SHA256, 1, b'1' * 10)
+    fc.put(SHA256, 2, b'2' * 10)
+    assert fc.get(SHA256, 0) == b'0' * 10          # frame 0 is now the most recently used
+    fc.put(SHA256, 3, b'3' * 10)                   # evicts frame 1
+    assert fc.get(SHA256, 1) is None
+    assert fc.get(SHA256, 0) is not None
+    stats = fc.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= 30
+
+
+def test_frame_cache_disk():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fc = FrameCache(max_bytes=100, cache_dir=cache_dir)
+        fc.put(SHA256, 5, b'jpeg')
+
+        # A new cache (e.g. a new request handler in a warm container) finds the frame on disk
+        fc2 = FrameCache(max_bytes=100, cache_dir=cache_dir)
+        assert fc2.get(SHA256, 5) == b'jpeg'
+        assert fc2.get(SHA256, 5) == b'jpeg'
+        assert fc2.stats()['disk_hits'] == 1
+        assert fc2.stats()['hits'] == 1
+
+        # Overflowing the disk budget removes the oldest frames
+        fc3 = FrameCache(max_bytes=100, cache_dir=cache_dir, max_disk_bytes=40)
+        for frame_number in range(10):
+            fc3.put(SHA256, frame_number, b'x' * 10)
+        assert fc3.stats()['disk_bytes'] <= 40
+
+
+def test_frame_cache_disk_bytes():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fc = FrameCache(max_bytes=100, cache_dir=cache_dir)
+        fc.put(SHA256, 0, b'x' * 10)
+        fc.put(SHA256, 1, b'x' * 10)
+        fc.put(SHA256, 1, b'y' * 5)                # replacing a frame counts only the new file
+        assert fc.stats()['disk_bytes'] == 15
+
+        # A new cache counts the files that are already on disk
+        fc2 = FrameCache(max_bytes=100, cache_dir=cache_dir)
+        assert fc2.stats()['disk_bytes'] == 15
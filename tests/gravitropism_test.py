@@ -5,8 +5,10 @@ from os.path import dirname,abspath
 
 sys.path.append(dirname(dirname(abspath(__file__))))
 
+import numpy as np
+
 from constants import E
-from gravitropism import calculate_results_gravitropism
+from gravitropism import calculate_results_gravitropism, analyze_trajectory, ruler_mm_per_pixel
 
 
 # Configuring the logging module
@@ -36,3 +38,36 @@ def test_coordinates_type_error():
     with pytest.raises(TypeError) as e:
         calculate_results_gravitropism(1, 2, 3, 4, 0)
         assert e.message == E.CALC_RESULTS_PARAM_INVALID['message']
+
+
+def test_analyze_trajectory():
+    """The vectorized analysis agrees with calculate_results_gravitropism for each pair of frames"""
+    labels = ['apex', 'ruler 0 mm', 'ruler 10 mm']
+    points = np.full((6, 3, 2), np.nan)
+    points[:, 0] = [[0, 0], [2, 0], [4, 0], [4, 2], [4, 2], [2, 2]]
+    points[0, 1] = [0, 0]
+    points[0, 2] = [20, 0]
+    assert ruler_mm_per_pixel(labels, points) == 0.5
+
+    results = analyze_trajectory(labels=labels, points=points, seconds_per_frame=30)
+    assert results['units'] == 'mm'
+    assert list(results['tracks']) == ['apex']
+    apex = results['tracks']['apex']
+    assert apex['x'] == [0, 1, 2, 2, 2, 1]
+    for frame in range(1, 6):
+        expected = calculate_results_gravitropism(apex['x'][frame-1], apex['y'][frame-1],
+                                                  apex['x'][frame], apex['y'][frame], 0.5)
+        assert apex['distance'][frame] == pytest.approx(expected['distance'], abs=0.01)
+        assert apex['rate'][frame] == pytest.approx(expected['rate'], abs=0.01)
+        assert apex['angle'][frame] == pytest.approx(expected['angle'], abs=0.01)
+    assert apex['distance'][0] is None
+    assert apex['displacement'][5] == pytest.approx(1.4142, abs=0.001)
+    assert apex['curvature'] == [0, 0, 0, 90, 90, 180]
+
+    # Without a ruler, distances are in pixels
+    results = analyze_trajectory(labels=labels[0:1], points=points[:, 0:1], seconds_per_frame=30)
+    assert results['units'] == 'pixels'
+    assert results['tracks']['apex']['x'][5] == 2
+
+    with pytest.raises(TypeError):
+        analyze_trajectory(labels=labels, points=points, seconds_per_frame=0)
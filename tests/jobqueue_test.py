@@ -0,0 +1,86 @@
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import jobqueue
+import dbpool
+from auth import get_dbwriter
+
+def test_job_lifecycle():
+    """A job is claimed once and requeued with a delay after a failure"""
+    kind = 'test-' + str(uuid.uuid4())[0:8]
+    job_id = jobqueue.enqueue(kind=kind, args={'a':1}, max_attempts=2)
+    assert jobqueue.get_job(job_id=job_id)['status'] == jobqueue.QUEUED
+
+    job = jobqueue.claim(worker='test', kinds=[kind])
+    assert job['id'] == job_id
+    assert job['args'] == {'a':1}
+    assert job['status'] == jobqueue.RUNNING
+    assert jobqueue.claim(worker='test', kinds=[kind]) is None
+    assert jobqueue.heartbeat(job=job) == jobqueue.RUNNING
+
+    # The first failure requeues the job after a delay
+    jobqueue.fail(job=job, error='first')
+    job = jobqueue.get_job(job_id=job_id)
+    assert job['status'] == jobqueue.QUEUED
+    assert job['error'] == 'first'
+    assert jobqueue.claim(worker='test', kinds=[kind]) is None
+
+    # A worker that lost the job cannot change it
+    job['claim'] = 'stale'
+    jobqueue.fail(job=job, error='ignored')
+    assert jobqueue.get_job(job_id=job_id)['error'] == 'first'
+    assert jobqueue.cancel(job_id=job_id) is True
+
+def test_job_cancel_and_finish():
+    kind = 'test-' + str(uuid.uuid4())[0:8]
+    job_id = jobqueue.enqueue(kind=kind, args={})
+    assert jobqueue.cancel(job_id=job_id) is True
+    assert jobqueue.claim(worker='test', kinds=[kind]) is None
+    assert jobqueue.cancel(job_id=job_id) is False
+
+    # A handler runs the job to completion
+    ran = []
+    jobqueue.register_handler(kind, lambda *, x, cancelled: ran.append(x))
+    job_id = jobqueue.enqueue(kind=kind, args={'x':3})
+    jobqueue.run_job(jobqueue.claim(worker='test', kinds=[kind]))
+    assert ran == [3]
+    assert jobqueue.get_job(job_id=job_id)['status'] == jobqueue.DONE
+    del jobqueue.handlers[kind]
+
+def test_job_failure_handler():
+    """The failure handler is told of each failure, including jobs whose worker stopped sending heartbeats"""
+    kind = 'test-' + str(uuid.uuid4())[0:8]
+    failures = []
+    jobqueue.register_handler(kind, lambda *, cancelled: None,
+                              on_fail=lambda job, error, retrying: failures.append((job['id'], error, retrying)))
+    job_id = jobqueue.enqueue(kind=kind, args={}, max_attempts=2)
+    job = jobqueue.claim(worker='test', kinds=[kind])
+    jobqueue.fail(job=job, error='first')
+    assert failures == [(job_id, 'first', True)]
+
+    # The second attempt stops sending heartbeats, and has no attempts left
+    dbpool.DBMySQL.csfr(get_dbwriter(), "UPDATE jobs SET run_after=0 WHERE id=%s", (job_id,))
+    job = jobqueue.claim(worker='test', kinds=[kind])
+    dbpool.DBMySQL.csfr(get_dbwriter(), "UPDATE jobs SET heartbeat_at=heartbeat_at-1000 WHERE id=%s", (job_id,))
+    assert jobqueue.requeue_stale(stale_after=100) >= 1
+    assert failures[1] == (job_id, 'worker stopped sending heartbeats', False)
+    assert jobqueue.get_job(job_id=job_id)['status'] == jobqueue.FAILED
+    del jobqueue.handlers[kind]
+    del jobqueue.failure_handlers[kind]
+
+def test_job_claim_limits():
+    """Concurrent claims never run two jobs for the same movie"""
+    kind = 'test-' + str(uuid.uuid4())[0:8]
+    movie_id = 1_000_000_000 + int(uuid.uuid4().int % 1_000_000)
+    job_ids = [jobqueue.enqueue(kind=kind, args={}, movie_id=movie_id) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        claimed = [job for job in pool.map(lambda n: jobqueue.claim(worker=f'test/{n}', kinds=[kind]), range(4))
+                   if job is not None]
+    assert len(claimed) == 1
+    for job_id in job_ids:
+        jobqueue.cancel(job_id=job_id)
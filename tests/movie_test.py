@@ -37,6 +37,7 @@ from auth import get_dbreader,get_dbwriter
 from user_test import new_user,new_course,API_KEY,MOVIE_ID,MOVIE_TITLE,USER_ID,DBWRITER,TEST_MOVIE_FILENAME
 from constants import MIME,Engines
 import tracker
+import progress
 
 # Test for edge cases
 def test_edge_case():
@@ -254,6 +255,14 @@ def test_movie_update_metadata(new_movie):
     assert get_movie(api_key, movie_id)['published'] == 0
 
 
+def parse_frames(data):
+    """Split an /api/get-frames response into its header and a list of (frame_number, jpeg) tuples"""
+    (header_length,) = bottle_api.GET_FRAMES_HEADER_LENGTH.unpack_from(data)
+    start = bottle_api.GET_FRAMES_HEADER_LENGTH.size + header_length
+    header = json.loads(data[bottle_api.GET_FRAMES_HEADER_LENGTH.size:start])
+    return (header, [(f['frame_number'], data[start+f['jpeg_offset']:start+f['jpeg_offset']+f['jpeg_length']])
+                     for f in header['frames']])
+
 def test_movie_extract(new_movie):
     """Try extracting individual movie frames"""
     cfg = copy.copy(new_movie)
@@ -327,6 +336,69 @@ def test_movie_extract(new_movie):
     r2 = get_jpeg_json(2)
     assert r0['frame_id'] != r1['frame_id'] != r2['frame_id']
 
+    # The JSON has the URL of the frame rather than the frame, and the URL is named by the SHA256 of the JPEG
+    assert 'data_url' not in r1
+    jpeg1_sha256 = bottle_api.jpeg_sha256(jpeg1)
+    assert r1['frame_url'].endswith(f'/{movie_id}/1/{jpeg1_sha256}.jpg')
+    with boddle(params={'api_key': api_key}):
+        r = bottle_api.api_frame_jpeg(movie_id, 1, jpeg1_sha256)
+    assert r.status_code==200
+    assert r.body==jpeg1
+    assert r.headers['Cache-Control']==bottle_api.FRAME_CACHE_CONTROL
+    assert r.headers['Cache-Control'].startswith('private')
+    assert r.headers['ETag']==f'"{jpeg1_sha256}"'
+
+    # A revalidation is answered without the JPEG
+    with boddle(params={'api_key': api_key}, headers={'If-None-Match': r.headers['ETag']}):
+        r = bottle_api.api_frame_jpeg(movie_id, 1, jpeg1_sha256)
+    assert r.status_code==304
+    with boddle(params={'api_key': api_key}):
+        assert bottle_api.api_frame_jpeg(movie_id, 1, '0'*64).status_code==404
+
+    # Only users who may access the movie get its frames
+    with boddle(params={'api_key': api_key}):
+        assert bottle_api.api_frame_jpeg(movie_id+1000000, 1, jpeg1_sha256).status_code==403
+
+    # Get the first three frames in one response
+    with boddle(params={'api_key': api_key,
+                        'movie_id': str(movie_id),
+                        'frame_start': '0',
+                        'frame_end': '2'}):
+        r = bottle_api.api_get_frames()
+    (header, frames) = parse_frames(r)
+    assert header['error'] is False
+    assert frames == [(0, jpeg0), (1, jpeg1), (2, jpeg2)]
+    # Each frame has what /api/get-frame returns for it
+    assert [f['frame_id'] for f in header['frames']] == [r0['frame_id'], r1['frame_id'], r2['frame_id']]
+    assert [f['annotations'] for f in header['frames']] == [r0['annotations'], r1['annotations'], r2['annotations']]
+
+    # A huge frame_end is cut to GET_FRAMES_MAX frames without building the whole range
+    with boddle(params={'api_key': api_key,
+                        'movie_id': str(movie_id),
+                        'frame_start': '0',
+                        'frame_end': str(10**12)}):
+        (header, frames) = parse_frames(bottle_api.api_get_frames())
+    assert frames[0:3] == [(0, jpeg0), (1, jpeg1), (2, jpeg2)]
+    assert len(frames) <= bottle_api.GET_FRAMES_MAX
+
+    with boddle(params={'api_key': api_key,
+                        'movie_id': str(movie_id),
+                        'frame_start': str(1_000_000)}):
+        r = bottle_api.api_get_frames()
+    assert r['error']==True
+    assert 'out of range' in r['message']
+
+    # Replacing the stored frame changes its URL
+    with boddle(params={'api_key': api_key,
+                        'movie_id': str(movie_id),
+                        'frame_number': '1',
+                        'frame_base64_data': base64.b64encode(jpeg0).decode()}):
+        assert bottle_api.api_new_frame()['error']==False
+    r1b = get_jpeg_json(1)
+    assert r1b['frame_url'].endswith(f'/{movie_id}/1/{bottle_api.jpeg_sha256(jpeg0)}.jpg')
+    with boddle(params={'api_key': api_key}):
+        assert bottle_api.api_frame_jpeg(movie_id, 1, bottle_api.jpeg_sha256(jpeg0)).body==jpeg0
+
 """
 test frame annotations ---
     # get the frame with the JSON interface, asking for annotations
@@ -454,3 +526,88 @@ def test_log_search_movie(new_movie):
     logging.info("log entries for movie:")
     for r in res:
         logging.info("%s",r)
+
+
+def test_extract_movie_frames(new_movie):
+    """Pre-extract all of the frames into the database and make sure they are served from there"""
+    cfg = copy.copy(new_movie)
+    movie_id = cfg[MOVIE_ID]
+    api_key = cfg[API_KEY]
+
+    bottle_api.api_extract_movie_frames(movie_id=movie_id)
+    movie_metadata = tracker.extract_movie_metadata(movie_data=db.get_movie_data(movie_id=movie_id))
+    assert db.movie_frames_info(movie_id=movie_id)['count'] == movie_metadata['total_frames']
+
+    row = db.get_frame(movie_id=movie_id, frame_number=1)
+    assert filetype.guess(row['frame_data']).mime==MIME.JPEG
+    with boddle(params={'api_key': api_key,
+                        'movie_id': str(movie_id),
+                        'frame_number': '1',
+                        'format':'jpeg' }):
+        assert bottle_api.api_get_frame() == row['frame_data']
+
+def test_movie_track_callback(new_movie):
+    """The callback stores every frame from its writer thread and sets the status directly"""
+    cfg = copy.copy(new_movie)
+    movie_id = cfg[MOVIE_ID]
+    user_id  = cfg[USER_ID]
+    movie_data = db.get_movie_data(movie_id=movie_id)
+    frames = list(tracker.extract_frames(movie_data=movie_data, frame_end=9, fmt='CV2'))
+
+    mtc = bottle_api.MovieTrackCallback(user_id=user_id, movie_id=movie_id)
+    mtc.movie_metadata = {'total_frames':len(frames)}
+    for (frame_number, frame) in frames:
+        mtc.notify(frame_number=frame_number, frame=frame, output_trackpoints=None)
+    mtc.close()
+    assert db.movie_frames_info(movie_id=movie_id)['count'] == len(frames)
+    row = db.get_frame(movie_id=movie_id, frame_number=len(frames)-1)
+    assert filetype.guess(row['frame_data']).mime==MIME.JPEG
+    movie = db.get_movie_metadata(user_id=user_id, movie_id=movie_id)[0]
+    assert movie['status'] == f"Tracked frames {len(frames)} of {len(frames)}"
+
+    # Once the callback is closed, the status comes from the database rather than the progress board
+    assert progress.board.get(movie_id) is None
+
+def test_movie_status_events(new_movie):
+    """The status events come from the progress board while the movie is tracked here, otherwise from the database"""
+    movie_id = new_movie[MOVIE_ID]
+    db.set_movie_status(movie_id=movie_id, status=C.TRACKING_QUEUED)
+    events = list(bottle_api.movie_status_events(movie_id=movie_id, max_seconds=0))
+    assert events[0].startswith('retry:')
+    assert json.loads(events[1].split('data: ')[1])['status'] == C.TRACKING_QUEUED
+
+    # A status that the client already has is not sent again
+    assert len(list(bottle_api.movie_status_events(movie_id=movie_id, last_status=C.TRACKING_QUEUED, max_seconds=0))) == 1
+
+    progress.board.post(movie_id, status='Tracked frames 1 of 2', total_frames=2, frame_number=0)
+    events = list(bottle_api.movie_status_events(movie_id=movie_id, max_seconds=0))
+    assert json.loads(events[1].split('data: ')[1])['frame_number'] == 0
+    progress.board.finish(movie_id)
+
+def test_access_cache(new_movie):
+    """Access checks are answered from the cached access set. A movie that is not in it is checked on its own."""
+    cfg = copy.copy(new_movie)
+    movie_id = cfg[MOVIE_ID]
+    user_id  = cfg[USER_ID]
+    db.forget_access()
+    assert db.can_access_movie(user_id=user_id, movie_id=movie_id)
+    assert movie_id in db.access_cache[user_id][1]
+    frame_id = db.create_new_frame(movie_id=movie_id, frame_number=0)
+    assert db.can_access_frame(user_id=user_id, frame_id=frame_id)
+    assert db.frame_movie_ids[frame_id] == movie_id
+
+    # A movie created after the access set was computed is still accessible
+    movie_id2 = db.create_new_movie(user_id=user_id, title='test_access_cache')
+    db.access_cache[user_id] = (time.time(), frozenset([movie_id]))
+    assert db.can_access_movie(user_id=user_id, movie_id=movie_id2)
+    assert db.access_cache[user_id][1] == frozenset([movie_id, movie_id2])
+
+    # movie_ids from requests are strings
+    assert db.can_access_movie(user_id=user_id, movie_id=str(movie_id2))
+    assert not db.can_access_movie(user_id=user_id, movie_id='not-a-movie')
+    assert not db.can_access_movie(user_id=user_id, movie_id=None)
+
+    # Writing movie metadata does not change access, so it leaves the cached sets alone
+    db.set_metadata(user_id=user_id, set_movie_id=movie_id2, prop='fps', value='30')
+    assert db.access_cache[user_id][1] == frozenset([movie_id, movie_id2])
+    db.purge_movie(movie_id=movie_id2)
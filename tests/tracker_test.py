@@ -38,6 +38,7 @@ from user_test import new_user,new_course,API_KEY,MOVIE_ID,MOVIE_TITLE,USER_ID,D
 from movie_test import new_movie
 from constants import MIME,Engines
 import tracker
+import gravitropism
 
 
 TEST_LABEL1 = 'test-label1'
@@ -102,6 +103,81 @@ def test_track_point_annotations(new_movie):
     assert tps[2]['frame_id'] == frame_id
 
 
+def test_put_movie_trackpoints(new_movie):
+    """Replace the trackpoints of many frames at once"""
+    movie_id = new_movie[MOVIE_ID]
+    tp0 = {'x':10,'y':11,'label':TEST_LABEL1}
+    tp1 = {'x':20,'y':21,'label':TEST_LABEL2}
+    assert db.put_movie_trackpoints(movie_id=movie_id,
+                                    trackpoints_by_frame=[(0, [tp0, tp1]), (1, [tp0]), (2, [tp1])]) == 4
+    tps = db.get_movie_trackpoints(movie_id=movie_id)
+    assert [(tp['frame_number'],tp['label']) for tp in tps] == [(0,TEST_LABEL1),(0,TEST_LABEL2),(1,TEST_LABEL1),(2,TEST_LABEL2)]
+
+    # The export reads the same trackpoints a page at a time, including pages that end inside a frame
+    for page_size in [1, 3, 4, 100]:
+        assert list(db.iter_movie_trackpoints(movie_id=movie_id, page_size=page_size)) == tps
+
+    # Replacing frames 1 and 2 leaves frame 0 alone, and an empty list removes a frame's trackpoints
+    assert db.put_movie_trackpoints(movie_id=movie_id,
+                                    trackpoints_by_frame=[(1, [tp1]), (2, [])]) == 1
+    tps = db.get_movie_trackpoints(movie_id=movie_id)
+    assert [(tp['frame_number'],tp['label']) for tp in tps] == [(0,TEST_LABEL1),(0,TEST_LABEL2),(1,TEST_LABEL2)]
+
+    with pytest.raises(KeyError):
+        db.put_movie_trackpoints(movie_id=movie_id, trackpoints_by_frame=[(0, [{'x':1,'y':2}])])
+
+def test_get_frame_bundle(new_movie):
+    """The single-query bundle should return the same as the separate queries"""
+    movie_id = new_movie[MOVIE_ID]
+    tp0 = {'x':10,'y':11,'label':TEST_LABEL1}
+    tp1 = {'x':20,'y':21,'label':TEST_LABEL2}
+    frame_id = db.create_new_frame(movie_id=movie_id, frame_number=0)
+    db.put_frame_trackpoints(frame_id=frame_id, trackpoints=[ tp0, tp1 ])
+    db.put_frame_trackpoints(frame_id=db.create_new_frame(movie_id=movie_id, frame_number=3), trackpoints=[ tp0 ])
+
+    for bundle in [db.get_frame_bundle(movie_id=movie_id, frame_number=0),
+                   db.get_frame_bundle(frame_id=frame_id)]:
+        assert bundle['frame_id'] == frame_id
+        assert bundle['movie_id'] == movie_id
+        assert bundle['frame_number'] == 0
+        assert bundle['trackpoints'] == db.get_frame_trackpoints(frame_id=frame_id)
+        assert bundle['annotations'] == db.get_frame_annotations(frame_id=frame_id)
+        assert bundle['last_tracked_frame'] == db.last_tracked_frame(movie_id=movie_id) == 3
+
+    # A frame that is not in the database still reports the movie's last tracked frame
+    bundle = db.get_frame_bundle(movie_id=movie_id, frame_number=2)
+    assert bundle['frame_id'] is None
+    assert bundle['trackpoints'] == bundle['annotations'] == []
+    assert bundle['last_tracked_frame'] == 3
+
+def test_movie_trajectory(new_movie):
+    """A stored trajectory is what get_movie_trackpoints returns, until a frame's trackpoints change"""
+    movie_id = new_movie[MOVIE_ID]
+    tp0 = {'x':10,'y':11,'label':TEST_LABEL1}
+    db.put_movie_trackpoints(movie_id=movie_id, trackpoints_by_frame=[(0, [tp0]), (1, [tp0])])
+    points = np.array([[[10, 11], [np.nan, np.nan]],
+                       [[10.25, 11.5], [30, 31]],
+                       [[np.nan, np.nan], [np.nan, np.nan]]], dtype=np.float32)
+    db.put_movie_trajectory(movie_id=movie_id, labels=[TEST_LABEL1, TEST_LABEL2], points=points)
+    trajectory = db.get_movie_trajectory(movie_id=movie_id)
+    assert trajectory['labels'] == [TEST_LABEL1, TEST_LABEL2]
+    assert np.array_equal(trajectory['points'], points, equal_nan=True)
+
+    # Sub-pixel positions are kept; whole numbers read back as ints
+    tps = db.get_movie_trackpoints(movie_id=movie_id)
+    assert tps == [{'frame_number':0, 'x':10, 'y':11, 'label':TEST_LABEL1},
+                   {'frame_number':1, 'x':10.25, 'y':11.5, 'label':TEST_LABEL1},
+                   {'frame_number':1, 'x':30, 'y':31, 'label':TEST_LABEL2}]
+    assert db.get_movie_trackpoints(movie_id=movie_id, frame_start=1, frame_end=1) == tps[1:]
+    assert db.last_tracked_frame(movie_id=movie_id) == 1
+
+    # Changing a frame's trackpoints deletes the trajectory; the rows are read instead
+    db.put_frame_trackpoints(frame_id=db.get_frame(movie_id=movie_id, frame_number=1)['frame_id'], trackpoints=[])
+    assert db.get_movie_trajectory(movie_id=movie_id) is None
+    tps = db.get_movie_trackpoints(movie_id=movie_id)
+    assert [(tp['frame_number'], tp['x'], tp['y']) for tp in tps] == [(0, 10, 11)]
+    assert db.last_tracked_frame(movie_id=movie_id) == 0
+
 def test_cleanup_mp4():
     with pytest.raises(FileNotFoundError):
         tracker.cleanup_mp4(infile='no-such-file',outfile='no-such-file')
@@ -137,6 +213,14 @@ def test_pixels_to_mm():
     assert y2_mm - 88.3883 <= 0.0001
 
 
+def parse_columns(data):
+    """Split a columnar export into its header and a dictionary of column name -> numpy array"""
+    (header_length,) = bottle_api.GET_FRAMES_HEADER_LENGTH.unpack_from(data)
+    start = bottle_api.GET_FRAMES_HEADER_LENGTH.size + header_length
+    header = json.loads(data[bottle_api.GET_FRAMES_HEADER_LENGTH.size:start])
+    values = np.frombuffer(data[start:], dtype=header['dtype']).reshape(len(header['columns']), header['frame_count'])
+    return (header, dict(zip(header['columns'], values)))
+
 def test_movie_tracking(new_movie):
     """
     Load up our favorite trackpoint ask the API to track a movie!
@@ -168,11 +252,12 @@ def test_movie_tracking(new_movie):
     assert ret['error']==False
 
     # Now track with CV2 - This actually does the tracking when run outsie of lambda
+    # Send the engine version the way that analyze.js does
     with boddle(params={'api_key': api_key,
                         'movie_id': str(movie_id),
                         'frame_start': '0',
                         'engine_name':Engines.CV2,
-                        'engine_version':0 }):
+                        'engine_version':'1.0' }):
         ret = bottle_api.api_track_movie_queue()
     logging.debug("track movie ret=%s",ret)
     assert ret['error']==False
@@ -181,7 +266,7 @@ def test_movie_tracking(new_movie):
     # The trackpoints go with the original movie, not the tracked one.
     with boddle(params={'api_key': api_key,
                         'movie_id': movie_id}):
-        ret = bottle_api.api_get_movie_trackpoints()
+        ret = "".join(bottle_api.api_get_movie_trackpoints())
     lines = ret.splitlines()
     # Check that the header is set
     fields = lines[0].split(",")
@@ -206,6 +291,38 @@ def test_movie_tracking(new_movie):
     # Make sure we got a lot back
     assert len(lines) > 50
 
+    # The same trackpoints as binary columns
+    with boddle(params={'api_key': api_key,
+                        'movie_id': movie_id,
+                        'format': 'columns'}):
+        (header, columns) = parse_columns(b"".join(bottle_api.api_get_movie_trackpoints()))
+    assert header['labels'] == ['track1','track2']
+    assert header['frame_count'] >= len(lines)-1
+    assert columns['track1 x'][0] == 275
+    assert close(columns['track2 y'][10], 171.97594)
+
+    # Analyze the motion of the tracked points. A GET does not write the cache; a POST does,
+    # and the GET after it is answered from the cache.
+    engine_id = db.get_analysis_engine_id(engine_name=gravitropism.GRAVITROPISM_ENGINE,
+                                          engine_version=gravitropism.GRAVITROPISM_VERSION)
+    for (method, cached) in [('GET', False), ('POST', True), ('GET', True)]:
+        with boddle(method=method,
+                    params={'api_key': api_key,
+                            'movie_id': movie_id}):
+            ret = bottle_api.api_get_movie_gravitropism()
+        assert (db.get_movie_analysis(movie_id=movie_id, engine_id=engine_id) is not None) == cached
+        assert ret['error']==False
+        assert ret['analysis']['units']=='pixels'
+        assert sorted(ret['analysis']['tracks'])==['track1','track2']
+        assert close(ret['analysis']['tracks']['track1']['x'][10], 272.28845)
+
+    # The same trackpoints as a WebVTT metadata track
+    with boddle(params={'api_key': api_key,
+                        'movie_id': movie_id}):
+        vtt = "".join(bottle_api.api_get_movie_track())
+    assert vtt.startswith("WEBVTT")
+    assert vtt.count(" --> ") > 50
+
 def test_render_trackpoints():
     input_trackpoints = [{"x":138,"y":86,"label":"mypoint",'frame_number':0}];
 
@@ -219,3 +336,242 @@ def test_render_trackpoints():
         tracker.render_tracked_movie( moviefile_input= infile, moviefile_output=tf.name,
                               movie_trackpoints=res['output_trackpoints'])
         assert os.path.getsize(tf.name)>100
+
+def test_trackpoints_to_webvtt():
+    """Each frame with trackpoints becomes a cue that lasts one frame"""
+    trackpoints = [{'frame_number':0, 'label':'apex', 'x':10.5, 'y':20},
+                   {'frame_number':0, 'label':'ruler 0 mm', 'x':1, 'y':2},
+                   {'frame_number':61, 'label':'apex', 'x':11, 'y':21.25}]
+    vtt = "".join(tracker.trackpoints_to_webvtt(trackpoints, fps=30))
+    assert vtt.startswith("WEBVTT\n\n")
+    cues = vtt.strip().split("\n\n")[1:]
+    assert len(cues) == 2
+    (cue_id, timing, payload) = cues[1].split("\n")
+    assert cue_id == '61'
+    assert timing == '00:00:02.033 --> 00:00:02.067'
+    assert json.loads(payload) == [{'label':'apex', 'x':11, 'y':21.25}]
+    assert len(json.loads(cues[0].split("\n")[2])) == 2
+    assert tracker.webvtt_timestamp(3723.5) == '01:02:03.500'
+
+def test_render_preview(monkeypatch):
+    """A preview render is scaled down to RENDER_PREVIEW_HEIGHT"""
+    monkeypatch.setattr(tracker, 'RENDER_PREVIEW_HEIGHT', 120)
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    with tempfile.NamedTemporaryFile(suffix='.mp4') as tf:
+        tracker.render_tracked_movie( moviefile_input= infile, moviefile_output=tf.name,
+                                      movie_trackpoints=[{"x":138,"y":86,"label":"mypoint",'frame_number':0}],
+                                      preview=True)
+        cap = cv2.VideoCapture(tf.name)
+        assert int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == 120
+        assert int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) == 160
+        cap.release()
+
+def test_extract_frame_with_index():
+    """Make sure that seeking through the movie index returns the same frames as a sequential decode"""
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    with open(infile,'rb') as f:
+        movie_data = f.read()
+    cap = cv2.VideoCapture(infile)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+
+    movie_index = tracker.build_movie_index(infile)
+    assert movie_index['total_frames'] == len(frames)
+    assert movie_index['keyframes'][0] == 0
+
+    for frame_number in [0, 1, 74, 75, 76, 150, len(frames)-1]:
+        frame = tracker.extract_frame(movie_data=movie_data, frame_number=frame_number, fmt='CV2')
+        assert np.array_equal(frame, frames[frame_number])
+
+    for frame_number in [-1, len(frames)]:
+        with pytest.raises(ValueError):
+            tracker.extract_frame(movie_data=movie_data, frame_number=frame_number, fmt='jpeg')
+
+def test_extract_frames():
+    """Make sure a single pass extracts the same frames as random access"""
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    with open(infile,'rb') as f:
+        movie_data = f.read()
+    frames = list(tracker.extract_frames(movie_data=movie_data, frame_start=70, frame_end=160, frame_stride=10, fmt='CV2'))
+    assert [frame_number for (frame_number, _) in frames] == list(range(70, 161, 10))
+    for (frame_number, frame) in frames:
+        assert np.array_equal(frame, tracker.extract_frame(movie_data=movie_data, frame_number=frame_number, fmt='CV2'))
+    assert list(tracker.extract_frames(movie_data=movie_data, frame_start=1_000_000)) == []
+
+def test_extract_movie_metadata():
+    """The metadata is read from the container; make sure the frame count matches a full decode"""
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-31 plantmovie.mov")
+    with open(infile,'rb') as f:
+        movie_data = f.read()
+    cap = cv2.VideoCapture(infile)
+    decoded_frames = 0
+    while cap.read()[0]:
+        decoded_frames += 1
+    cap.release()
+    metadata = tracker.extract_movie_metadata(movie_data=movie_data)
+    assert metadata['total_frames'] == decoded_frames
+    assert metadata['total_bytes'] == len(movie_data)
+    assert metadata['width'] > 0 and metadata['height'] > 0
+    assert metadata['fps'] > 0
+
+def test_movie_reader():
+    """Reading from a file, from a buffer in memory, and from a content-addressed movie file must give the same frames"""
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-31 plantmovie.mov")
+    with open(infile,'rb') as f:
+        movie_data = f.read()
+    from_file   = tracker.MovieReader(moviefile=infile)
+    from_buffer = tracker.MovieReader(movie_data=memoryview(movie_data))
+    assert from_file.metadata()['total_frames'] == from_buffer.metadata()['total_frames']
+    for ((n1, f1), (n2, f2)) in zip(from_file.frames(frame_start=25, frame_end=35),
+                                    from_buffer.frames(frame_start=25, frame_end=35)):
+        assert n1 == n2
+        assert np.array_equal(f1, f2)
+    assert np.array_equal(from_file.read_frame(31), from_buffer.read_frame(31))
+
+    # The movie is only written once
+    fname = tracker.movie_file(movie_data=movie_data)
+    assert fname == tracker.movie_file(movie_data=movie_data)
+    with open(fname,'rb') as f:
+        assert f.read() == movie_data
+
+    # A reader whose file is evicted by another process writes it again
+    tracker.evict_movie_file(fname)
+    assert np.array_equal(from_file.read_frame(31), from_buffer.read_frame(31))
+    assert os.path.exists(fname)
+
+def test_movie_file_held(monkeypatch, tmp_path):
+    """A movie file that is being tracked is not evicted, and a decoder that cannot open its file raises"""
+    monkeypatch.setattr(tracker, 'MOVIE_FILE_CACHE_SIZE', 1)
+    monkeypatch.setattr(tracker, 'MOVIE_FILE_DIR', str(tmp_path))
+    monkeypatch.setattr(tracker, 'movie_files', {})
+    with open(os.path.join(TEST_DATA_DIR,"2019-07-31 plantmovie.mov"),'rb') as f:
+        movie_data = f.read()
+    fname = tracker.movie_file(movie_data=movie_data)
+    with tracker.movie_file_held(fname):
+        tracker.movie_file(movie_data=movie_data + b'1')
+        assert os.path.exists(fname)
+    tracker.movie_file(movie_data=movie_data + b'2')
+    assert not os.path.exists(fname)
+
+    with pytest.raises(FileNotFoundError):
+        tracker.decode_segment(fname, 0, 1, [0])
+    with pytest.raises(FileNotFoundError):
+        list(tracker.sequential_frames(fname))
+
+def test_track_movie_arrays():
+    """The array output of track_movie must match the dict output"""
+    input_trackpoints = [{"x":275,"y":215,"label":"track1",'frame_number':0},
+                         {"x":410,"y":175,"label":"track2",'frame_number':0}]
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-31 plantmovie.mov")
+    dicts  = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints)
+    arrays = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                 output='arrays')
+    assert arrays['labels'] == ['track1','track2']
+    assert arrays['points'].dtype == np.float32
+    assert arrays['points'].shape[1:] == (2,2)
+    from_arrays = [tp for (_,tps) in tracker.trackpoints_from_arrays(labels=arrays['labels'], points=arrays['points'])
+                   for tp in tps]
+    assert len(from_arrays) == len(dicts['output_trackpoints'])
+    for (a,b) in zip(from_arrays, dicts['output_trackpoints']):
+        assert (a['label'],a['frame_number']) == (b['label'],b['frame_number'])
+        assert math.isclose(a['x'], b['x']) and math.isclose(a['y'], b['y'])
+
+def test_engines():
+    """Every engine can be found by name and version, and the NULL engine copies the points through"""
+    assert tracker.get_engine().name == Engines.CV2
+    for version in [None, '', 0, '0', '1', '1.0', 1.0]:
+        assert tracker.get_engine(engine_name=Engines.CV2, engine_version=version).version == '1'
+    with pytest.raises(RuntimeError):
+        tracker.get_engine(engine_name=Engines.CV2, engine_version='no-such-version')
+
+    input_trackpoints = [{"x":275,"y":215,"label":"track1",'frame_number':0}]
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-31 plantmovie.mov")
+    null = tracker.track_movie(engine_name=Engines.NULL, moviefile_input=infile, input_trackpoints=input_trackpoints,
+                               output='arrays')
+    assert np.all(null['points'][:,0] == [275,215])
+    for version in ['fast','precise']:
+        res = tracker.track_movie(engine_name=Engines.CV2, engine_version=version, moviefile_input=infile,
+                                  input_trackpoints=input_trackpoints, output='arrays')
+        assert res['points'].shape == null['points'].shape
+
+def test_track_movie_parallel():
+    """Decoding in a pool of processes must not change the tracking"""
+    input_trackpoints = [{"x":138,"y":86,"label":"mypoint",'frame_number':0}]
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    segments = tracker.movie_segments(tracker.build_movie_index(infile), target_segments=8)
+    assert segments[0][0] == 0
+    assert all(a[1]+1 == b[0] for (a,b) in zip(segments, segments[1:]))
+    sequential = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                     output='arrays')
+    parallel   = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                     output='arrays', workers=2)
+    assert np.array_equal(sequential['points'], parallel['points'], equal_nan=True)
+
+def test_track_movie_parallel_many_segments(monkeypatch):
+    """More segments than are in flight, and segments that do not begin at keyframes"""
+    monkeypatch.setattr(tracker, 'TRACK_SEGMENT_MAX_FRAMES', 10)
+    monkeypatch.setattr(tracker, 'TRACK_IN_FLIGHT_PER_WORKER', 1)
+    input_trackpoints = [{"x":138,"y":86,"label":"mypoint",'frame_number':0}]
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    segments = tracker.movie_segments(tracker.build_movie_index(infile), target_segments=8)
+    assert len(segments) > 2*tracker.TRACK_IN_FLIGHT_PER_WORKER
+    assert all(last-first < 10 for (first,last) in segments)
+    assert all(a[1]+1 == b[0] for (a,b) in zip(segments, segments[1:]))
+    sequential = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                     output='arrays')
+    parallel   = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                     output='arrays', workers=2)
+    assert np.array_equal(sequential['points'], parallel['points'], equal_nan=True)
+
+def test_track_movie_no_trackpoints():
+    """A movie with no trackpoints is gone through without tracking anything"""
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    for workers in [None, 2]:
+        tracked = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=[],
+                                      output='arrays', workers=workers)
+        assert tracked['labels'] == []
+        assert tracked['points'].shape == (tracked['last_tracked_frame']+1, 0, 2)
+        assert next(tracker.trackpoints_from_arrays(labels=tracked['labels'], points=tracked['points'])) == (0, [])
+
+def test_track_movie_incremental():
+    """Retracking from a later frame seeks to it, and stops once it reproduces the stored trackpoints"""
+    input_trackpoints = [{"x":138,"y":86,"label":"mypoint",'frame_number':0}]
+    infile = os.path.join(TEST_DATA_DIR,"2019-07-12 circumnutation.mp4")
+    tracked = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=input_trackpoints,
+                                  output='arrays')
+    stored = [tp for (_,tps) in tracker.trackpoints_from_arrays(labels=tracked['labels'], points=tracked['points'])
+              for tp in tps]
+
+    retracked = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=stored,
+                                    frame_start=100, output='arrays')
+    assert retracked['last_tracked_frame'] == len(tracked['points'])-1
+    assert np.array_equal(retracked['points'], tracked['points'], equal_nan=True)
+
+    converged = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=stored,
+                                    frame_start=100, output='arrays', converge_tolerance=tracker.TRACK_CONVERGE_TOLERANCE)
+    assert converged['last_tracked_frame'] == 100 + tracker.TRACK_CONVERGE_FRAMES
+    assert np.array_equal(converged['points'], tracked['points'], equal_nan=True)
+
+    # If the stored trackpoints end before the movie does, tracking resumes after the last of them
+    partial = [tp for tp in stored if tp['frame_number'] <= 200]
+    resumed = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=partial,
+                                  frame_start=100, output='arrays', converge_tolerance=tracker.TRACK_CONVERGE_TOLERANCE)
+    assert resumed['last_tracked_frame'] == len(tracked['points'])-1
+    assert np.array_equal(resumed['points'], tracked['points'], equal_nan=True)
+
+    # Moving the point means that the new trajectory never meets the stored one
+    moved = [{**tp, 'x':tp['x']+5} if tp['frame_number']==100 else tp for tp in stored]
+    diverged = tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=moved,
+                                   frame_start=100, output='arrays', converge_tolerance=tracker.TRACK_CONVERGE_TOLERANCE)
+    assert diverged['last_tracked_frame'] == len(tracked['points'])-1
+
+    # A frame_start after the end of the movie is an error, not a run that tracks nothing
+    for workers in [None, 2]:
+        with pytest.raises(ValueError):
+            tracker.track_movie(engine_name="CV2", moviefile_input=infile, input_trackpoints=stored,
+                                frame_start=len(tracked['points']), output='arrays', workers=workers)
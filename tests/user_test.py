@@ -331,6 +331,18 @@ def test_new_movie_analysis(new_engine):
     # delete the created movie_analysis
     db.delete_movie_analysis(movie_analysis_id=movie_analysis_id)
 
+def test_analysis_engine_id_cache():
+    """The engine_id is remembered until the engine is deleted, and then the engine is created again"""
+    engine_name = 'pytest-engine-cache'
+    engine_id = db.get_analysis_engine_id(engine_name=engine_name, engine_version='1')
+    assert db.engine_ids[(engine_name, '1')] == engine_id
+    assert db.get_analysis_engine_id(engine_name=engine_name, engine_version='1') == engine_id
+    db.delete_analysis_engine_id(engine_id=engine_id)
+    assert (engine_name, '1') not in db.engine_ids
+    engine_id = db.get_analysis_engine_id(engine_name=engine_name, engine_version='1')
+    assert db.get_analysis_engine_id(engine_name=engine_name, engine_version='1') == engine_id
+    db.delete_analysis_engine_id(engine_id=engine_id)
+
 def test_get_logs(new_user):
     """Incrementally test each part of the get_logs functions. We don't really care what the returns are"""
     dbreader = get_dbreader()
@@ -424,3 +436,40 @@ def test_log_search_user(new_user):
 
     # We should have nothing with this IP address
     assert(len(db.get_logs( user_id=user_id, ipaddr="0.0.0.0"))==0)
+
+def test_audit_log(new_user):
+    """Records queued by logit() are written by the audit log's writer thread and are visible after a flush"""
+    user_id = new_user[USER_ID]
+    api_key = new_user[API_KEY]
+    func_name = 'test_audit_log_' + str(uuid.uuid4())[0:8]
+    with boddle(params={'api_key': api_key}):
+        for i in range(3):
+            db.logit(func_name=func_name, func_args={'i':i}, func_return=None)
+    db.flush_logs()
+    rows = dbfile.DBMySQL.csfr(get_dbreader(), "SELECT user_id FROM logs WHERE func_name=%s", (func_name,))
+    assert len(rows)==3
+    assert all(row[0]==user_id for row in rows)
+    assert api_key in db.audit_log.api_key_ids
+
+    # Deleting a key forgets its ids
+    db.forget_api_keys(api_key)
+    assert api_key not in db.audit_log.api_key_ids
+
+def test_validate_api_key_cache(new_user):
+    """Validated api_keys are cached, their use is counted in memory, and a deleted key is no longer valid"""
+    api_key = new_user[API_KEY]
+    def use_count():
+        return dbfile.DBMySQL.csfr(get_dbreader(), "SELECT use_count FROM api_keys WHERE api_key=%s", (api_key,))[0][0]
+    db.flush_api_key_usage()
+    count0 = use_count()
+    assert db.validate_api_key(api_key)['user_id'] == new_user[USER_ID]
+    assert db.validate_api_key(api_key)['user_id'] == new_user[USER_ID]
+    db.flush_api_key_usage()
+    assert use_count() == count0 + 2
+
+    # Each request validates the api_key only once
+    with boddle(params={'api_key': api_key}):
+        assert bottle_api.get_user_id() == new_user[USER_ID]
+        assert bottle_api.get_user_id() == new_user[USER_ID]
+    db.flush_api_key_usage()
+    assert use_count() == count0 + 3
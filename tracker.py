@@ -10,12 +10,19 @@ import tempfile
 import subprocess
 import logging
 import os
-from collections import defaultdict
+import bisect
+import hashlib
+import threading
+import itertools
+import multiprocessing
+import concurrent.futures
+from collections import defaultdict,deque,Counter
+from contextlib import contextmanager
 
 import math
 import cv2
 import numpy as np
-from constants import Engines
+from constants import Engines,C
 import paths
 
 FFMPEG_PATH = paths.ffmpeg_path()
@@ -26,6 +33,9 @@ TEXT_FACE = cv2.FONT_HERSHEY_DUPLEX
 TEXT_SCALE = 0.75
 TEXT_THICKNESS = 2
 TEXT_MARGIN = 5
+MOVIE_INDEX_CACHE_SIZE = 256    # number of movie indexes kept in memory
+MOVIE_FILE_CACHE_SIZE = 16      # number of content-addressed movie files kept in MOVIE_FILE_DIR
+MOVIE_FILE_DIR = os.path.join(tempfile.gettempdir(), 'planttracer-movies')
 
 ## JPEG support
 
@@ -35,37 +45,175 @@ class ConversionError(RuntimeError):
 class MovieCorruptError(RuntimeError):
     """Special error"""
 
+class PointTracker:
+    """Tracks an array of points from frame to frame with pyramidal Lucas-Kanade optical flow.
+    Points are kept in a float32 array of shape (N,1,2); a point that has been lost is NaN.
+    Each frame is converted to grayscale once; the grayscale image is kept and used as the previous
+    frame when the next frame is tracked. (The Python binding of calcOpticalFlowPyrLK only accepts images,
+    not the pyramids made by buildOpticalFlowPyramid, so the pyramids are rebuilt inside OpenCV.)
+    """
+    def __init__(self, *, win_size=(15, 15), max_level=2,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)):
+        self.win_size = win_size
+        self.max_level = max_level
+        self.criteria = criteria
+        self.gray = None
+
+    def set_frame(self, frame, gray=None):
+        """Make frame (a CV2 BGR image) the previous frame, without tracking any points.
+        :param: gray - frame converted to grayscale, if it has already been converted.
+        """
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if gray is None else gray
+
+    def track(self, frame, points, gray=None):
+        """Track points from the previous frame into frame, which then becomes the previous frame.
+        :param: frame - CV2 BGR image
+        :param: points - float32 array of shape (N,1,2). Rows that are NaN are not tracked.
+        :param: gray - frame converted to grayscale, if it has already been converted.
+        :return: (points_out, err) - points_out has the same shape as points; points that are lost are NaN.
+        """
+        assert self.gray is not None
+        gray_prev = self.gray
+        self.set_frame(frame, gray)
+        points_out = np.full_like(points, np.nan)
+        err_out    = np.full(len(points), np.nan, dtype=np.float32)
+        live = ~np.isnan(points).any(axis=(1, 2))
+        if not live.any():
+            return (points_out, err_out)
+        try:
+            tracked, status, err = cv2.calcOpticalFlowPyrLK(gray_prev, self.gray, points[live], None,
+                                                            winSize=self.win_size, maxLevel=self.max_level,
+                                                            criteria=self.criteria)
+        except cv2.error:      # pylint: disable=catching-non-exception
+            return (points_out, err_out)
+        found = status[:, 0]==1
+        rows  = np.flatnonzero(live)[found]
+        points_out[rows] = tracked[found]
+        err_out[rows]    = err[found, 0]
+        return (points_out, err_out)
+
+
 def cv2_track_frame(*,frame_prev, frame_this, trackpoints):
     """
-    Summary - Takes the original marked marked_frame and new frame and returns a frame that is annotated.
-    :param: frame0 - cv2 image of the previous frame in CV2 format
-    :param: frame1 - cv2 image of the current frame in CV2 format
+    Summary - Tracks trackpoints from one frame to the next. This is a dict interface to PointTracker for a single pair of frames;
+    track_movie() uses PointTracker directly, so that each frame is only converted once.
+    :param: frame_prev - cv2 image of the previous frame in CV2 format
+    :param: frame_this - cv2 image of the current frame in CV2 format
     :param: trackpoints  - array of trackpoints (dicts of x,y and label)
-    :return: array of trackpoints
-
+    :return: array of trackpoints that were found in frame_this
     """
-    winSize=(15, 15)
-    maxLevel=2
-    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
-    tpts = np.array([[pt['x'],pt['y']] for pt in trackpoints],dtype=np.float32)
-
+    pt = get_engine(engine_name=Engines.CV2).new_tracker()
+    pt.set_frame(frame_prev)
+    points_out, err = pt.track(frame_this, trackpoints_to_array(trackpoints))
+    return [{'x':float(points_out[i][0][0]),
+             'y':float(points_out[i][0][1]),
+             'status':1,
+             'err':float(err[i]),
+             'label':tp['label']}
+            for (i,tp) in enumerate(trackpoints) if not np.isnan(err[i])]
+
+def trackpoints_to_array(trackpoints, labels=None):
+    """Convert a list of trackpoint dicts to a float32 array of shape (N,1,2).
+    :param: labels - if provided, row i is the point labeled labels[i], or NaN if there is no such point.
+    """
+    if labels is None:
+        return np.array([[[tp['x'],tp['y']]] for tp in trackpoints], dtype=np.float32).reshape(-1,1,2)
+    points = np.full((len(labels),1,2), np.nan, dtype=np.float32)
+    row = {label:i for (i,label) in enumerate(labels)}
+    for tp in trackpoints:
+        if tp['label'] in row:
+            points[row[tp['label']]][0] = (tp['x'], tp['y'])
+    return points
+
+def trackpoints_from_arrays(*, labels, points, frame_start=0):
+    """Materialize the arrays returned by track_movie(output='arrays') as trackpoint dicts.
+    :param: labels - the label of each point
+    :param: points - float32 array of shape (frames, labels, 2), NaN where a point was not found
+    :param: frame_start - first frame to return
+    :return: yields (frame_number, [trackpoint dicts]) for each frame
+    """
+    for frame_number in range(frame_start, len(points)):
+        row = points[frame_number]
+        yield (frame_number, [{'x':float(row[i][0]), 'y':float(row[i][1]), 'label':label, 'frame_number':frame_number}
+                              for (i,label) in enumerate(labels) if not np.isnan(row[i][0])])
+
+class NullTracker:
+    """Tracker for the NULL engine: points are copied from each frame to the next, and frames are never converted."""
+    def set_frame(self, frame, gray=None):
+        pass
+
+    def track(self, frame, points, gray=None): # pylint: disable=unused-argument
+        return (points.copy(), np.where(np.isnan(points[:, 0, 0]), np.nan, 0).astype(np.float32))
+
+
+################################################################
+## Tracking engines.
+## Each engine is registered under the name and version that are stored in the engines table
+## (see db.get_analysis_engine_id), so analysis in the database records which engine made it.
+
+class TrackingEngine:
+    """A named, versioned tracking engine and the parameters that it gives to its tracker"""
+    def __init__(self, *, name, version, description, tracker_class, **params):
+        self.name = name
+        self.version = version
+        self.description = description
+        self.tracker_class = tracker_class
+        self.params = params
+
+    def new_tracker(self):
+        """Return a new tracker (with set_frame() and track() methods) for one pass through a movie"""
+        return self.tracker_class(**self.params)
+
+    def __repr__(self):
+        return f"<TrackingEngine {self.name} {self.version} {self.params}>"
+
+ENGINES = {}                    # (name, version) -> TrackingEngine
+DEFAULT_ENGINE_NAME = Engines.CV2
+DEFAULT_ENGINE_VERSIONS = {}    # name -> version used when no version is specified
+
+def register_engine(engine, *, default=False):
+    ENGINES[(engine.name, engine.version)] = engine
+    if default or engine.name not in DEFAULT_ENGINE_VERSIONS:
+        DEFAULT_ENGINE_VERSIONS[engine.name] = engine.version
+
+def normalize_engine_version(engine_version):
+    """Numeric versions are registered as integers, so '1.0' (as sent by analyze.js) and 1.0 are version '1'."""
     try:
-        gray_frame0 = cv2.cvtColor(frame_prev, cv2.COLOR_BGR2GRAY)
-        gray_frame1 = cv2.cvtColor(frame_this, cv2.COLOR_BGR2GRAY)
-        point_array_out, status_array, err = cv2.calcOpticalFlowPyrLK(gray_frame0, gray_frame1, tpts, None,
-                                                                      winSize=winSize, maxLevel=maxLevel, criteria=criteria)
-        trackpoints_out = []
-        for (i,pt) in enumerate(trackpoints):
-            if status_array[i]==1:
-                trackpoints_out.append({'x':point_array_out[i][0],
-                                        'y':point_array_out[i][1],
-                                        'status':int(status_array[i][0]),
-                                        'err':float(err[i][0]),
-                                        'label':pt['label']})
-    except cv2.error:      # pylint: disable=catching-non-exception
-        trackpoints_out = []
-
-    return trackpoints_out
+        number = float(engine_version)
+    except (TypeError, ValueError):
+        return str(engine_version)
+    return str(int(number)) if number.is_integer() else str(engine_version)
+
+def get_engine(*, engine_name=None, engine_version=None):
+    """Return the TrackingEngine for engine_name and engine_version.
+    :param: engine_name - if None, the default engine (CV2)
+    :param: engine_version - if None, '' or 0, the engine's default version. '1.0' is the same as '1'.
+    :raises RuntimeError: if there is no such engine
+    """
+    if not engine_name:
+        engine_name = DEFAULT_ENGINE_NAME
+    if engine_version in (None, '', 0, '0'):
+        engine_version = DEFAULT_ENGINE_VERSIONS.get(engine_name)
+    try:
+        return ENGINES[(engine_name, normalize_engine_version(engine_version))]
+    except KeyError as e:
+        raise RuntimeError(f"Engine_name={engine_name} engine_version={engine_version} is not a known tracking engine") from e
+
+register_engine(TrackingEngine(name=Engines.NULL, version='1', tracker_class=NullTracker,
+                               description='points are copied from input to output'))
+register_engine(TrackingEngine(name=Engines.CV2, version='1', tracker_class=PointTracker,
+                               description='Lucas-Kanade optical flow',
+                               win_size=(15, 15), max_level=2,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)),
+                default=True)
+register_engine(TrackingEngine(name=Engines.CV2, version='fast', tracker_class=PointTracker,
+                               description='coarse Lucas-Kanade optical flow, for previews',
+                               win_size=(9, 9), max_level=1,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 5, 0.1)))
+register_engine(TrackingEngine(name=Engines.CV2, version='precise', tracker_class=PointTracker,
+                               description='Lucas-Kanade optical flow with a larger window and more iterations',
+                               win_size=(21, 21), max_level=3,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)))
 
 def cv2_label_frame(*, frame, trackpoints, frame_label=None):
     """
@@ -92,59 +240,331 @@ def cv2_label_frame(*, frame, trackpoints, frame_label=None):
         cv2.putText(frame, text, text_origin, TEXT_FACE, TEXT_SCALE, WHITE, TEXT_THICKNESS, cv2.LINE_4)
 
 
-def extract_movie_metadata(*, movie_data):
-    """Use OpenCV to get the movie metadata"""
-    with tempfile.NamedTemporaryFile(mode='ab') as tf:
-        tf.write(movie_data)
-        tf.flush()
-        cap = cv2.VideoCapture(tf.name)
-        total_frames = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if len(frame)==0:
-                raise MovieCorruptError()
-
-            total_frames += 1
-    return {'total_frames':total_frames,
-            'total_bytes':len(movie_data),
-            'width':int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-            'height':int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-            'fps':cap.get(cv2.CAP_PROP_FPS)}
-
 def convert_frame_to_jpeg(img):
     """Use CV2 to convert a frame to a jpeg"""
     _,jpg_img = cv2.imencode('.jpg',img, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
     return jpg_img.tobytes()
 
-def extract_frame(*, movie_data, frame_number, fmt):
-    """Extract a frame from movie data using CV2. This is not an efficient approach to read the entire movie.
+################################################################
+## Movie index.
+## The index records which frames are keyframes, so that a frame can be
+## found by seeking to the closest keyframe and decoding forward from there,
+## rather than decoding every frame from the start of the movie.
+
+movie_indexes = {}              # movie_sha256 -> movie index
+
+def build_movie_index(moviefile):
+    """Scan the packets of a movie without decoding them.
+    :param: moviefile - file name of the movie
+    :return: dict 'keyframes' - sorted list of the frame numbers of the keyframes
+                  'total_frames' - number of frames in the movie
+    Frame 0 is always listed as a keyframe, so a container that does not report keyframes
+    degrades to a sequential decode from the start of the movie.
+    """
+    cap = cv2.VideoCapture(moviefile, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    keyframes = []
+    total_frames = 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(total_frames)
+        total_frames += 1
+    cap.release()
+    if not keyframes or keyframes[0]!=0:
+        keyframes.insert(0, 0)
+    return {'keyframes':keyframes, 'total_frames':total_frames}
+
+def get_movie_index(*, moviefile, movie_sha256):
+    """Return the index for a movie, building it the first time the movie is seen."""
+    index = movie_indexes.get(movie_sha256)
+    if index is None:
+        index = build_movie_index(moviefile)
+        if len(movie_indexes) >= MOVIE_INDEX_CACHE_SIZE:
+            del movie_indexes[next(iter(movie_indexes))] # evict the oldest entry
+        movie_indexes[movie_sha256] = index
+    return index
+
+def seek_frame(cap, *, frame_number, movie_index):
+    """Position cap so that the next cap.read() returns frame_number.
+    Seeks to the closest keyframe at or before frame_number and then grabs (without converting) the frames in between.
+    :raises ValueError: if frame_number is not in the movie.
+    """
+    if not 0 <= frame_number < movie_index['total_frames']:
+        raise ValueError(f"invalid frame_number {frame_number}")
+    keyframes = movie_index['keyframes']
+    keyframe  = keyframes[bisect.bisect_right(keyframes, frame_number)-1]
+    if keyframe > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+    for _ in range(frame_number - keyframe):
+        if not cap.grab():
+            raise ValueError(f"invalid frame_number {frame_number}")
+
+################################################################
+## Movie files.
+## CV2's VideoCapture cannot read from a memory buffer, so movie data has to be in a file.
+## Rather than writing a new temporary file for every request, each movie is written once
+## to a file named by its SHA256, which is shared by every request in this process.
+
+movie_files = {}                # movie_sha256 -> file name
+movie_files_in_use = Counter()  # file name -> number of movie_file_held blocks using it; these are not evicted
+movie_files_lock = threading.Lock()
+
+def movie_file(*, movie_data, movie_sha256=None):
+    """Return the name of a file that contains movie_data, writing it only if this process has not already done so.
+    :param: movie_data - the movie; bytes or any other buffer (e.g. a memoryview or mmap)
+    :param: movie_sha256 - if provided, the SHA256 of movie_data; otherwise it is computed.
+    """
+    if movie_sha256 is None:
+        movie_sha256 = hashlib.sha256(movie_data).hexdigest()
+    with movie_files_lock:
+        fname = movie_files.get(movie_sha256)
+        if (fname is not None) and os.path.exists(fname):
+            return fname
+        os.makedirs(MOVIE_FILE_DIR, exist_ok=True)
+        fname = os.path.join(MOVIE_FILE_DIR, movie_sha256 + C.MOVIE_EXTENSION)
+        if not os.path.exists(fname):
+            # Write to a temporary name and rename, so that other processes never open a partial file
+            with tempfile.NamedTemporaryFile(dir=MOVIE_FILE_DIR, delete=False) as tf:
+                tf.write(movie_data)
+            os.replace(tf.name, fname)
+        if len(movie_files) >= MOVIE_FILE_CACHE_SIZE:
+            # Evict the oldest file that is not in use. If they all are, the cache is briefly larger.
+            for (old_sha256, old_fname) in movie_files.items():
+                if old_fname not in movie_files_in_use:
+                    evict_movie_file(movie_files.pop(old_sha256))
+                    break
+        movie_files[movie_sha256] = fname
+        return fname
+
+@contextmanager
+def movie_file_held(fname):
+    """Context manager that keeps this process from evicting fname while the block runs,
+    for readers (such as parallel_frames) that open the file again by name.
+    """
+    with movie_files_lock:
+        movie_files_in_use[fname] += 1
+    try:
+        yield fname
+    finally:
+        with movie_files_lock:
+            movie_files_in_use[fname] -= 1
+            if movie_files_in_use[fname] <= 0:
+                del movie_files_in_use[fname]
+
+def evict_movie_file(fname):
+    """Remove a movie file. It is first renamed to a name that no reader looks up, so a reader in another
+    process either opens the whole file or finds it missing (and calls movie_file again; see MovieReader.capture).
+    Readers that already have it open can continue to read it. Called with movie_files_lock held.
+    """
+    evicted = f"{fname}.{os.getpid()}.{threading.get_ident()}.evicted"
+    try:
+        os.rename(fname, evicted)
+        os.unlink(evicted)
+    except FileNotFoundError:
+        pass
+
+
+class MovieReader:
+    """Decodes frames from a movie that is provided as a file, as a buffer in memory, or through an ffmpeg pipe.
+    :param: moviefile - decode this file in place.
+    :param: movie_data - decode a buffer (bytes, memoryview or mmap). It is written once to a content-addressed file (see movie_file).
+    :param: movie_sha256 - SHA256 of the movie, if known. Used as the key for the movie index and the movie file.
+    :param: pipe - if True, frames are decoded by an ffmpeg process and read from its stdout, without OpenCV.
+                   If only movie_data is provided, ffmpeg reads it from stdin, so no file is written at all.
+                   This requires a container that can be read sequentially (e.g. an mp4 with its moov atom first).
+    """
+    def __init__(self, *, moviefile=None, movie_data=None, movie_sha256=None, pipe=False):
+        if (moviefile is None) == (movie_data is None):
+            raise ValueError("exactly one of moviefile and movie_data must be provided")
+        if (movie_sha256 is None) and (movie_data is not None):
+            movie_sha256 = hashlib.sha256(movie_data).hexdigest()
+        self.moviefile = moviefile
+        self.movie_data = movie_data
+        self.movie_sha256 = movie_sha256
+        self.pipe = pipe
+        self._index = None
+
+    def filename(self):
+        """Return the name of a file containing the movie"""
+        if self.movie_data is not None:
+            # movie_file checks that the shared file is still there, and writes it again if it was evicted
+            self.moviefile = movie_file(movie_data=self.movie_data, movie_sha256=self.movie_sha256)
+        return self.moviefile
+
+    def index(self):
+        """Return the movie index (see build_movie_index)"""
+        if self._index is None:
+            if self.movie_sha256 is None:
+                self._index = build_movie_index(self.filename())
+            else:
+                self._index = get_movie_index(moviefile=self.filename(), movie_sha256=self.movie_sha256)
+        return self._index
+
+    def capture(self):
+        """Return an opened cv2.VideoCapture for the movie"""
+        cap = cv2.VideoCapture(self.filename())
+        if not cap.isOpened() and self.movie_data is not None:
+            # Another process evicted the shared movie file after we looked it up; write it again
+            cap.release()
+            self.moviefile = movie_file(movie_data=self.movie_data, movie_sha256=self.movie_sha256)
+            cap = cv2.VideoCapture(self.moviefile)
+        return cap
+
+    def read_frame(self, frame_number):
+        """Return frame_number as a CV2 image, seeking to the nearest keyframe
+        :raises ValueError: if frame_number is not in the movie.
+        """
+        if self.pipe:
+            for (_, frame) in self.frames(frame_start=frame_number, frame_end=frame_number):
+                return frame
+            raise ValueError(f"invalid frame_number {frame_number}")
+        cap = self.capture()
+        try:
+            seek_frame(cap, frame_number=frame_number, movie_index=self.index())
+            ret, frame = cap.read()
+        finally:
+            cap.release()
+        if not ret:
+            raise ValueError(f"invalid frame_number {frame_number}")
+        return frame
+
+    def frames(self, *, frame_start=0, frame_end=None, frame_stride=1):
+        """Generator that decodes a range of frames in a single sequential pass.
+        :param: frame_start - first frame to return
+        :param: frame_end - last frame to return (inclusive); None for the end of the movie
+        :param: frame_stride - return every frame_stride'th frame. The others are grabbed but not converted.
+        :return: yields (frame_number, frame) tuples, where frame is a CV2 image
+        """
+        assert frame_stride >= 1
+        if self.pipe:
+            yield from self._pipe_frames(frame_start=frame_start, frame_end=frame_end, frame_stride=frame_stride)
+            return
+        movie_index = self.index()
+        if frame_end is None or frame_end >= movie_index['total_frames']:
+            frame_end = movie_index['total_frames']-1
+        if frame_start > frame_end:
+            return
+        cap = self.capture()
+        try:
+            seek_frame(cap, frame_number=frame_start, movie_index=movie_index)
+            for frame_number in range(frame_start, frame_end+1):
+                if (frame_number - frame_start) % frame_stride != 0:
+                    if not cap.grab():
+                        return
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                yield (frame_number, frame)
+        finally:
+            cap.release()
+
+    def _pipe_frames(self, *, frame_start, frame_end, frame_stride):
+        """Decode with ffmpeg, which writes each frame to stdout as a binary PPM (a short text header followed by RGB pixels)."""
+        if FFMPEG_PATH is None:
+            raise FileNotFoundError("ffmpeg")
+        source = 'pipe:0' if self.moviefile is None else self.moviefile
+        args = ['-hide_banner','-loglevel','error','-i',source,'-f','image2pipe','-vcodec','ppm','pipe:1']
+        with subprocess.Popen([FFMPEG_PATH] + args,
+                              stdin=subprocess.PIPE if self.moviefile is None else subprocess.DEVNULL,
+                              stdout=subprocess.PIPE) as proc:
+            if self.moviefile is None:
+                def feed():
+                    try:
+                        proc.stdin.write(self.movie_data)
+                    except BrokenPipeError:
+                        pass
+                    finally:
+                        proc.stdin.close()
+                threading.Thread(target=feed, daemon=True).start()
+            try:
+                frame_number = 0
+                while frame_end is None or frame_number <= frame_end:
+                    header = [proc.stdout.readline() for _ in range(3)] # P6, width height, maxval
+                    if not header[0]:
+                        break
+                    (width, height) = (int(v) for v in header[1].split())
+                    pixels = proc.stdout.read(width*height*3)
+                    if len(pixels) < width*height*3:
+                        break
+                    if frame_number >= frame_start and (frame_number - frame_start) % frame_stride == 0:
+                        rgb = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
+                        yield (frame_number, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+                    frame_number += 1
+            finally:
+                proc.kill()
+
+    def metadata(self):
+        """Return the movie metadata without decoding the whole movie.
+        The frame count comes from the movie index, which is built from the packets without decoding them.
+        It is checked against the frame count in the container's header. Only if the two disagree
+        (or the index is empty) are the frames decoded and counted.
+        """
+        movie_index = self.index()
+        cap = self.capture()
+        try:
+            # Decode the first frame, to make sure that the movie is readable
+            total_frames = 0
+            ret, frame = cap.read()
+            if ret:
+                if len(frame)==0:
+                    raise MovieCorruptError()
+                total_frames = movie_index['total_frames']
+                header_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                if total_frames==0 or total_frames!=header_frames:
+                    logging.info("index reports %s frames but header reports %s; counting frames",total_frames,header_frames)
+                    total_frames = 1
+                    while True:
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                        if len(frame)==0:
+                            raise MovieCorruptError()
+                        total_frames += 1
+                    movie_index['total_frames'] = total_frames
+            total_bytes = len(self.movie_data) if self.movie_data is not None else os.path.getsize(self.moviefile)
+            return {'total_frames':total_frames,
+                    'total_bytes':total_bytes,
+                    'width':int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    'height':int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    'fps':cap.get(cv2.CAP_PROP_FPS)}
+        finally:
+            cap.release()
+
+
+def extract_movie_metadata(*, movie_data, movie_sha256=None):
+    """Use OpenCV to get the movie metadata without decoding the whole movie. See MovieReader.metadata()
+    :param: movie_data - binary object of data
+    :param: movie_sha256 - if provided, the SHA256 of movie_data; otherwise it is computed.
+    """
+    return MovieReader(movie_data=movie_data, movie_sha256=movie_sha256).metadata()
+
+def extract_frame(*, movie_data, frame_number, fmt, movie_sha256=None):
+    """Extract a frame from movie data using CV2. Uses the movie index to seek to the nearest keyframe,
+    so only the frames between that keyframe and frame_number are decoded.
     :param: movie_data - binary object of data
     :param: frame_number - frame to extract
     :param: fmt - format wanted. CV2-return a CV2 image; 'jpeg' - return a jpeg image as a byte array.
+    :param: movie_sha256 - if provided, the SHA256 of movie_data (the key for the movie index); otherwise it is computed.
     """
     assert fmt in ['CV2','jpeg']
-    # CV2's VideoCapture method does not support reading from a memory buffer.
-    # So perhaps we will change this to use a named pipe
-    with tempfile.NamedTemporaryFile(mode='ab') as tf:
-        tf.write(movie_data)
-        tf.flush()
-        cap = cv2.VideoCapture(tf.name)
-
-    # skip to frame_number (first frame is #0)
-    for fn in range(frame_number+1):
-        ret, frame = cap.read()
-        if not ret:
-            raise ValueError(f"invalid frame_number {frame_number}")
-        if fn==frame_number:
-            if fmt=='CV2':
-                return frame
-            elif fmt=='jpeg':
-                return convert_frame_to_jpeg(frame)
-            else:
-                raise ValueError("Invalid fmt: "+fmt)
-    raise ValueError(f"invalid frame_number {frame_number}")
+    frame = MovieReader(movie_data=movie_data, movie_sha256=movie_sha256).read_frame(frame_number)
+    if fmt=='CV2':
+        return frame
+    return convert_frame_to_jpeg(frame)
+
+def extract_frames(*, movie_data, frame_start=0, frame_end=None, frame_stride=1, fmt='jpeg', movie_sha256=None):
+    """Generator that extracts a range of frames from movie data in a single sequential decoding pass.
+    :param: movie_data - binary object of data
+    :param: frame_start - first frame to extract
+    :param: frame_end - last frame to extract (inclusive); None for the end of the movie
+    :param: frame_stride - extract every frame_stride'th frame
+    :param: fmt - CV2 or jpeg (see extract_frame)
+    :return: yields (frame_number, frame) tuples
+    """
+    assert fmt in ['CV2','jpeg']
+    reader = MovieReader(movie_data=movie_data, movie_sha256=movie_sha256)
+    for (frame_number, frame) in reader.frames(frame_start=frame_start, frame_end=frame_end, frame_stride=frame_stride):
+        yield (frame_number, frame if fmt=='CV2' else convert_frame_to_jpeg(frame))
 
 def cleanup_mp4(*,infile,outfile):
     """Given an import file, clean it up with ffmpeg"""
@@ -159,95 +579,342 @@ def cleanup_mp4(*,infile,outfile):
     subprocess.call([ FFMPEG_PATH ] + args)
 
 
-def render_tracked_movie(*, moviefile_input, moviefile_output, movie_trackpoints):
-    # Create a VideoWriter object to save the output video to a temporary file (which we will then transcode with ffmpeg)
-    # movie_trackpoints is an array of records where each has the form:
-    # {'x': 152.94203, 'y': 76.80803, 'status': 1, 'err': 0.08736111223697662, 'label': 'mypoint', 'frame_number': 189}
+def webvtt_timestamp(seconds):
+    """Format seconds as a WebVTT timestamp (HH:MM:SS.mmm)"""
+    msec = int(round(seconds * 1000))
+    return f"{msec // 3_600_000:02}:{msec // 60_000 % 60:02}:{msec // 1000 % 60:02}.{msec % 1000:03}"
 
+def trackpoints_to_webvtt(movie_trackpoints, *, fps):
+    """Generator that turns the trackpoints of a movie into a WebVTT metadata track.
+    Each frame with trackpoints becomes a cue that lasts for the frame, whose identifier is the frame number
+    and whose payload is a JSON list of {label, x, y}. A player can load this with <track kind='metadata'>
+    and draw the points over the original movie, so showing a tracked movie needs no video encoding.
+    :param: movie_trackpoints - array of dicts with frame_number, label, x and y, sorted by frame_number
+    :param: fps - frames per second of the movie
+    :return: yields the track, a cue at a time
+    """
+    yield "WEBVTT\n\n"
+    for (frame_number, tps) in itertools.groupby(movie_trackpoints, key=lambda tp: tp['frame_number']):
+        points = [{'label':tp['label'], 'x':tp['x'], 'y':tp['y']} for tp in tps]
+        yield (f"{frame_number}\n"
+               f"{webvtt_timestamp(frame_number / fps)} --> {webvtt_timestamp((frame_number + 1) / fps)}\n"
+               f"{json.dumps(points, separators=(',',':'))}\n\n")
+
+
+RENDER_PRESET = 'veryfast'      # x264 preset used when rendering tracked movies
+RENDER_CRF = 23                 # x264 constant rate factor; lower is better quality and larger files
+RENDER_PREVIEW_HEIGHT = 360     # height of the frames in preview renders
+
+def render_tracked_movie(*, moviefile_input, moviefile_output, movie_trackpoints,
+                         preset=RENDER_PRESET, crf=RENDER_CRF, preview=False):
+    """Render the movie with the trackpoints and frame numbers drawn on each frame.
+    The labeled frames are piped as raw video to a single ffmpeg process that encodes them with h264,
+    so there is only one encode and no temporary file.
+    :param: moviefile_input - the movie to render
+    :param: moviefile_output - where to write the rendered mp4. It will be overwritten.
+    :param: movie_trackpoints - an array of records where each has the form:
+      {'x': 152.94203, 'y': 76.80803, 'status': 1, 'err': 0.08736111223697662, 'label': 'mypoint', 'frame_number': 189}
+    :param: preset - x264 preset
+    :param: crf - x264 constant rate factor
+    :param: preview - if True, render at RENDER_PREVIEW_HEIGHT lines, which is much faster
+    """
+    if FFMPEG_PATH is None:
+        raise FileNotFoundError("ffmpeg")
     cap = cv2.VideoCapture(moviefile_input)
-    ret, current_frame_data = cap.read()
-    # Get video properties
     width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS)
+    fps    = cap.get(cv2.CAP_PROP_FPS) or 30
+
+    # h264 with yuv420p needs even dimensions
+    scale = RENDER_PREVIEW_HEIGHT / height if preview and height > RENDER_PREVIEW_HEIGHT else 1
+    out_width  = int(width * scale) & ~1
+    out_height = int(height * scale) & ~1
 
     logging.info("start movie rendering")
     trackpoints_by_frame = defaultdict(list)
     for tp in movie_trackpoints:
-        trackpoints_by_frame[tp['frame_number']].append(tp)
+        trackpoints_by_frame[tp['frame_number']].append({**tp, 'x':tp['x']*scale, 'y':tp['y']*scale})
+
+    args = ['-y','-hide_banner','-loglevel','error',
+            '-f','rawvideo','-pix_fmt','bgr24','-s',f'{out_width}x{out_height}','-r',str(fps),'-i','pipe:0',
+            '-an','-vcodec','libx264','-preset',preset,'-crf',str(crf),'-pix_fmt','yuv420p',
+            '-movflags','+faststart',moviefile_output]
+    with subprocess.Popen([FFMPEG_PATH] + args, stdin=subprocess.PIPE) as proc:
+        try:
+            for frame_number in itertools.count():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if (frame.shape[1], frame.shape[0]) != (out_width, out_height):
+                    frame = cv2.resize(frame, (out_width, out_height), interpolation=cv2.INTER_AREA)
+                cv2_label_frame(frame=frame, trackpoints=trackpoints_by_frame[frame_number], frame_label=frame_number)
+                proc.stdin.write(frame.tobytes())
+        finally:
+            cap.release()
+            proc.stdin.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with status {proc.returncode} rendering {moviefile_output}")
+    logging.info("rendered movie")
 
-    with tempfile.NamedTemporaryFile(suffix='.mp4') as tf:
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(tf.name, fourcc, fps, (width, height))
 
-        for frame_number in range(1_000_000):
-            ret, current_frame_data = cap.read()
+################################################################
+## Parallel decoding.
+## Optical flow has to be computed one frame after another, but decoding and grayscale
+## conversion do not. The movie is split into segments, each of which a worker decodes on its own
+## by seeking to the keyframe at or before the segment. A pool of processes decodes the segments
+## ahead of the tracker, which consumes the frames in order.
+## A decoded segment is sent back to the tracker as a whole, so segments are at most
+## TRACK_SEGMENT_MAX_FRAMES long, and at most workers*TRACK_IN_FLIGHT_PER_WORKER segments are in flight.
+
+TRACK_SEGMENTS_PER_WORKER = 4       # segments per worker, so that the workers stay busy
+TRACK_IN_FLIGHT_PER_WORKER = 2      # segments decoded ahead of the tracker, per worker
+TRACK_SEGMENT_MAX_FRAMES = 120      # longer keyframe intervals are split; each piece re-decodes from the keyframe
+
+# Retracking stops once the new trajectory has been within TRACK_CONVERGE_TOLERANCE pixels of the stored one
+# for TRACK_CONVERGE_FRAMES frames in a row; from there on the stored trajectory is what tracking would produce.
+TRACK_CONVERGE_TOLERANCE = 0.5
+TRACK_CONVERGE_FRAMES = 3
+
+def movie_segments(movie_index, *, target_segments):
+    """Split a movie into segments that begin at keyframes where possible.
+    Adjacent keyframe intervals are merged, so that there are about target_segments segments,
+    and segments longer than TRACK_SEGMENT_MAX_FRAMES are split.
+    :return: list of (first_frame, last_frame) tuples
+    """
+    total_frames = movie_index['total_frames']
+    min_length = max(1, total_frames // max(1, target_segments))
+    starts = []
+    for keyframe in movie_index['keyframes']:
+        if keyframe >= total_frames:
+            break
+        if not starts or keyframe - starts[-1] >= min_length:
+            starts.append(keyframe)
+    return [(first, min(first+TRACK_SEGMENT_MAX_FRAMES, last)-1)
+            for (start, last) in zip(starts, starts[1:] + [total_frames])
+            for first in range(start, last, TRACK_SEGMENT_MAX_FRAMES)]
+
+def decode_segment(moviefile, first_frame, last_frame, keyframes):
+    """Decode frames first_frame..last_frame. This runs in a worker process.
+    :param: keyframes - the movie's keyframes, used to seek to first_frame
+    :return: list of (frame, gray) tuples. It is shorter than the segment if a frame cannot be decoded.
+    :raises FileNotFoundError: if the movie cannot be opened.
+    """
+    cap = cv2.VideoCapture(moviefile)
+    try:
+        if not cap.isOpened():
+            raise FileNotFoundError(moviefile)
+        seek_frame(cap, frame_number=first_frame, movie_index={'keyframes':keyframes, 'total_frames':last_frame+1})
+        decoded = []
+        for _ in range(first_frame, last_frame+1):
+            ret, frame = cap.read()
             if not ret:
                 break
-
-            # Label the output and write it
-            cv2_label_frame(frame=current_frame_data, trackpoints=trackpoints_by_frame[frame_number], frame_label=frame_number)
-            out.write(current_frame_data)
-
+            decoded.append((frame, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+        return decoded
+    finally:
         cap.release()
-        out.release()
-
-        # Finally, use ffmpeg to transcode the output to a proper mp4 file (This shouldn't be necessary)
-        cleanup_mp4(infile=tf.name, outfile=moviefile_output)
-    logging.info("rendered movie")
 
+def sequential_frames(moviefile, *, frame_start=0, movie_index=None):
+    """Generator that yields (frame_number, frame, None) for every frame of a movie from frame_start.
+    :param: movie_index - used to seek to frame_start; built if it is needed and not provided
+    :raises ValueError: if frame_start is not in the movie.
+    :raises FileNotFoundError: if the movie cannot be opened.
+    """
+    cap = cv2.VideoCapture(moviefile)
+    try:
+        if not cap.isOpened():
+            raise FileNotFoundError(moviefile)
+        if frame_start > 0:
+            seek_frame(cap, frame_number=frame_start, movie_index=movie_index or build_movie_index(moviefile))
+        frame_number = frame_start
+        while True:
+            result, frame = cap.read()
+            if not result:
+                return
+            yield (frame_number, frame, None)
+            frame_number += 1
+    finally:
+        cap.release()
 
-def track_movie(*, engine_name, engine_version=None, moviefile_input, input_trackpoints, frame_start=0, callback=None):
+def parallel_frames(moviefile, *, workers, frame_start=0, movie_index=None):
+    """Return a generator that yields (frame_number, frame, gray) for every frame of a movie from frame_start,
+    decoded by a pool of processes.
+    :raises OSError: if a process pool cannot be created. (AWS Lambda has no /dev/shm, so this happens there.)
+    :raises ValueError: if frame_start is not in the movie.
+    """
+    movie_index = movie_index or build_movie_index(moviefile)
+    if frame_start > 0 and not frame_start < movie_index['total_frames']:
+        raise ValueError(f"invalid frame_number {frame_start}")
+    # Workers are spawned rather than forked, because OpenCV's thread pool does not survive a fork.
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    segments = [(first, last) for (first, last)
+                in movie_segments(movie_index, target_segments=workers*TRACK_SEGMENTS_PER_WORKER)
+                if last >= frame_start]
+    keyframes = movie_index['keyframes']
+
+    def frames():
+        with pool:
+            pending = deque()
+            todo = iter(segments)
+            for (first, last) in itertools.islice(todo, workers*TRACK_IN_FLIGHT_PER_WORKER):
+                pending.append((first, last, pool.submit(decode_segment, moviefile, first, last, keyframes)))
+            while pending:
+                (first, last, future) = pending.popleft()
+                for (next_first, next_last) in itertools.islice(todo, 1):
+                    pending.append((next_first, next_last, pool.submit(decode_segment, moviefile, next_first, next_last, keyframes)))
+                decoded = future.result()
+                for (i, (frame, gray)) in enumerate(decoded):
+                    if first+i >= frame_start:   # the first segment starts at the keyframe before frame_start
+                        yield (first+i, frame, gray)
+                # The segments come from the movie index, so every frame in them should decode.
+                # A short segment means that the file changed or is corrupt; tracking must not end early without saying so.
+                if len(decoded) < last-first+1:
+                    for (_, _, f) in pending:
+                        f.cancel()
+                    raise MovieCorruptError(f"decoded {len(decoded)} of frames {first}..{last} of {moviefile}")
+    return frames()
+
+def converged(new_points, stored_points, tolerance):
+    """Return True if every point is within tolerance pixels of the stored point, and the same points are missing"""
+    new_missing = np.isnan(new_points[:, 0, 0])
+    stored_missing = np.isnan(stored_points[:, 0, 0])
+    if not np.array_equal(new_missing, stored_missing):
+        return False
+    found = ~new_missing
+    return bool(np.all(np.abs(new_points[found] - stored_points[found]) <= tolerance))
+
+def track_movie(*, engine_name, engine_version=None, moviefile_input, input_trackpoints, frame_start=0, callback=None, output='dicts',
+                workers=None, movie_sha256=None, converge_tolerance=None):
     """
     Summary - takes in a movie(cap) and returns annotatted movie with red dots on all the trackpoints.
     Draws frame numbers on each frame
-    :param: engine - the engine to use. CV2 is the only supported engine at the moment.
+    :param: engine_name, engine_version - the engine to use (see get_engine). None selects the default.
     :param: moviefile_input  - file name of an MP4 to track. Must not be annotated. CV2 cannot read movies from memory; this is a known problem.
     :param: trackpoints - a list of dictionaries {'x', 'y', 'label', 'frame_number'} to track.  Those before frame_start will be copied to the output.
-    :param: frame_start - the frame to start tracking out (frames 0..(frame_start-1) are just copied to output)
-    :param: callback - a function to callback with (*, frame_number, jpeg, trackpoints)
-    :return: dict 'output_trackpoints' = [frame][pt#][0], [frame][pt#][1]
+    :param: frame_start - the frame to start tracking out (frames 0..(frame_start-1) are just copied to output).
+                          Decoding seeks to frame_start, so the frames before it are not decoded and the callback is not called for them.
+    :param: callback - a function to callback with (*, frame_number, frame, output_trackpoints)
+    :param: output - 'dicts' or 'arrays'
+    :param: workers - if more than 1, frames are decoded by this many processes (see parallel_frames).
+                      Falls back to decoding in this process if a process pool cannot be created.
+    :param: movie_sha256 - if provided, the movie index used to seek to frame_start is cached under it
+    :param: converge_tolerance - if provided, tracking stops once the tracked points have been within this many pixels
+                      of the input_trackpoints after frame_start for TRACK_CONVERGE_FRAMES frames in a row.
+                      The input_trackpoints of the remaining frames are copied to the output. If they end before
+                      the last frame of the movie, tracking resumes from the last frame that has input_trackpoints.
+    :return: if output=='dicts': dict 'output_trackpoints' = list of dicts {'x', 'y', 'label', 'frame_number'}
+             if output=='arrays': dict 'labels' = the label of each point, in the order of first appearance in input_trackpoints
+                                       'points' = float32 array of shape (frames, labels, 2); NaN where a point was not found.
+                                  Use trackpoints_from_arrays() to get dicts.
+             In both cases 'last_tracked_frame' is the last frame that was tracked rather than copied.
 
     Note - no longer renders the tracked movie. That's now in render_tracked_movie()
 
     """
-    if engine_name!=Engines.CV2:
-        raise RuntimeError(f"Engine_name={engine_name} engine_version={engine_version} but this only runs with CV2")
-
-    cap = cv2.VideoCapture(moviefile_input)
-    frame_this = None
-
-    # should be movie name + tracked
-
-    # Create a VideoWriter object to save the output video to a temporary file (which we will then transcode with ffmpeg)
-    logging.info("start movie tracking")
-    output_trackpoints = []
-    for frame_number in range(1_000_000):
-        frame_prev = frame_this
-        result, frame_this = cap.read()
-        if not result:
-            break
-
-        # Copy over the trackpoints for the current frame if this was previously tracked or is the first frame to track
-        # This also copies over frame_prev at start (when frame_number=0 and frame_start=0, it is <= frame_start)
-        if frame_number <= frame_start:
-            current_trackpoints = [tp for tp in input_trackpoints if tp['frame_number']==frame_number]
-
-        # If this is after the starting frame, then track it
-        # This is run the second time
-        if frame_number > frame_start:
-            assert frame_prev is not None
-            current_trackpoints = cv2_track_frame(frame_prev=frame_prev, frame_this=frame_this, trackpoints=current_trackpoints)
-
-        # Add the trackpionts to the output list, giving each a frame number
-        output_trackpoints.extend( [ {**tp, **{'frame_number':frame_number}} for tp in current_trackpoints] )
-
-        # Call the callback if we have one
-        if callback is not None:
-            callback(frame_number=frame_number, frame=frame_this, output_trackpoints=output_trackpoints)
-
-    cap.release()
-    return {'output_trackpoints':output_trackpoints}
+    engine = get_engine(engine_name=engine_name, engine_version=engine_version)
+    assert output in ['dicts','arrays']
+
+    labels = list(dict.fromkeys(tp['label'] for tp in input_trackpoints))
+    input_by_frame = defaultdict(list)
+    for tp in input_trackpoints:
+        input_by_frame[tp['frame_number']].append(tp)
+    point_tracker = engine.new_tracker()
+
+    output_points = []          # one (labels,1,2) array per frame
+    output_trackpoints = []     # only used for output=='dicts'
+    def copy_input(frame_number):
+        """Copy the input trackpoints of a frame to the output"""
+        output_points.append(trackpoints_to_array(input_by_frame[frame_number], labels))
+        if output=='dicts':
+            output_trackpoints.extend( [ {**tp, **{'frame_number':frame_number}} for tp in input_by_frame[frame_number]] )
+
+    # The frames before frame_start are not decoded
+    for frame_number in range(0, frame_start):
+        copy_input(frame_number)
+
+    movie_index = None
+    if frame_start > 0:
+        movie_index = (get_movie_index(moviefile=moviefile_input, movie_sha256=movie_sha256) if movie_sha256
+                       else build_movie_index(moviefile_input))
+    # parallel_frames opens the movie again for each segment, so it must not be evicted while it is tracked
+    with movie_file_held(moviefile_input):
+        frames = None
+        if workers is not None and workers > 1:
+            try:
+                frames = parallel_frames(moviefile_input, workers=workers, frame_start=frame_start, movie_index=movie_index)
+            except OSError as e:
+                logging.warning("cannot decode in parallel (%s); decoding sequentially",e)
+        if frames is None:
+            frames = sequential_frames(moviefile_input, frame_start=frame_start, movie_index=movie_index)
+
+        logging.info("start movie tracking at frame %s",frame_start)
+        points = None
+        last_tracked_frame = None
+        converged_frames = 0
+        resume_frame = None         # after converging, the frame whose copied trackpoints tracking resumes from
+        for (frame_number, frame_this, gray_this) in frames:
+
+            # The frames up to resume_frame were copied from the input. Tracking resumes from its trackpoints.
+            if resume_frame is not None:
+                if frame_number == resume_frame:
+                    points = output_points[-1]
+                    point_tracker.set_frame(frame_this, gray_this)
+                    resume_frame = None
+                continue
+
+            # Tracking starts from the trackpoints of frame_start, so it is the first frame converted to grayscale
+            if frame_number == frame_start:
+                copy_input(frame_number)
+                points = output_points[-1]
+                point_tracker.set_frame(frame_this, gray_this)
+
+            # If this is after the starting frame, then track it
+            else:
+                points, err = point_tracker.track(frame_this, points, gray_this)
+                output_points.append(points)
+                if output=='dicts':
+                    output_trackpoints.extend( [ {'x':float(points[i][0][0]), 'y':float(points[i][0][1]),
+                                                  'status':1, 'err':float(err[i]),
+                                                  'label':label, 'frame_number':frame_number}
+                                                 for (i,label) in enumerate(labels) if not np.isnan(err[i])] )
+            last_tracked_frame = frame_number
+
+            # Call the callback if we have one
+            if callback is not None:
+                callback(frame_number=frame_number, frame=frame_this,
+                         output_trackpoints=output_trackpoints if output=='dicts' else points)
+
+            # Stop once the new trajectory is the stored one
+            if converge_tolerance is not None and frame_number > frame_start and input_by_frame[frame_number]:
+                if converged(points, trackpoints_to_array(input_by_frame[frame_number], labels), converge_tolerance):
+                    converged_frames += 1
+                else:
+                    converged_frames = 0
+                if converged_frames >= TRACK_CONVERGE_FRAMES:
+                    logging.info("tracking converged with the stored trackpoints at frame %s",frame_number)
+                    last_input_frame = max(input_by_frame)
+                    for copy_frame in range(frame_number+1, last_input_frame+1):
+                        copy_input(copy_frame)
+                    if movie_index is None:
+                        movie_index = (get_movie_index(moviefile=moviefile_input, movie_sha256=movie_sha256) if movie_sha256
+                                       else build_movie_index(moviefile_input))
+                    if last_input_frame >= movie_index['total_frames']-1:
+                        break
+                    logging.info("resuming tracking after the stored trackpoints at frame %s",last_input_frame)
+                    if last_input_frame > frame_number:
+                        resume_frame = last_input_frame
+                    converged_frames = 0
+        frames.close()          # stop the decoding processes before the file can be evicted
+
+    ret = {'last_tracked_frame':last_tracked_frame}
+    if output=='arrays':
+        ret['labels'] = labels
+        # The number of frames is given, because with no labels every array is empty
+        ret['points'] = (np.stack(output_points).reshape(len(output_points), len(labels), 2) if output_points
+                         else np.zeros((0, len(labels), 2), dtype=np.float32))
+        return ret
+    ret['output_trackpoints'] = output_trackpoints
+    return ret
 
 
 def pixels_to_mm(x1, y1, x2, y2, straight_line_distance_mm):
@@ -269,12 +936,15 @@ if __name__ == "__main__":
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('--engine',default='CV2')
+    parser.add_argument('--engine_version',help='engine version; default is the default version of the engine',
+                        choices=sorted(set(version for (_,version) in ENGINES)))
     parser.add_argument(
         "--moviefile", default='tests/data/2019-07-12 circumnutation.mp4', help='mpeg4 file')
     parser.add_argument(
         "--points_to_track", default='[{"x":138,"y":86,"label":"mypoint"}]',
         help="list of points to track as json 2D array.")
     parser.add_argument('--outfile',default='tracked_output.mp4')
+    parser.add_argument('--preview', help='render a reduced-resolution movie', action='store_true')
     args = parser.parse_args()
 
     # Get the trackpoints
@@ -284,10 +954,11 @@ if __name__ == "__main__":
 
     # Get the new trackpoints
     res = track_movie(engine_name=args.engine,
+                      engine_version=args.engine_version,
                       moviefile_input=args.moviefile,
                       input_trackpoints=input_trackpoints)
     # Now render the movie
     print("results:")
-    render_tracked_movie( moviefile_input= args.moviefile, moviefile_output='tracked.mp4',
-                          movie_trackpoints=res['output_trackpoints'])
-    subprocess.call(['open','tracked.mp4'])
+    render_tracked_movie( moviefile_input= args.moviefile, moviefile_output=args.outfile,
+                          movie_trackpoints=res['output_trackpoints'], preview=args.preview)
+    subprocess.call(['open',args.outfile])